@@ -5,56 +5,347 @@ import os
 import base64
 import tempfile
 import streamlit as st
-import gdown
 import re
 import cloudscraper
 import json
+import uuid
 import urllib.parse
 import datetime
 import requests 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 import subprocess
 import gc  # נוסף לטובת ניקוי זיכרון RAM אגרסיבי
+import multiprocessing
+import queue
+import hashlib
+import shutil
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+try:
+    import resource
+except ImportError:  # לא קיים ב-Windows
+    resource = None
+
+import grayscale
 
 # מונע מ-OpenCV לפתוח תהליכים מקבילים שגורמים ל-Segmentation fault בשרתים מוגבלים
 cv2.setNumThreads(1)
 
 # --- הגדרות מערכת ---
 DEFAULT_START_ID = 72680
-AUTO_REGULAR_PDF = "auto_regular_document.pdf"
-AUTO_REGULAR_BW_PDF = "auto_regular_document_bw.pdf" 
-AUTO_CUT_PDF = "auto_cut_document.pdf"
-AUTO_CUT_BW_PDF = "auto_cut_document_bw.pdf" 
+# מאגר התוצרים: כל מסמך מעובד נשמר בתיקייה לפי hash של המקור (ראו result_cache_key)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "result_cache")
+# המצביע לגיליון האוטומטי הנוכחי מוחלף אטומית כשגיליון חדש מוכן
+AUTO_CURRENT_FILE = os.path.join(RESULT_CACHE_DIR, ".auto_current.json")
+AUTO_LOCK_FILE = os.path.join(RESULT_CACHE_DIR, ".auto_build.lock")
+AUTO_POLL_SECONDS = int(os.environ.get("AUTO_POLL_SECONDS", "600"))
+
+@st.cache_resource
+def _process_state():
+    """
+    Streamlit מריץ את הקובץ כמודול חדש בכל אינטראקציה, כך שמשתנה גלובלי רגיל נוצר מחדש בכל ריצה.
+    מנעולים, מטמונים ותורים שצריכים להיות משותפים לכל הסשנים בתהליך נשמרים כאן.
+    """
+    return {"lock": threading.Lock()}
+
+def process_shared(name, factory):
+    """האובייקט המשותף בשם name, שנוצר ב-factory() בפעם הראשונה בתהליך"""
+    state = _process_state()
+    with state["lock"]:
+        if name not in state:
+            state[name] = factory()
+        return state[name]
+
+# --- מדידת ביצועים ---
+
+# לאן נכתבים אירועי המדידה כשורות JSON: "off" (ברירת מחדל), "stdout" או נתיב לקובץ.
+# גם כשהיומן כבוי האירועים נשמרים בזיכרון ללוח הניטור; PROFILE_LOG=stdout מיועד לדיבוג ולמדידות
+PROFILE_LOG = os.environ.get("PROFILE_LOG", "off")
+# לוח הניטור מוצג כש-PROFILE_ADMIN=1, או בכתובת ?admin=<ADMIN_KEY> כשהמפתח מוגדר ב-secrets
+PROFILE_ADMIN = os.environ.get("PROFILE_ADMIN", "0") == "1"
+_PROFILE_EVENTS = process_shared("profile_events", lambda: deque(maxlen=2000))
+_PROFILE_LOCK = process_shared("profile_lock", threading.Lock)
+# בתהליך עבודה מהתור: פונקציה שמעבירה כל אירוע לתהליך הראשי (ללוח הניטור ולהצגת ההתקדמות)
+_PROFILE_SINK = None
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return round(int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20, 1)
+    except (OSError, ValueError, IndexError):
+        return None
+
+# השיא של כל שלב נדגם ברקע בפרק הזמן הזה (בנוסף לתחילת השלב ולסופו)
+PROFILE_RSS_SAMPLE_SECONDS = 0.05
+# שלב פעיל -> ה-RSS הגבוה ביותר שנדגם מאז שהתחיל
+_RSS_WATCHES = process_shared("rss_watches", dict)
+_RSS_WATCH_LOCK = process_shared("rss_watch_lock", threading.Lock)
+_RSS_SAMPLER = process_shared("rss_sampler", dict)
+
+def _rss_sampler_loop():
+    while True:
+        time.sleep(PROFILE_RSS_SAMPLE_SECONDS)
+        if not _RSS_WATCHES:
+            continue
+        rss = _rss_mb()
+        if rss is None:
+            return
+        with _RSS_WATCH_LOCK:
+            for token, peak in _RSS_WATCHES.items():
+                if rss > peak:
+                    _RSS_WATCHES[token] = rss
+
+def _start_rss_watch():
+    """מתחיל לעקוב אחרי שיא ה-RSS של התהליך; מחזיר (אסימון, RSS בהתחלה)"""
+    rss = _rss_mb()
+    token = object()
+    with _RSS_WATCH_LOCK:
+        _RSS_WATCHES[token] = rss or 0.0
+        # תהליכון הדגימה לא עובר ב-fork, ולכן נבדק לפי מזהה התהליך
+        if rss is not None and _RSS_SAMPLER.get("pid") != os.getpid():
+            _RSS_SAMPLER["pid"] = os.getpid()
+            threading.Thread(target=_rss_sampler_loop, name="rss-sampler", daemon=True).start()
+    return token, rss
+
+def _stop_rss_watch(token):
+    """מחזיר (RSS עכשיו, השיא מאז _start_rss_watch) ומפסיק לעקוב"""
+    rss = _rss_mb()
+    with _RSS_WATCH_LOCK:
+        peak = _RSS_WATCHES.pop(token, 0.0)
+    if rss is None:
+        return None, None
+    return rss, max(peak, rss)
+
+def _resource_snapshot():
+    """זמן מעבד של התהליכון הנוכחי ושל תהליכי הבן (gs, עובדי סריקה), ושיא הזיכרון לאורך חיי התהליך"""
+    snapshot = {"cpu": time.thread_time(), "child_cpu": 0.0, "peak_rss_mb": None, "child_peak_rss_mb": None}
+    if resource:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        snapshot["child_cpu"] = children.ru_utime + children.ru_stime
+        # ב-Linux ru_maxrss נמדד ב-KB
+        snapshot["peak_rss_mb"] = round(own.ru_maxrss / 1024, 1)
+        snapshot["child_peak_rss_mb"] = round(children.ru_maxrss / 1024, 1)
+    return snapshot
+
+def record_profile_event(event):
+    event = {"ts": datetime.datetime.now().isoformat(timespec="milliseconds"), "pid": os.getpid(), **event}
+    if _PROFILE_SINK:
+        _PROFILE_SINK(event)
+    with _PROFILE_LOCK:
+        _PROFILE_EVENTS.append(event)
+        if PROFILE_LOG == "off":
+            return
+        line = json.dumps({"profile": event}, ensure_ascii=False, default=str)
+        if PROFILE_LOG == "stdout":
+            print(line, flush=True)
+        else:
+            with open(PROFILE_LOG, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+@contextmanager
+def profile_stage(stage, **fields):
+    """
+    מודד שלב: זמן אמת, זמן מעבד (כולל תהליכי בן) וזיכרון - RSS בסוף השלב (rss_mb), השיא שנדגם
+    במהלכו (peak_rss_mb) והגידול ביחס לתחילתו (peak_growth_mb). ה-RSS הוא של כל התהליך, כך ששלבים
+    שרצים במקביל רואים גם את הזיכרון זה של זה. maxrss_growth_mb נרשם רק כשהשלב קבע שיא חדש לתהליך.
+    מחזיר מילון שהשלב יכול להוסיף אליו שדות (מספר עמודים, פגיעה במטמון וכו').
+    """
+    record = {"stage": stage, **fields}
+    before = _resource_snapshot()
+    watch, rss_start = _start_rss_watch()
+    wall_start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        after = _resource_snapshot()
+        record["wall_s"] = round(time.perf_counter() - wall_start, 4)
+        record["cpu_s"] = round(after["cpu"] - before["cpu"], 4)
+        child_cpu = after["child_cpu"] - before["child_cpu"]
+        if child_cpu > 0:
+            record["child_cpu_s"] = round(child_cpu, 4)
+        record["rss_mb"], record["peak_rss_mb"] = _stop_rss_watch(watch)
+        if rss_start is not None and record["peak_rss_mb"] is not None:
+            record["peak_growth_mb"] = round(record["peak_rss_mb"] - rss_start, 1)
+        if after["peak_rss_mb"] is not None and after["peak_rss_mb"] > before["peak_rss_mb"]:
+            record["maxrss_growth_mb"] = round(after["peak_rss_mb"] - before["peak_rss_mb"], 1)
+        if after["child_peak_rss_mb"] != before["child_peak_rss_mb"]:
+            record["child_peak_rss_mb"] = after["child_peak_rss_mb"]
+        record_profile_event(record)
+
+def profile_summary():
+    """סיכום לפי שלב: מספר הרצות, ממוצע, p95 ומקסימום זמן, שיא זיכרון והגידול הגדול ביותר בזיכרון"""
+    with _PROFILE_LOCK:
+        events = list(_PROFILE_EVENTS)
+    by_stage = {}
+    for event in events:
+        by_stage.setdefault(event["stage"], []).append(event)
+    summary = []
+    for stage, stage_events in sorted(by_stage.items()):
+        walls = np.array([e.get("wall_s", 0.0) for e in stage_events])
+        peaks = [e["peak_rss_mb"] for e in stage_events if e.get("peak_rss_mb") is not None]
+        growths = [e["peak_growth_mb"] for e in stage_events if e.get("peak_growth_mb") is not None]
+        summary.append({
+            "stage": stage,
+            "count": len(stage_events),
+            "errors": sum(1 for e in stage_events if "error" in e),
+            "mean_s": round(float(walls.mean()), 4),
+            "p95_s": round(float(np.percentile(walls, 95)), 4),
+            "max_s": round(float(walls.max()), 4),
+            "cpu_s": round(sum(e.get("cpu_s", 0.0) + e.get("child_cpu_s", 0.0) for e in stage_events), 4),
+            "peak_rss_mb": max(peaks) if peaks else None,
+            "max_growth_mb": max(growths) if growths else None,
+        })
+    return summary, events
 
 # --- פונקציות מסד נתונים וזמן ---
 
-@st.cache_data(ttl=600) 
-def get_config():
-    """שולף את הנתונים ממסד הנתונים בענן (JSONBin)"""
+# עותק מקומי של ההגדרות: האפליקציה ממשיכה לעבוד ממנו גם כש-JSONBin איטי או לא זמין
+CONFIG_CACHE_FILE = os.path.join(RESULT_CACHE_DIR, ".config.json")
+JSONBIN_BASE_URL = os.environ.get("JSONBIN_BASE_URL", "https://api.jsonbin.io/v3/b")
+CONFIG_REFRESH_SECONDS = 600
+CONFIG_TIMEOUT = (3, 10)
+CONFIG_WRITE_RETRIES = 5
+
+_config_session = process_shared("config_session", requests.Session)
+_config_lock = process_shared("config_lock", threading.Lock)
+# record: ההגדרות האחרונות; fetched_at: מתי נמשכו מהענן; dirty: יש שינוי שעוד לא נכתב לענן
+_config_state = process_shared("config_state", lambda: {"record": None, "fetched_at": 0.0, "dirty": False})
+_config_refreshing = process_shared("config_refreshing", threading.Event)
+_config_write_wakeup = process_shared("config_write_wakeup", threading.Event)
+# תהליכון הכתיבה לענן (לכל היותר אחד)
+_config_writer = process_shared("config_writer", list)
+
+def _jsonbin_target():
+    """כתובת ה-bin והמפתח מתוך secrets, או None אם JSONBin לא מוגדר"""
     try:
         if 'JSONBIN_BIN_ID' in st.secrets and 'JSONBIN_API_KEY' in st.secrets:
-            url = f"https://api.jsonbin.io/v3/b/{st.secrets['JSONBIN_BIN_ID']}"
-            headers = {'X-Master-Key': st.secrets['JSONBIN_API_KEY']}
-            req = requests.get(url, headers=headers)
-            if req.status_code == 200:
-                return req.json().get('record', {})
+            return f"{JSONBIN_BASE_URL}/{st.secrets['JSONBIN_BIN_ID']}", st.secrets['JSONBIN_API_KEY']
+    except Exception:
+        pass
+    return None
+
+def _write_config_cache():
+    """שומר אטומית את המצב הנוכחי לקובץ המקומי (נקרא תחת _config_lock)"""
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{CONFIG_CACHE_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"record": _config_state["record"], "dirty": _config_state["dirty"]}, f, ensure_ascii=False)
+    os.replace(tmp_path, CONFIG_CACHE_FILE)
+
+def _load_config_cache():
+    """טוען פעם אחת את הקובץ המקומי לזיכרון. שינוי שלא הספיק להיכתב לענן נשלח שוב ברקע"""
+    if _config_state["record"] is not None:
+        return
+    try:
+        with open(CONFIG_CACHE_FILE, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return
+    _config_state["record"] = cached.get("record") or {}
+    _config_state["dirty"] = bool(cached.get("dirty"))
+    if _config_state["dirty"]:
+        _ensure_config_writer()
+        _config_write_wakeup.set()
+
+def _fetch_remote_config(target):
+    url, api_key = target
+    res = _config_session.get(url, headers={'X-Master-Key': api_key}, timeout=CONFIG_TIMEOUT)
+    res.raise_for_status()
+    return res.json().get('record', {})
+
+def _refresh_config(target):
+    """מושך את ההגדרות מהענן. שינוי מקומי שממתין לכתיבה גובר על מה שבענן"""
+    try:
+        record = _fetch_remote_config(target)
     except Exception as e:
-        st.warning(f"שגיאה בקריאה ממסד הנתונים: {e}")
-    return {}
+        print(f"JSONBin read failed: {e}")
+        return False
+    finally:
+        _config_refreshing.clear()
+    with _config_lock:
+        _config_state["fetched_at"] = time.time()
+        if not _config_state["dirty"]:
+            _config_state["record"] = record
+            _write_config_cache()
+    return True
+
+def get_config():
+    """
+    מחזיר את ההגדרות מהעותק המקומי. כשהעותק ישן הוא מתרענן מ-JSONBin ברקע (הדף לא מחכה);
+    רק אם אין עותק מקומי בכלל הקריאה הראשונה ממתינה לענן.
+    """
+    target = _jsonbin_target()
+    with _config_lock:
+        _load_config_cache()
+        record = _config_state["record"]
+        stale = time.time() - _config_state["fetched_at"] > CONFIG_REFRESH_SECONDS
+    if target and record is None:
+        if not _refresh_config(target):
+            st.warning("שגיאה בקריאה ממסד הנתונים, ממשיכים עם הגדרות ברירת מחדל")
+        with _config_lock:
+            # גם אם הקריאה נכשלה, מכאן והלאה מנסים שוב רק ברקע
+            if _config_state["record"] is None:
+                _config_state["record"] = {}
+            record = _config_state["record"]
+    elif target and stale and not _config_refreshing.is_set():
+        _config_refreshing.set()
+        threading.Thread(target=_refresh_config, args=(target,), daemon=True).start()
+    return dict(record or {})
+
+def _config_writer_loop():
+    """write-behind: שולח לענן את הגרסה האחרונה בלבד (PUT מחליף את כל הרשומה), עם ניסיונות חוזרים"""
+    while True:
+        _config_write_wakeup.wait()
+        _config_write_wakeup.clear()
+        target = _jsonbin_target()
+        if not target:
+            continue
+        url, api_key = target
+        for attempt in range(CONFIG_WRITE_RETRIES):
+            with _config_lock:
+                if not _config_state["dirty"]:
+                    break
+                record = dict(_config_state["record"] or {})
+            try:
+                res = _config_session.put(url, json=record, headers={'Content-Type': 'application/json', 'X-Master-Key': api_key}, timeout=CONFIG_TIMEOUT)
+                res.raise_for_status()
+            except Exception as e:
+                print(f"JSONBin write failed (attempt {attempt + 1}): {e}")
+                if _config_write_wakeup.wait(min(2 ** attempt, 30)):
+                    _config_write_wakeup.clear()
+                continue
+            with _config_lock:
+                # אם נשמר שינוי נוסף בזמן הכתיבה, הסבב הבא ישלח אותו
+                if _config_state["record"] == record:
+                    _config_state["dirty"] = False
+                    _config_state["fetched_at"] = time.time()
+                    _write_config_cache()
+        # אם כל הניסיונות נכשלו השינוי נשאר dirty בקובץ ויישלח בשמירה הבאה או בהפעלה הבאה
+
+def _ensure_config_writer():
+    if not any(writer.is_alive() for writer in _config_writer):
+        writer = threading.Thread(target=_config_writer_loop, daemon=True)
+        writer.start()
+        _config_writer[:] = [writer]
 
 def save_config(data):
-    """שומר את הנתונים למסד הנתונים בענן ומנקה את זיכרון המטמון"""
+    """שומר את ההגדרות מיד בעותק המקומי, והכתיבה ל-JSONBin מתבצעת ברקע"""
     try:
-        if 'JSONBIN_BIN_ID' in st.secrets and 'JSONBIN_API_KEY' in st.secrets:
-            url = f"https://api.jsonbin.io/v3/b/{st.secrets['JSONBIN_BIN_ID']}"
-            headers = {
-                'Content-Type': 'application/json',
-                'X-Master-Key': st.secrets['JSONBIN_API_KEY']
-            }
-            requests.put(url, json=data, headers=headers)
-            get_config.clear() 
+        with _config_lock:
+            _config_state["record"] = dict(data)
+            _config_state["dirty"] = True
+            _write_config_cache()
+            _ensure_config_writer()
+        _config_write_wakeup.set()
     except Exception as e:
-        st.error(f"שגיאה בשמירה למסד הנתונים: {e}")
+        st.error(f"שגיאה בשמירת ההגדרות: {e}")
 
 def get_next_saturday_1600(from_date):
     """מחשב מתי תחול השבת הקרובה בשעה 16:00"""
@@ -64,9 +355,261 @@ def get_next_saturday_1600(from_date):
     next_sat = from_date + datetime.timedelta(days=days_ahead)
     return next_sat.replace(hour=16, minute=0, second=0, microsecond=0)
 
+# --- גישה לאתר קו מאורות ---
+
+KAV_CATEGORY_URL = "https://kav.meorot.net/category/%d7%a2%d7%9c%d7%95%d7%a0%d7%99-%d7%a9%d7%91%d7%aa/%d7%9e%d7%a9%d7%9b%d7%9f-%d7%a9%d7%99%d7%9c%d7%94/"
+HTTP_TIMEOUT = 30
+HTTP_CACHE_SIZE = 32
+# קישור דרייב רגיל או מקודד (URL-encoded) - ביטוי אחד ומעבר אחד על ה-HTML
+DRIVE_LINK_RE = re.compile(r'https(?:://|%3A%2F%2F)drive\.google\.com(?:/|%2F)file(?:/|%2F)d(?:/|%2F)([a-zA-Z0-9_-]+)')
+
+_http_cache = process_shared("http_cache", OrderedDict)
+_http_cache_lock = process_shared("http_cache_lock", threading.Lock)
+
+def get_scraper():
+    """session אחד של cloudscraper לכל התהליך (keep-alive), שנוצר רק כשבאמת צריך לגשת לאתר"""
+    return process_shared("scraper", lambda: cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'desktop': True}))
+
+def fetch_page(url):
+    """
+    GET מותנה: שולח ETag / Last-Modified מהתשובה הקודמת, ובתשובת 304 מחזיר את התוכן השמור.
+    מחזיר את ה-HTML או None אם הבקשה נכשלה.
+    """
+    with _http_cache_lock:
+        cached = _http_cache.get(url)
+    headers = {}
+    if cached:
+        if cached["etag"]: headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]: headers["If-Modified-Since"] = cached["last_modified"]
+    with profile_stage("http_fetch", url=url) as prof:
+        res = get_scraper().get(url, headers=headers, timeout=HTTP_TIMEOUT)
+        prof["status"] = res.status_code
+        prof["cache"] = "hit" if res.status_code == 304 and cached else "miss"
+    if res.status_code == 304 and cached:
+        text = cached["text"]
+    elif res.status_code == 200:
+        text = res.text
+    else:
+        return None
+    with _http_cache_lock:
+        _http_cache[url] = {
+            "etag": res.headers.get("ETag") or (cached or {}).get("etag"),
+            "last_modified": res.headers.get("Last-Modified") or (cached or {}).get("last_modified"),
+            "text": text,
+        }
+        _http_cache.move_to_end(url)
+        while len(_http_cache) > HTTP_CACHE_SIZE:
+            _http_cache.popitem(last=False)
+    return text
+
+def find_latest_post_url(category_html):
+    """מנתח רק את כותרות הפוסטים (h2/h3) ברשימה, במקום לבנות עץ לכל הדף"""
+    soup = BeautifulSoup(category_html, "html.parser", parse_only=SoupStrainer(["h2", "h3"]))
+    post_link = soup.select_one("h3 a, h2 a")
+    return post_link["href"] if post_link and post_link.has_attr("href") else None
+
+def find_drive_id(post_html):
+    match = DRIVE_LINK_RE.search(post_html)
+    return match.group(1) if match else None
+
+def find_post_drive_id(post_id):
+    """מזהה קובץ הדרייב שמקושר מפוסט באתר, או None"""
+    post_html = fetch_page(f"https://kav.meorot.net/{post_id}/")
+    return find_drive_id(post_html) if post_html else None
+
+# --- הורדה מגוגל דרייב ---
+
+DRIVE_DOWNLOAD_URL = os.environ.get("DRIVE_DOWNLOAD_URL", "https://drive.usercontent.google.com/download")
+# קבצים שהורדו נשמרים לפי מזהה הקובץ בדרייב, כך שאותו קובץ לא יורד פעמיים
+DRIVE_DOWNLOAD_DIR = os.environ.get("DRIVE_DOWNLOAD_DIR", os.path.join(tempfile.gettempdir(), "pdf_cutter_drive"))
+DRIVE_DOWNLOAD_MAX_AGE_DAYS = 7
+DRIVE_DOWNLOAD_RETRIES = 3
+DRIVE_CHUNK_SIZE = 64 * 1024
+DRIVE_TIMEOUT = (10, 60)
+
+_drive_session = process_shared("drive_session", requests.Session)
+
+class DriveDownloadError(Exception):
+    """ההורדה נכשלה או שגוגל דרייב החזיר דף HTML במקום הקובץ"""
+
+class DriveFileTooLarge(DriveDownloadError):
+    """הקובץ בדרייב גדול מהמגבלה שנקבעה להורדה (max_bytes)"""
+
+def _drive_too_large(max_bytes, size=None):
+    limit_mb = max_bytes / 2**20
+    if size is None:
+        return DriveFileTooLarge(f"הקובץ גדול מדי (המקסימום הוא {limit_mb:.0f}MB).")
+    return DriveFileTooLarge(f"הקובץ גדול מדי ({size / 2**20:.0f}MB, המקסימום הוא {limit_mb:.0f}MB).")
+
+def _drive_filename(res, file_id):
+    """שם הקובץ מתוך Content-Disposition (מעדיף את filename* המקודד ב-UTF-8)"""
+    disposition = res.headers.get("Content-Disposition", "")
+    match = re.search(r"filename\*=UTF-8''([^;]+)", disposition, re.IGNORECASE)
+    if match:
+        return urllib.parse.unquote(match.group(1).strip())
+    match = re.search(r'filename="?([^";]+)"?', disposition)
+    if match:
+        return urllib.parse.unquote(match.group(1).strip())
+    return f"{file_id}.pdf"
+
+def _drive_confirm_request(html):
+    """בקבצים גדולים דרייב מחזיר טופס אישור ("לא ניתן לסרוק לאיתור וירוסים"); מחזיר את כתובת הטופס והפרמטרים שלו"""
+    form = BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("form")).find("form", id="download-form")
+    if not form or not form.get("action"):
+        return None
+    params = {i["name"]: i.get("value", "") for i in form.find_all("input", attrs={"type": "hidden"}) if i.get("name")}
+    return form["action"], params
+
+def _evict_drive_downloads():
+    now = time.time()
+    for name in os.listdir(DRIVE_DOWNLOAD_DIR):
+        # קובץ מנעול שנמחק מתחת למי שמחזיק בו כבר לא נועל כלום
+        if name.endswith(".lock"):
+            continue
+        path = os.path.join(DRIVE_DOWNLOAD_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > DRIVE_DOWNLOAD_MAX_AGE_DAYS * 86400:
+                os.remove(path)
+        except OSError:
+            pass
+
+def _drive_stream(file_id, part_path, meta, max_bytes=None):
+    """
+    ניסיון הורדה אחד לקובץ ה-.part. אם יש כבר חלק מהקובץ מבקשים רק את ההמשך (Range),
+    ו-If-Range מוודא שהקובץ לא השתנה בדרייב בינתיים. תשובת HTML נעצרת כבר בבתים הראשונים.
+    max_bytes: קובץ גדול ממנו נדחה לפי הגודל שבכותרות, ואם אין כזה - ברגע שההורדה עוברת אותו.
+    """
+    url, params = DRIVE_DOWNLOAD_URL, {"id": file_id, "export": "download", "confirm": "t"}
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    for _ in range(2):
+        headers = {}
+        if offset and meta.get("validator"):
+            headers = {"Range": f"bytes={offset}-", "If-Range": meta["validator"]}
+        res = _drive_session.get(url, params=params, headers=headers, stream=True, timeout=DRIVE_TIMEOUT)
+        with res:
+            if res.status_code not in (200, 206):
+                raise DriveDownloadError(f"שגיאה בהורדת הקובץ מגוגל דרייב (HTTP {res.status_code}).")
+            if "text/html" in res.headers.get("Content-Type", ""):
+                confirm = _drive_confirm_request(res.text)
+                if confirm is None:
+                    raise DriveDownloadError("גוגל דרייב חסם את ההורדה (התקבל דף HTML במקום קובץ PDF).")
+                url, params = confirm
+                continue
+            if res.status_code == 200:
+                offset = 0
+            meta["filename"] = _drive_filename(res, file_id) if res.headers.get("Content-Disposition") else meta.get("filename") or f"{file_id}.pdf"
+            meta["validator"] = res.headers.get("ETag") or res.headers.get("Last-Modified")
+            if res.status_code == 206:
+                total = res.headers.get("Content-Range", "").rpartition("/")[2]
+            else:
+                # בתשובה דחוסה Content-Length הוא הגודל הדחוס, ואין מול מה לבדוק
+                total = None if res.headers.get("Content-Encoding") else res.headers.get("Content-Length")
+            meta["total"] = int(total) if total and total.isdigit() else None
+            if max_bytes is not None and meta["total"] is not None and meta["total"] > max_bytes:
+                raise _drive_too_large(max_bytes, meta["total"])
+            with open(part_path + ".json", "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            with open(part_path, "ab" if offset else "wb") as f:
+                for chunk in res.iter_content(DRIVE_CHUNK_SIZE):
+                    if f.tell() == 0 and b"%PDF" not in chunk[:1024]:
+                        raise DriveDownloadError("הקובץ שהתקבל מגוגל דרייב אינו קובץ PDF.")
+                    f.write(chunk)
+                    if max_bytes is not None and f.tell() > max_bytes:
+                        raise _drive_too_large(max_bytes)
+                size = f.tell()
+            if meta["total"] is not None and size != meta["total"]:
+                raise requests.exceptions.ChunkedEncodingError(f"received {size} of {meta['total']} bytes")
+            return
+    raise DriveDownloadError("גוגל דרייב חסם את ההורדה (התקבל דף HTML במקום קובץ PDF).")
+
+def download_drive_file(file_id, max_bytes=None):
+    """
+    מוריד קובץ מגוגל דרייב ב-streaming לקובץ זמני ומחזיר (נתיב, שם הקובץ המקורי).
+    קובץ שכבר הורד מוחזר מיד; הורדה שנקטעה ממשיכה מהמקום שבו נעצרה.
+    מנעול בתוך התהליך ומנעול קובץ בין תהליכים (תהליכון התזמון ותהליכי העבודות), כך שרק אחד כותב ל-.part.
+    max_bytes: קובץ גדול יותר נדחה (DriveFileTooLarge) בלי להוריד אותו עד הסוף.
+    """
+    if not re.fullmatch(r"[a-zA-Z0-9_-]+", file_id or ""):
+        raise DriveDownloadError("מזהה הקובץ בגוגל דרייב אינו תקין.")
+    os.makedirs(DRIVE_DOWNLOAD_DIR, exist_ok=True)
+    final_path = os.path.join(DRIVE_DOWNLOAD_DIR, f"{file_id}.pdf")
+    part_path = os.path.join(DRIVE_DOWNLOAD_DIR, f"{file_id}.part")
+    with _path_lock(final_path), open(final_path + ".lock", "w") as lock_file, \
+            profile_stage("download", file_id=file_id) as prof:
+        try:
+            import fcntl
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except ImportError:
+            pass
+        _evict_drive_downloads()
+        try:
+            with open(final_path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            if os.path.exists(final_path):
+                os.utime(final_path)
+                prof["cache"] = "hit"
+                return final_path, meta["filename"]
+        except (OSError, ValueError, KeyError):
+            pass
+        prof["cache"] = "miss"
+        prof["resumed_from"] = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        try:
+            with open(part_path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = {}
+        for attempt in range(DRIVE_DOWNLOAD_RETRIES):
+            try:
+                _drive_stream(file_id, part_path, meta, max_bytes)
+                break
+            except DriveDownloadError:
+                for path in (part_path, part_path + ".json"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+            except requests.exceptions.RequestException as e:
+                print(f"Drive download interrupted (attempt {attempt + 1}): {e}")
+                if attempt == DRIVE_DOWNLOAD_RETRIES - 1:
+                    raise DriveDownloadError("ההורדה מגוגל דרייב נקטעה. נסו שוב - היא תמשיך מהמקום שבו נעצרה.")
+                time.sleep(2 ** attempt)
+        os.replace(part_path + ".json", final_path + ".json")
+        os.replace(part_path, final_path)
+        prof["bytes"] = os.path.getsize(final_path)
+        return final_path, meta["filename"]
+
 # --- פונקציית האוטומציה המרכזית ---
 
-def prepare_auto_pdf():
+def read_auto_current():
+    """קורא את המצביע לגיליון האוטומטי המוכן האחרון, או None אם עדיין לא נבנה אף גיליון"""
+    try:
+        with open(AUTO_CURRENT_FILE, encoding="utf-8") as f:
+            current = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(get_auto_outputs(current)["regular"]):
+        return None
+    return current
+
+def get_auto_outputs(current=None):
+    """נתיבי ארבע הגרסאות של הגיליון האוטומטי הנוכחי (ברשומה שלו במאגר התוצרים)"""
+    current = current or read_auto_current() or {"key": ""}
+    return _result_cache_paths(os.path.join(RESULT_CACHE_DIR, current["key"]))
+
+def _publish_auto_issue(key, title, post_id):
+    """מחליף אטומית את המצביע לגיליון החדש. הגיליון הקודם נשאר נעוץ עבור סשנים שעדיין מציגים אותו"""
+    previous = read_auto_current() or {}
+    previous_key = previous.get("key") if previous.get("key") != key else previous.get("previous_key")
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    tmp_path = f"{AUTO_CURRENT_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key, "title": title, "post_id": post_id, "previous_key": previous_key}, f, ensure_ascii=False)
+    os.replace(tmp_path, AUTO_CURRENT_FILE)
+
+def build_auto_issue():
+    """
+    בודק אם יצא גיליון חדש (פעם בשבוע, אחרי שבת ב-16:00), מוריד ומעבד אותו לתיקייה חדשה,
+    ורק בסוף מפרסם אותו דרך המצביע. משתמשים תמיד קוראים גיליון גמור בלבד.
+    """
     config = get_config()
     last_post_id = config.get("last_post_id", DEFAULT_START_ID)
     last_drive_id = config.get("last_drive_id", None)
@@ -88,107 +631,202 @@ def prepare_auto_pdf():
     target_drive_id = last_drive_id
     found_new = False
 
-    scraper = cloudscraper.create_scraper(browser={'browser': 'chrome', 'platform': 'windows', 'desktop': True})
-    
     if should_scrape:
-        cat_url = "https://kav.meorot.net/category/%d7%a2%d7%9c%d7%95%d7%a0%d7%99-%d7%a9%d7%91%d7%aa/%d7%9e%d7%a9%d7%9b%d7%9f-%d7%a9%d7%99%d7%9c%d7%94/"
-        cat_res = scraper.get(cat_url)
+        with profile_stage("scrape", last_post_id=last_post_id) as prof:
+            cat_html = fetch_page(KAV_CATEGORY_URL)
+            url = find_latest_post_url(cat_html) if cat_html else None
         
-        if cat_res.status_code == 200:
-            soup = BeautifulSoup(cat_res.text, "html.parser")
-            post_link = soup.select_one("h3 a, h2 a")
-            
-            if post_link:
-                url = post_link["href"]
+            if url:
                 id_match = re.search(r'kav\.meorot\.net/(\d+)', url)
                 if id_match:
                     scraped_post_id = int(id_match.group(1))
-                    
+                
                     if scraped_post_id > last_post_id:
-                        post_res = scraper.get(url)
-                        if post_res.status_code == 200:
-                            drive_patterns = [
-                                r'https://drive\.google\.com/file/d/([a-zA-Z0-9_-]+)', 
-                                r'https%3A%2F%2Fdrive\.google\.com%2Ffile%2Fd%2F([a-zA-Z0-9_-]+)'
-                            ]
-                            for pattern in drive_patterns:
-                                match = re.search(pattern, post_res.text)
-                                if match:
-                                    target_drive_id = match.group(1)
-                                    target_post_id = scraped_post_id
-                                    found_new = True
-                                    break
-
-    if not found_new and os.path.exists(AUTO_REGULAR_PDF):
-        if not os.path.exists(AUTO_REGULAR_BW_PDF): convert_pdf_to_bw(AUTO_REGULAR_PDF, AUTO_REGULAR_BW_PDF)
-        if not os.path.exists(AUTO_CUT_PDF): split_pdf_to_columns(AUTO_REGULAR_PDF, AUTO_CUT_PDF)
-        if not os.path.exists(AUTO_CUT_BW_PDF): convert_pdf_to_bw(AUTO_CUT_PDF, AUTO_CUT_BW_PDF)
+                        post_html = fetch_page(url)
+                        drive_id = find_drive_id(post_html) if post_html else None
+                        if drive_id:
+                            target_drive_id = drive_id
+                            target_post_id = scraped_post_id
+                            found_new = True
+            prof["found_new"] = found_new
+            prof["post_id"] = target_post_id
+
+    current = read_auto_current()
+    if not found_new and current:
+        process_document(None, get_auto_outputs(current), skip_existing=True)
+        return True, None, current.get("title", last_title)
+
+    # אם הפוסט כבר עובד בעבר (למשל אחרי הפעלה מחדש), מאגר התוצרים מכיר אותו לפי מזהה הפוסט
+    aliased_key = result_cache_resolve(f"post-{target_post_id}")
+    if not found_new and aliased_key and result_cache_get(aliased_key):
+        _publish_auto_issue(aliased_key, last_title, target_post_id)
         return True, None, last_title
 
     if not target_drive_id:
-        post_res = scraper.get(f"https://kav.meorot.net/{target_post_id}/")
-        if post_res.status_code == 200:
-            drive_patterns = [r'https://drive\.google\.com/file/d/([a-zA-Z0-9_-]+)', r'https%3A%2F%2Fdrive\.google\.com%2Ffile%2Fd%2F([a-zA-Z0-9_-]+)']
-            for pattern in drive_patterns:
-                match = re.search(pattern, post_res.text)
-                if match:
-                    target_drive_id = match.group(1)
-                    break
+        target_drive_id = find_post_drive_id(target_post_id)
                     
     if not target_drive_id:
         return False, "לא הצלחנו לאתר קישור תקין לגוגל דרייב בפוסט.", None
 
-    downloaded_path = gdown.download(id=target_drive_id, quiet=False)
-    
-    if not downloaded_path:
-        return False, "שגיאה בהורדת הקובץ מגוגל דרייב.", None
-
-    original_filename = urllib.parse.unquote(os.path.basename(downloaded_path))
-
-    if os.path.getsize(downloaded_path) < 100000:
-        if os.path.exists(downloaded_path): os.remove(downloaded_path)
-        return False, "הקובץ שהורד קטן מדי! נראה שגוגל דרייב חסם את ההורדה.", None
+    try:
+        downloaded_path, original_filename = download_drive_file(target_drive_id)
+    except DriveDownloadError as e:
+        return False, str(e), None
 
     START_IMG, END_IMG = "start.png", "end.png"
     if not os.path.exists(START_IMG) or not os.path.exists(END_IMG):
-        if os.path.exists(downloaded_path): os.remove(downloaded_path)
         return False, "שגיאה: קבצי תמונות החיתוך חסרים בשרת.", None
 
-    with open(START_IMG, "rb") as f: start_b64 = base64.b64encode(f.read())
-    with open(END_IMG, "rb") as f: end_b64 = base64.b64encode(f.read())
+    start_matcher, end_matcher = get_marker_matchers(START_IMG, END_IMG)
 
-    success = extract_pdf_by_images(downloaded_path, AUTO_REGULAR_PDF, start_b64, end_b64)
-    if os.path.exists(downloaded_path): os.remove(downloaded_path)
+    # העיבוד נכתב לרשומה חדשה במאגר - הגיליון הקודם ממשיך להיות מוגש עד שהחדש מוכן
+    scan_info = {}
+    outputs = run_cached_pipeline(downloaded_path, start_matcher, end_matcher, scan_hint=get_scan_hint(config),
+                                  scan_info=scan_info, alias=f"post-{target_post_id}")
 
-    if success:
-        convert_pdf_to_bw(AUTO_REGULAR_PDF, AUTO_REGULAR_BW_PDF)
-        split_pdf_to_columns(AUTO_REGULAR_PDF, AUTO_CUT_PDF)
-        convert_pdf_to_bw(AUTO_CUT_PDF, AUTO_CUT_BW_PDF)
-        
-        if found_new or last_title != original_filename:
+    if outputs:
+        _publish_auto_issue(result_cache_entry_key(outputs), original_filename, target_post_id)
+        # בפגיעה במאגר לא נסרקו עמודים, ולכן נשמרים מיקומי הסימנים הקודמים
+        start_page, end_page = get_scan_hint(config) or (None, None)
+        start_page = scan_info.get("start_page", start_page)
+        end_page = scan_info.get("end_page", end_page)
+        if found_new or last_title != original_filename or get_scan_hint(config) != (start_page, end_page):
             save_config({
                 "last_post_id": target_post_id,
                 "last_drive_id": target_drive_id,
                 "last_check_time": last_check_str if not found_new else now.isoformat(),
-                "last_title": original_filename
+                "last_title": original_filename,
+                "last_start_page": start_page,
+                "last_end_page": end_page
             })
         return True, None, original_filename
     else:
         return False, "לא הצלחנו למצוא את סימני ההתחלה והסיום בתוך ה-PDF החדש.", None
 
+_AUTO_BUILD_LOCK = process_shared("auto_build_lock", threading.Lock)
+
+def run_auto_build():
+    """
+    בנייה בודדת בכל רגע נתון (single-flight): מנעול בתוך התהליך ומנעול קובץ בין תהליכים.
+    מי שמגיע בזמן בנייה ממתין לסיומה ומקבל את התוצאה שכבר פורסמה.
+    """
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    with _AUTO_BUILD_LOCK:
+        with open(AUTO_LOCK_FILE, "w") as lock_file:
+            try:
+                import fcntl
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            except ImportError:
+                pass
+            return build_auto_issue()
+
+def _auto_scheduler_loop():
+    while True:
+        try:
+            run_auto_build()
+        except Exception as e:
+            print(f"Auto build error: {e}")
+        time.sleep(AUTO_POLL_SECONDS)
+
+@st.cache_resource
+def start_auto_scheduler():
+    """מפעיל פעם אחת לכל תהליך שרת תהליכון רקע שבונה מראש את הגיליון השבועי"""
+    worker = threading.Thread(target=_auto_scheduler_loop, name="auto-issue-scheduler", daemon=True)
+    worker.start()
+    return worker
+
+def prepare_auto_pdf():
+    """
+    נקרא מתוך בקשת המשתמש: מחזיר את הגיליון המוכן האחרון בלי לחכות לעיבוד.
+    רק אם עדיין לא נבנה אף גיליון (הפעלה ראשונה של השרת) ממתינים לבנייה.
+    מחזיר (הצלחה, הודעת שגיאה, כותרת, מפתח הרשומה במאגר). הסשן שומר את המפתח וממשיך להציג את אותו
+    גיליון גם אחרי שהמתזמן מפרסם גיליון חדש.
+    """
+    start_auto_scheduler()
+    current = read_auto_current()
+    if not current:
+        success, error_msg, _ = run_auto_build()
+        current = read_auto_current() if success else None
+        if not current:
+            return False, error_msg or "הגיליון לא נמצא לאחר העיבוד.", None, None
+    return True, None, current["title"], current["key"]
+
 # --- פונקציות עיבוד תצוגה וממשק מתקדם ---
 
-def display_pdf(file_path):
+# תצוגה מקדימה כתמונות עמוד (במקום להטמיע את כל ה-PDF כ-base64), עם מטמון תמונות מוגבל בגודל
+PREVIEW_ZOOM = 1.5
+PREVIEW_CACHE_MAX_MB = int(os.environ.get("PREVIEW_CACHE_MAX_MB", "64"))
+_PREVIEW_CACHE = process_shared("preview_cache", OrderedDict)
+_PREVIEW_CACHE_LOCK = process_shared("preview_cache_lock", threading.Lock)
+
+def render_preview_page(file_path, page_num, zoom=PREVIEW_ZOOM):
+    """מחזיר PNG של עמוד בודד. התמונות נשמרות במטמון LRU משותף שגודלו הכולל מוגבל"""
+    key = (os.path.abspath(file_path), os.path.getmtime(file_path), page_num, zoom)
+    with _PREVIEW_CACHE_LOCK:
+        if key in _PREVIEW_CACHE:
+            _PREVIEW_CACHE.move_to_end(key)
+            return _PREVIEW_CACHE[key]
+    with _MUPDF_LOCK:
+        doc = fitz.open(file_path)
+        png = doc[page_num].get_pixmap(matrix=fitz.Matrix(zoom, zoom)).tobytes("png")
+        doc.close()
+    with _PREVIEW_CACHE_LOCK:
+        _PREVIEW_CACHE[key] = png
+        max_bytes = PREVIEW_CACHE_MAX_MB * 1024 * 1024
+        while len(_PREVIEW_CACHE) > 1 and sum(len(v) for v in _PREVIEW_CACHE.values()) > max_bytes:
+            _PREVIEW_CACHE.popitem(last=False)
+    return png
+
+def _pdf_page_count(file_path):
+    with _MUPDF_LOCK:
+        doc = fitz.open(file_path)
+        count = len(doc)
+        doc.close()
+    return count
+
+def display_pdf(file_path, key_prefix="preview"):
+    """תצוגה מדפדפת: רק העמוד הנוכחי מרונדר ונשלח לדפדפן, כך שהזיכרון לא תלוי בגודל הקובץ"""
+    page_count = _pdf_page_count(file_path)
+    if page_count == 0:
+        return
+    page_num = 1
+    if page_count > 1:
+        page_num = st.number_input(f"עמוד (מתוך {page_count})", min_value=1, max_value=page_count, value=1, step=1, key=f"{key_prefix}_page")
+    st.image(render_preview_page(file_path, page_num - 1), use_container_width=True)
+
+def _read_file_bytes(file_path):
     with open(file_path, "rb") as f:
-        base64_pdf = base64.b64encode(f.read()).decode('utf-8')
-    pdf_display = f'<iframe src="data:application/pdf;base64,{base64_pdf}" width="100%" height="800px" type="application/pdf" style="border: 1px solid #ccc; border-radius: 8px;"></iframe>'
-    st.markdown(pdf_display, unsafe_allow_html=True)
+        return f.read()
+
+# שמות הקבצים להורדה: שם הגיליון ועוד סיומת לפי הגרסה
+VARIANT_FILENAME_SUFFIXES = {
+    "regular": "",
+    "regular_bw": " - שחור לבן",
+    "cut": " - חתוך לטורים",
+    "cut_bw": " - שחור לבן - חתוך לטורים",
+}
+
+def safe_pdf_filename(title):
+    """מנקה תווים אסורים משם הקובץ ומוודא סיומת .pdf"""
+    safe_name = re.sub(r'[\\/*?:"<>|]', "", title).strip()
+    if not safe_name.lower().endswith('.pdf'):
+        safe_name += ".pdf"
+    return safe_name
+
+def variant_filename(base_filename, variant):
+    return base_filename.replace(".pdf", f"{VARIANT_FILENAME_SUFFIXES[variant]}.pdf")
+
+# בנייה עצלה שנכשלה, לפי (רשומת המקור במאגר, גרסה) -> הודעת השגיאה. כך כישלון לא נשלח שוב לתור
+# בכל ריצה של הדף (ובכל סשן), אלא מוצג עד שמשתמש מבקש במפורש לנסות שוב
+_VARIANT_FAILURES = process_shared("variant_failures", dict)
 
 def render_download_view_ui(base_filename, regular_color, regular_bw, cut_color, cut_bw, key_prefix):
     if f"{key_prefix}_format" not in st.session_state:
         st.session_state[f"{key_prefix}_format"] = None
     if f"{key_prefix}_layout" not in st.session_state:
         st.session_state[f"{key_prefix}_layout"] = None
+    if f"{key_prefix}_preview" not in st.session_state:
+        st.session_state[f"{key_prefix}_preview"] = False
 
     st.write("### 1. בחר פורמט צבע:")
     col1, col2 = st.columns(2)
@@ -196,10 +834,12 @@ def render_download_view_ui(base_filename, regular_color, regular_bw, cut_color,
     if col1.button("🎨 צבעוני", use_container_width=True, key=f"{key_prefix}_btn_color"):
         st.session_state[f"{key_prefix}_format"] = "color"
         st.session_state[f"{key_prefix}_layout"] = None
+        st.session_state[f"{key_prefix}_preview"] = False
     
     if col2.button("🖨️ שחור לבן", use_container_width=True, key=f"{key_prefix}_btn_bw"):
         st.session_state[f"{key_prefix}_format"] = "bw"
         st.session_state[f"{key_prefix}_layout"] = None
+        st.session_state[f"{key_prefix}_preview"] = False
 
     fmt = st.session_state[f"{key_prefix}_format"]
     
@@ -209,249 +849,1692 @@ def render_download_view_ui(base_filename, regular_color, regular_bw, cut_color,
         
         if layout_col1.button("📄 מסמך רגיל", use_container_width=True, key=f"{key_prefix}_btn_reg"):
             st.session_state[f"{key_prefix}_layout"] = "regular"
+            st.session_state[f"{key_prefix}_preview"] = False
         
         if layout_col2.button("✂️ חתוך לטורים (לקריאה דיגיטלית)", use_container_width=True, key=f"{key_prefix}_btn_cut"):
             st.session_state[f"{key_prefix}_layout"] = "cut"
+            st.session_state[f"{key_prefix}_preview"] = False
 
         lyt = st.session_state[f"{key_prefix}_layout"]
         if lyt:
             if fmt == "color" and lyt == "regular":
                 target_file = regular_color
-                dl_name = base_filename
+                variant = "regular"
+                dl_name = variant_filename(base_filename, variant)
             elif fmt == "bw" and lyt == "regular":
                 target_file = regular_bw
-                dl_name = base_filename.replace(".pdf", " - שחור לבן.pdf")
+                variant = "regular_bw"
+                dl_name = variant_filename(base_filename, variant)
             elif fmt == "color" and lyt == "cut":
                 target_file = cut_color
-                dl_name = base_filename.replace(".pdf", " - חתוך לטורים.pdf")
+                variant = "cut"
+                dl_name = variant_filename(base_filename, variant)
             elif fmt == "bw" and lyt == "cut":
                 target_file = cut_bw
-                dl_name = base_filename.replace(".pdf", " - שחור לבן - חתוך לטורים.pdf")
+                variant = "cut_bw"
+                dl_name = variant_filename(base_filename, variant)
+
+            # במצב עצל הגרסה נבנית רק כשמישהו מבקש אותה בפעם הראשונה. הבנייה עוברת בתור העבודות,
+            # כך שהיא רצה בתהליך נפרד עם תקרת הזיכרון והזמן ובמקביליות מוגבלת, ולא בתהליכון של הדף
+            if not os.path.exists(target_file) and os.path.exists(regular_color):
+                job_key = f"{key_prefix}_{variant}_job"
+                failure_key = (result_cache_entry_key({"regular": regular_color}), variant)
+                if failure_key in _VARIANT_FAILURES and job_key not in st.session_state:
+                    st.error(f"יצירת הקובץ נכשלה: {_VARIANT_FAILURES[failure_key]}")
+                    if st.button("🔄 נסה שוב", key=f"{key_prefix}_{variant}_retry"):
+                        _VARIANT_FAILURES.pop(failure_key, None)
+                        st.rerun()
+                    return
+                status = job_status(st.session_state[job_key]) if job_key in st.session_state else None
+                if status is None:
+                    outputs = {"regular": regular_color, "regular_bw": regular_bw, "cut": cut_color, "cut_bw": cut_bw}
+                    try:
+                        st.session_state[job_key] = submit_job({"kind": "variant", "outputs": outputs, "variant": variant}, None, None)
+                    except JobRejected as e:
+                        st.warning(str(e))
+                        return
+                    status = job_status(st.session_state[job_key])
+                if status["state"] not in JOB_FINAL_STATES:
+                    render_job_status(st.session_state[job_key])
+                    return
+                st.session_state.pop(job_key, None)
+                if status["state"] != "done":
+                    print(f"Variant build error ({variant}): {status['error']}")
+                    _VARIANT_FAILURES[failure_key] = status["error"] or status["state"]
+                    st.error(f"יצירת הקובץ נכשלה: {_VARIANT_FAILURES[failure_key]}")
+                    return
 
             if os.path.exists(target_file):
                 st.write("### 3. בחר פעולה:")
                 act_col1, act_col2 = st.columns(2)
-                with open(target_file, "rb") as f:
-                    act_col1.download_button("📥 הורד קובץ", f, dl_name, "application/pdf", use_container_width=True, key=f"{key_prefix}_btn_dl")
+                # הקובץ נקרא מהדיסק רק בלחיצה על ההורדה, ולא בכל ריצה מחדש של הדף
+                act_col1.download_button("📥 הורד קובץ", lambda: _read_file_bytes(target_file), dl_name, "application/pdf", use_container_width=True, key=f"{key_prefix}_btn_dl")
                 if act_col2.button("👁️ תצוגה באתר", use_container_width=True, key=f"{key_prefix}_btn_view"):
-                    display_pdf(target_file)
+                    st.session_state[f"{key_prefix}_preview"] = True
+                if st.session_state[f"{key_prefix}_preview"]:
+                    display_pdf(target_file, key_prefix=f"{key_prefix}_{variant}")
             else:
                 st.error("הקובץ המבוקש נוצר עם שגיאה או אינו קיים.")
 
 
-def split_pdf_to_columns(input_pdf_path, output_pdf_path):
+SPLIT_NUM_COLUMNS = 3
+SPLIT_TOP_MARGIN = 40
+SPLIT_BOTTOM_MARGIN = 40
+# שמירה דחוסה של קובץ הטורים: איסוף ואיחוד אובייקטים כפולים, דחיסת זרמים ו-object streams.
+# "0" שומר כמו קודם (לבדיקות השוואה)
+SPLIT_COMPACT_SAVE = os.environ.get("SPLIT_COMPACT_SAVE", "1") == "1"
+COMPACT_SAVE_OPTIONS = {"garbage": 4, "deflate": True, "use_objstms": 1}
+
+# עמודות מערך המילים: x0, y0, x1, y1, רוחב
+WORD_X0, WORD_Y0, WORD_X1, WORD_Y1, WORD_W = range(5)
+
+def _words_array(words):
+    """ממיר את רשימת המילים של PyMuPDF למערך (N, 5) מסוג float"""
+    if not words:
+        return np.empty((0, 5), dtype=float)
+    arr = np.array([w[:4] for w in words], dtype=float)
+    return np.column_stack([arr, arr[:, 2] - arr[:, 0]])
+
+class PageLayout:
     """
-    אלגוריתם חיתוך אטומי:
-    מפרק את העמוד למילים בודדות (Words) במקום שורות או בלוקים.
-    מחשב את רוחב הטור בדיוק לפי "השורה הארוכה ביותר" בטור (X מינימלי ומקסימלי של כל המילים).
-    מבצע מחיקה כירורגית למילים פולשות למניעת קטיעת טקסט.
+    פריסת עמוד שנחלצת במעבר טקסט יחיד (TextPage אחד משמש גם למילים וגם לתמונות).
+    words: מערך (N, 5) - x0, y0, x1, y1, רוחב. images: מערך (M, 4) של מלבני התמונות.
+    מיועד לשימוש חוזר בכל שלב בתהליך שצריך את מיקומי המילים או התמונות בעמוד.
     """
-    doc = fitz.open(input_pdf_path)
-    out_doc = fitz.open()
+    def __init__(self, page_num, width, height, words, word_texts, images):
+        self.page_num = page_num
+        self.width = width
+        self.height = height
+        self.words = words
+        self.word_texts = word_texts
+        self.images = images
+
+    @classmethod
+    def from_page(cls, page):
+        textpage = page.get_textpage(flags=fitz.TEXTFLAGS_WORDS | fitz.TEXT_PRESERVE_IMAGES)
+        raw_words = textpage.extractWORDS()
+        # בלוקים מסוג 1 הם תמונות - ללא בניית עץ ה-spans המלא של "dict"
+        image_boxes = [b[:4] for b in textpage.extractBLOCKS() if b[6] == 1]
+        textpage = None
+        return cls(
+            page.number, page.rect.width, page.rect.height,
+            _words_array(raw_words), [w[4] for w in raw_words],
+            np.array(image_boxes, dtype=float).reshape(-1, 4)
+        )
 
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        width = page.rect.width
-        height = page.rect.height
+def cluster_column_centers(x2_values, page_width, num_columns=SPLIT_NUM_COLUMNS, max_iter=10):
+    """
+    k-means חד-ממדי על הקצה הימני של המילים. מחזיר את מרכזי הטורים מימין לשמאל.
+    נקודות ההתחלה נפרשות בין 95% ל-25% מרוחב העמוד (לשלושה טורים: 0.95, 0.60, 0.25).
+    """
+    centers = np.linspace(0.95, 0.25, num_columns) * page_width if num_columns > 1 else np.array([0.95 * page_width])
+    x2_values = np.asarray(x2_values, dtype=float)
+    if x2_values.size:
+        for _ in range(max_iter):
+            labels = assign_to_columns(x2_values, centers)
+            new_centers = np.array([x2_values[labels == i].mean() if np.any(labels == i) else centers[i] for i in range(num_columns)])
+            if np.array_equal(new_centers, centers):
+                break
+            centers = new_centers
+    # סידור מהימין לשמאל: [0]=ימין ... [-1]=שמאל
+    return np.sort(centers)[::-1]
 
-        top_margin = 40
-        bottom_margin = 40
-        crop_height = height - bottom_margin
+def assign_to_columns(x_values, centers):
+    """מחזיר לכל ערך X את אינדקס המרכז הקרוב ביותר (בשוויון - המרכז הראשון, כמו np.argmin)"""
+    return np.abs(np.asarray(x_values, dtype=float)[:, None] - centers[None, :]).argmin(axis=1)
 
-        # 1. חילוץ ברמת המילה הבודדת 
-        words = page.get_text("words")
-        valid_words = [w for w in words if w[1] >= top_margin and w[3] <= crop_height]
+# מרווח אופקי מקסימלי (בנקודות) בין מילים באותה שורה שמלבני המחיקה שלהן מאוחדים
+ERASE_MERGE_GAP = 12
+
+def _rects_in_view(rects, view_rect):
+    """רק מלבנים שנוגעים באזור החיתוך הסופי (כולל עובי קו המחיקה) - כל השאר ממילא מחוץ לעמוד"""
+    if not len(rects):
+        return rects.reshape(-1, 4)
+    return rects[(rects[:, 2] >= view_rect.x0 - 1) & (rects[:, 0] <= view_rect.x1 + 1) &
+                 (rects[:, 3] >= view_rect.y0 - 1) & (rects[:, 1] <= view_rect.y1 + 1)]
+
+def _intersects_any(rect, rects):
+    if not len(rects):
+        return False
+    return bool(np.any((rects[:, 0] < rect[2]) & (rects[:, 2] > rect[0]) & (rects[:, 1] < rect[3]) & (rects[:, 3] > rect[1])))
+
+def merge_erase_rects(rects, protected, max_gap=ERASE_MERGE_GAP, tol=1.0):
+    """
+    מאחד מלבני מחיקה של מילים סמוכות באותה שורה למלבן אחד ברמת השורה.
+    איחוד שהיה נוגע במלבן מוגן (מילים/תמונות של הטור שלנו או כותרות משותפות) לא מתבצע.
+    """
+    if len(rects) < 2:
+        return rects.reshape(-1, 4)
+    order = np.lexsort((rects[:, 0], np.round(rects[:, 3] / tol), np.round(rects[:, 1] / tol)))
+    merged = []
+    current = rects[order[0]].copy()
+    for rect in rects[order[1:]]:
+        same_line = abs(rect[1] - current[1]) <= tol and abs(rect[3] - current[3]) <= tol
+        if same_line and rect[0] - current[2] <= max_gap:
+            candidate = np.array([min(current[0], rect[0]), min(current[1], rect[1]), max(current[2], rect[2]), max(current[3], rect[3])])
+            if not _intersects_any(candidate, protected):
+                current = candidate
+                continue
+        merged.append(current)
+        current = rect.copy()
+    merged.append(current)
+    return np.array(merged)
+
+def draw_erase_rects(page, rects):
+    """מצייר את כל מלבני המחיקה בעמוד כפקודת ציור אחת (Shape יחיד) במקום פקודה לכל מלבן"""
+    if not len(rects):
+        return
+    shape = page.new_shape()
+    for x0, y0, x1, y1 in rects:
+        shape.draw_rect(fitz.Rect(x0, y0, x1, y1))
+    shape.finish(color=(1,1,1), fill=(1,1,1))
+    shape.commit()
+
+def _split_page_to_columns(doc, source_doc, out_doc, page_num, num_columns):
+    """חותך עמוד מקור אחד לעמודי טורים ב-out_doc. מחזיר כמה עמודים נוספו"""
+    # 1. חילוץ ברמת המילה הבודדת - מעבר טקסט אחד לעמוד עבור המילים והתמונות גם יחד
+    layout = PageLayout.from_page(doc[page_num])
+    width = layout.width
+    height = layout.height
+
+    top_margin = SPLIT_TOP_MARGIN
+    bottom_margin = SPLIT_BOTTOM_MARGIN
+    crop_height = height - bottom_margin
+
+    words = layout.words
+    words = words[(words[:, WORD_Y0] >= top_margin) & (words[:, WORD_Y1] <= crop_height)]
+    
+    if not len(words):
+        return 0
+
+    # 2. מציאת עוגני הטורים לפי הקצה הימני (x2) של כל מילה
+    # בעברית, תחילת השורה היא בצד ימין, ולכן הקצה הימני מיושר ונוח לזיהוי למרות הזיגזג שמאלה
+    x2_values = words[words[:, WORD_W] < width * 0.4, WORD_X1]
+    centers = cluster_column_centers(x2_values, width, num_columns)
+    
+    # 3. שיוך מילים בודדות לטורים (-1 = כותרת רחבה משותפת)
+    word_cols = assign_to_columns(words[:, WORD_X1], centers)
+    word_cols[words[:, WORD_W] > width * 0.45] = -1
+
+    # שיוך תמונות
+    images = layout.images
+    img_cols = assign_to_columns(images[:, 2], centers)
+    img_cols[((images[:, 2] - images[:, 0]) > width * 0.45) | (images[:, 1] < top_margin) | (images[:, 3] > crop_height)] = -1
+
+    shared_words = words[word_cols == -1]
+    shared_images = images[img_cols == -1]
+
+    # 4. יצירת עמוד לכל טור
+    column_pages = 0
+    for col_idx in range(num_columns):
+        my_words = words[word_cols == col_idx]
+        my_images = images[img_cols == col_idx]
         
-        if not valid_words:
+        # מניעת עמודים לבנים היכן שאין תוכן
+        if not len(my_words) and not len(my_images):
             continue
 
-        # 2. מציאת עוגני הטורים לפי הקצה הימני (x2) של כל מילה
-        # בעברית, תחילת השורה היא בצד ימין, ולכן הקצה הימני מיושר ונוח לזיהוי למרות הזיגזג שמאלה
-        x2_values = [w[2] for w in valid_words if (w[2] - w[0]) < width * 0.4]
-        centers = [width * 0.95, width * 0.60, width * 0.25]
+        # 5. הגדרת רוחב הטור בדיוק לפי "השורה הארוכה ביותר" בטור עצמו
+        # איסוף כל נקודות ה-X הרלוונטיות
+        xs = np.concatenate([my_words[:, [WORD_X0, WORD_X1]].ravel(), my_images[:, [0, 2]].ravel()])
         
-        if x2_values:
-            for _ in range(10):
-                clusters = [[], [], []]
-                for x in x2_values:
-                    idx = int(np.argmin([abs(x - c) for c in centers]))
-                    clusters[idx].append(x)
-                
-                new_centers = [float(np.mean(c)) if c else centers[i] for i, c in enumerate(clusters)]
-                if new_centers == centers:
-                    break
-                centers = new_centers
-                
-        # סידור מהימין לשמאל: [0]=ימין, [1]=אמצע, [2]=שמאל
-        centers.sort(reverse=True) 
+        min_x = xs.min() if xs.size else 0
+        max_x = xs.max() if xs.size else width
         
-        # 3. שיוך מילים בודדות לטורים
-        col_words = {0: [], 1: [], 2: [], "shared": []}
-        for w in valid_words:
-            w_width = w[2] - w[0]
-            if w_width > width * 0.45: # כותרת רחבה
-                col_words["shared"].append(w)
-            else:
-                idx = int(np.argmin([abs(w[2] - c) for c in centers]))
-                col_words[idx].append(w)
-
-        # שיוך תמונות
-        page_dict = page.get_text("dict")
-        images = [b for b in page_dict.get("blocks", []) if b["type"] == 1]
-        img_cols = {0: [], 1: [], 2: [], "shared": []}
-        for img in images:
-            ib = fitz.Rect(img["bbox"])
-            if ib.width > width * 0.45 or ib.y0 < top_margin or ib.y1 > crop_height:
-                img_cols["shared"].append(img)
-            else:
-                idx = int(np.argmin([abs(ib.x1 - c) for c in centers]))
-                img_cols[idx].append(img)
+        # הגובה יתחשב גם בכותרות המשותפות כדי שלא ייקטעו
+        ys = np.concatenate([
+            my_words[:, [WORD_Y0, WORD_Y1]].ravel(), shared_words[:, [WORD_Y0, WORD_Y1]].ravel(),
+            my_images[:, [1, 3]].ravel(), shared_images[:, [1, 3]].ravel()
+        ])
+             
+        min_y = ys.min() if ys.size else top_margin
+        max_y = ys.max() if ys.size else crop_height
 
-        # 4. יצירת 3 העמודים
-        for col_idx in [0, 1, 2]:
-            my_words = col_words[col_idx]
-            my_images = img_cols[col_idx]
-            
-            # מניעת עמודים לבנים היכן שאין תוכן
-            if not my_words and not my_images:
-                continue
+        pad_x = 8
+        pad_y = 15
+        
+        crop_rect = fitz.Rect(
+            max(0, min_x - pad_x),
+            max(0, min_y - pad_y),
+            min(width, max_x + pad_x),
+            min(height, max_y + pad_y)
+        )
 
-            new_page = out_doc.new_page(width=width, height=height)
-            new_page.show_pdf_page(new_page.rect, doc, page_num)
+        # בדיקה אחרונה שהמלבן בגודל הגיוני
+        if crop_rect.width <= 30 or crop_rect.height <= 30:
+            continue
 
-            # 5. טיפקס כירורגי למילים זרות
-            for other_idx in [0, 1, 2]:
-                if other_idx == col_idx:
-                    continue
-                for w in col_words[other_idx]:
-                    # מחיקה עם קיזוז קל (0.5 פיקסל פנימה) כדי לא לנגוס בניקוד של מילים סמוכות מהטור שלנו
-                    erase_rect = fitz.Rect(w[0]+0.5, w[1], w[2]-0.5, w[3])
-                    new_page.draw_rect(erase_rect, color=(1,1,1), fill=(1,1,1))
-                for img in img_cols[other_idx]:
-                    ib = fitz.Rect(img["bbox"])
-                    erase_rect = fitz.Rect(ib.x0, ib.y0, ib.x1, ib.y1)
-                    new_page.draw_rect(erase_rect, color=(1,1,1), fill=(1,1,1))
-
-            # 6. הגדרת רוחב הטור בדיוק לפי "השורה הארוכה ביותר" בטור עצמו
-            # איסוף כל נקודות ה-X הרלוונטיות
-            xs = [w[0] for w in my_words] + [w[2] for w in my_words] + \
-                 [fitz.Rect(i["bbox"]).x0 for i in my_images] + [fitz.Rect(i["bbox"]).x1 for i in my_images]
-            
-            min_x = min(xs) if xs else 0
-            max_x = max(xs) if xs else width
-            
-            # הגובה יתחשב גם בכותרות המשותפות כדי שלא ייקטעו
-            all_y_words = my_words + col_words["shared"]
-            all_y_imgs = my_images + img_cols["shared"]
-            ys = [w[1] for w in all_y_words] + [w[3] for w in all_y_words] + \
-                 [fitz.Rect(i["bbox"]).y0 for i in all_y_imgs] + [fitz.Rect(i["bbox"]).y1 for i in all_y_imgs]
-                 
-            min_y = min(ys) if ys else top_margin
-            max_y = max(ys) if ys else crop_height
-
-            pad_x = 8
-            pad_y = 15
-            
-            crop_rect = fitz.Rect(
-                max(0, min_x - pad_x),
-                max(0, min_y - pad_y),
-                min(width, max_x + pad_x),
-                min(height, max_y + pad_y)
-            )
+        new_page = out_doc.new_page(width=width, height=height)
+        # PyMuPDF שומר את עמוד המקור כ-Form XObject אחד לכל out_doc (doc.ShownPages), כך שכל הטורים
+        # של אותו עמוד מפנים לאותו אובייקט; לכל עמוד טור נוספים רק עטיפה קטנה ושכבת המחיקה שלו
+        new_page.show_pdf_page(new_page.rect, source_doc, page_num)
 
-            # בדיקה אחרונה שהמלבן בגודל הגיוני
-            if crop_rect.width > 30 and crop_rect.height > 30:
-                new_page.set_cropbox(crop_rect)
-                new_page.set_mediabox(crop_rect)
-            else:
-                out_doc.delete_page(-1)
+        # 6. טיפקס כירורגי למילים זרות
+        # מחיקה עם קיזוז קל (0.5 פיקסל פנימה) כדי לא לנגוס בניקוד של מילים סמוכות מהטור שלנו
+        other_words = words[(word_cols != col_idx) & (word_cols != -1)][:, :4] + [0.5, 0, -0.5, 0]
+        other_images = images[(img_cols != col_idx) & (img_cols != -1)]
+        protected = np.concatenate([my_words[:, :4], shared_words[:, :4], my_images, shared_images])
+        erase_rects = np.concatenate([
+            merge_erase_rects(_rects_in_view(other_words, crop_rect), protected),
+            _rects_in_view(other_images, crop_rect)
+        ])
+        draw_erase_rects(new_page, erase_rects)
 
-    out_doc.save(output_pdf_path)
-    out_doc.close()
-    doc.close()
+        new_page.set_cropbox(crop_rect)
+        new_page.set_mediabox(crop_rect)
+        column_pages += 1
+    return column_pages
 
+def split_pdf_to_columns(input_pdf_path, output_pdf_path, num_columns=SPLIT_NUM_COLUMNS, source_pdf_path=None, compact=None):
+    """
+    אלגוריתם חיתוך אטומי:
+    מפרק את העמוד למילים בודדות (Words) במקום שורות או בלוקים.
+    מחשב את רוחב הטור בדיוק לפי "השורה הארוכה ביותר" בטור (X מינימלי ומקסימלי של כל המילים).
+    מבצע מחיקה כירורגית למילים פולשות למניעת קטיעת טקסט.
+    החישובים נעשים על מערכי NumPy, ומספר הטורים ניתן להגדרה (num_columns).
+    source_pdf_path: מסמך חלופי שממנו מצוירים העמודים (למשל הגרסה בשחור-לבן), בעוד שהפריסה
+    מחושבת תמיד מ-input_pdf_path. כך גרסת השחור-לבן החתוכה לא דורשת הרצת Ghostscript נוספת.
+    compact: שמירה דחוסה (ברירת מחדל SPLIT_COMPACT_SAVE). באירוע split_save נרשמים גודל הפלט (bytes) וגודל
+    המסמך שממנו צוירו העמודים (source_bytes); ההשוואה לשמירה הרגילה נמדדת ב-benchmark.py (cut_bytes_plain).
+    """
+    with _MUPDF_LOCK:
+        doc = fitz.open(input_pdf_path)
+        source_doc = fitz.open(source_pdf_path) if source_pdf_path else doc
+        out_doc = fitz.open()
+        page_count = len(doc)
 
-def convert_pdf_to_bw(input_path, output_path):
+    # _MUPDF_LOCK לכל עמוד בנפרד, כדי שתצוגה מקדימה בסשן אחר תוכל להשתחל בין העמודים
+    for page_num in range(page_count):
+        with profile_stage("split_page", page=page_num) as prof, _MUPDF_LOCK:
+            prof["columns"] = _split_page_to_columns(doc, source_doc, out_doc, page_num, num_columns)
+
+    compact = SPLIT_COMPACT_SAVE if compact is None else compact
+    with _MUPDF_LOCK:
+        with profile_stage("split_save", pages=len(out_doc), compact=compact,
+                           source_bytes=os.path.getsize(source_pdf_path or input_pdf_path)) as prof:
+            out_doc.save(output_pdf_path, **(COMPACT_SAVE_OPTIONS if compact else {}))
+            prof["bytes"] = os.path.getsize(output_pdf_path)
+        out_doc.close()
+        if source_doc is not doc:
+            source_doc.close()
+        doc.close()
+
+def _same_page_geometry(pdf_path, other_pdf_path, tolerance=0.5):
+    """האם לשני המסמכים אותו מספר עמודים, ולכל עמוד אותו גודל נראה (CropBox) ואותו סיבוב"""
+    with _MUPDF_LOCK, fitz.open(pdf_path) as doc, fitz.open(other_pdf_path) as other:
+        if len(doc) != len(other):
+            return False
+        for page, other_page in zip(doc, other):
+            if page.rotation != other_page.rotation:
+                return False
+            if any(abs(a - b) > tolerance for a, b in zip(page.rect, other_page.rect)):
+                return False
+    return True
+
+def split_bw_pdf_to_columns(color_pdf_path, bw_pdf_path, output_pdf_path):
+    """
+    חיתוך הגרסה השחור-לבן: הפריסה מחושבת מהמסמך הצבעוני והעמודים מצוירים מ-bw_pdf_path.
+    זה תקף רק כשההמרה שמרה על גבולות העמודים - Ghostscript למשל מסובב עמודים לפי כיוון הטקסט
+    וכותב MediaBox/CropBox מחדש, ואז מלבני החיתוך של הצבעוני לא מתאימים לעמודי השחור-לבן.
+    במקרה כזה חותכים את הצבעוני וממירים את התוצאה לשחור-לבן.
+    """
+    if _same_page_geometry(color_pdf_path, bw_pdf_path):
+        split_pdf_to_columns(color_pdf_path, output_pdf_path, source_pdf_path=bw_pdf_path)
+        return
+    with profile_stage("split_bw_fallback"):
+        cut_color_path = f"{output_pdf_path}.color.tmp"
+        try:
+            split_pdf_to_columns(color_pdf_path, cut_color_path)
+            convert_pdf_to_bw(cut_color_path, output_pdf_path)
+        finally:
+            if os.path.exists(cut_color_path): os.remove(cut_color_path)
+
+
+# מנוע ההמרה לשחור-לבן: "ghostscript" (תהליך חיצוני) או "pymupdf" (בתוך התהליך, ללא gs - ראו grayscale.py)
+GRAYSCALE_BACKEND = os.environ.get("GRAYSCALE_BACKEND", "ghostscript")
+
+def _convert_bw_ghostscript(input_path, output_path):
     gs_cmd = [
         "gs",
         "-sOutputFile=" + output_path,
         "-sDEVICE=pdfwrite",
         "-sColorConversionStrategy=Gray",
         "-dProcessColorModel=/DeviceGray",
+        # בלי סיבוב אוטומטי, כדי שגבולות העמודים יתאימו למקור (ראו split_bw_pdf_to_columns)
+        "-dAutoRotatePages=/None",
         "-dCompatibilityLevel=1.4",
         "-dNOPAUSE",
         "-dBATCH",
         "-dQUIET",
         input_path
     ]
-    try:
-        subprocess.run(gs_cmd, check=True)
-    except Exception as e:
-        import shutil
-        shutil.copy(input_path, output_path)
-        print(f"Ghostscript error: {e}")
+    subprocess.run(gs_cmd, check=True)
+
+GRAYSCALE_BACKENDS = {
+    "ghostscript": _convert_bw_ghostscript,
+    "pymupdf": grayscale.convert_pdf_to_gray,
+}
+
+def convert_pdf_to_bw(input_path, output_path, backend=None):
+    """ממיר PDF לגווני אפור עם המנוע שנבחר (ברירת מחדל GRAYSCALE_BACKEND). בכישלון - מעתיק את המקור"""
+    backend = backend or GRAYSCALE_BACKEND
+    # Ghostscript רץ בתהליך חיצוני ולא נוגע ב-PyMuPDF; שאר המנועים רצים בתוך התהליך, תחת _MUPDF_LOCK
+    lock = nullcontext() if backend == "ghostscript" else _MUPDF_LOCK
+    with profile_stage("grayscale", backend=backend) as prof:
+        try:
+            with lock:
+                prof.update(GRAYSCALE_BACKENDS[backend](input_path, output_path) or {})
+        except Exception as e:
+            shutil.copy(input_path, output_path)
+            prof["error"] = f"{type(e).__name__}: {e}"
+            print(f"Grayscale ({backend}) error: {e}")
+
+MARKER_SCALES = np.linspace(0.4, 1.6, 12)
+MARKER_THRESHOLD = 0.7
+MARKER_RENDER_ZOOM = 1.2
+# חיפוש דו-שלבי: מעבר זול ברזולוציה נמוכה מאתר עמודים מועמדים ואת טווח הגודל,
+# ורק הם נבדקים שוב ברזולוציה מלאה. "exhaustive" מחזיר את הסריקה המלאה הישנה.
+MARKER_SEARCH_MODE = "coarse"
+MARKER_COARSE_FACTOR = 0.5
+MARKER_COARSE_THRESHOLD = 0.5
+# זיהוי מהיר לפי התמונות המוטמעות ב-PDF (בלי רינדור): תמונה שיחס המידות שלה דומה לתבנית
+# מוקטנת ומושווית לתבנית המוקטנת. רק אם לא נמצאו כך שני הסימנים - חוזרים לסריקה החזותית.
+MARKER_DIGEST_SCAN = os.environ.get("MARKER_DIGEST_SCAN", "1") == "1"
+MARKER_DIGEST_THRESHOLD = 0.8
+MARKER_DIGEST_ASPECT_TOLERANCE = 0.15
+MARKER_DIGEST_WIDTH = 64
+
+# סריקה ברצועות אופקיות (בנקודות PDF): רק רצועה אחת מרונדרת בכל רגע, והסריקה נעצרת ברצועה
+# שבה נמצא הסימן. הרצועות חופפות בגובה התבנית הגדולה ביותר כדי שסימן על הגבול לא יפוספס.
+# 0 = כל העמוד בבת אחת (בעמוד בלי סימן החפיפה מוסיפה עבודה)
+MARKER_BAND_HEIGHT = int(os.environ.get("MARKER_BAND_HEIGHT", "0"))
+
+def render_gray(page, zoom=MARKER_RENDER_ZOOM, clip=None):
+    """מרנדר ישירות לגווני אפור בלי ערוץ שקיפות - שליש מהזיכרון של RGB ובלי המרה נוספת"""
+    with _MUPDF_LOCK:
+        return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False, clip=clip)
+
+class PageRaster:
+    """
+    רינדור עצל של עמוד לגווני אפור - כל רזולוציה (ואזור, אם ניתן clip) מרונדרת פעם אחת לכל היותר.
+    המערכים הם תצוגה (view) על הזיכרון של ה-Pixmap, ולכן ה-Pixmap נשמר לצידם.
+    """
+    def __init__(self, page):
+        self.page = page
+        self._cache = {}
+
+    def gray(self, zoom=MARKER_RENDER_ZOOM, clip=None):
+        key = (zoom, tuple(clip) if clip is not None else None)
+        if key not in self._cache:
+            pix = render_gray(self.page, zoom, clip)
+            self._cache[key] = (pix, pixmap_to_gray(pix))
+        return self._cache[key][1]
+
+    def bands(self, clip=None, overlap=0.0, band_height=None):
+        """מחלק את האזור (ברירת מחדל: כל העמוד) לרצועות חופפות. None = בלי חלוקה"""
+        band_height = MARKER_BAND_HEIGHT if band_height is None else band_height
+        region = fitz.Rect(clip) if clip is not None else None
+        with _MUPDF_LOCK:
+            full = region or self.page.rect
+        if band_height <= 0 or full.height <= band_height + overlap:
+            yield region
+            return
+        y = full.y0
+        while y < full.y1:
+            yield fitz.Rect(full.x0, y, full.x1, min(full.y1, y + band_height + overlap))
+            if y + band_height + overlap >= full.y1:
+                break
+            y += band_height
+
+    def forget(self, clip):
+        """משחרר את הרינדורים של אזור שכבר נסרק"""
+        key_clip = tuple(clip) if clip is not None else None
+        with _MUPDF_LOCK:
+            for key in [k for k in self._cache if k[1] == key_clip]:
+                del self._cache[key]
+
+    def release(self):
+        with _MUPDF_LOCK:
+            self._cache.clear()
+            self.page = None
+
+class MarkerMatcher:
+    """
+    תבנית סימן (התחלה/סיום) שמפוענחת פעם אחת בלבד.
+    כל פירמידת הגדלים (רגילה ומוקטנת לשלב הגס) נבנית מראש ונשמרת, כך שסריקת עמוד מריצה רק matchTemplate.
+    """
+    def __init__(self, template_b64, threshold=MARKER_THRESHOLD, scales=MARKER_SCALES, coarse_factor=MARKER_COARSE_FACTOR):
+        self.threshold = threshold
+        self.coarse_factor = coarse_factor
+        self.scale_step = float(scales[1] - scales[0]) if len(scales) > 1 else 0.0
+        self.scale_range = (float(min(scales)), float(max(scales)))
+        img_data = base64.b64decode(template_b64)
+        np_arr_template = np.frombuffer(img_data, np.uint8)
+        self.template = cv2.imdecode(np_arr_template, cv2.IMREAD_GRAYSCALE)
+        self.pyramid = []
+        self.coarse_pyramid = []
+        # טביעות תוכן (hash של הזרם הגולמי) של תמונות מוטמעות שכבר זוהו כסימן - התאמה מיידית בפעם הבאה
+        self.known_digests = set()
+        if self.template is None:
+            return
+        self.pyramid = self._build_pyramid(scales)
+        self.coarse_pyramid = self._build_pyramid(scales, coarse_factor)
+        self.aspect = self.template.shape[1] / self.template.shape[0]
+        self.thumbnail = _digest_thumbnail(self.template, self.aspect)
+
+    def _build_pyramid(self, scales, factor=1.0):
+        pyramid = []
+        for scale in scales:
+            width = int(self.template.shape[1] * scale * factor)
+            height = int(self.template.shape[0] * scale * factor)
+            if height == 0 or width == 0: continue
+            resized_template = cv2.resize(self.template, (width, height), interpolation=cv2.INTER_AREA)
+            pyramid.append((float(scale), resized_template))
+        return pyramid
+
+    @classmethod
+    def from_file(cls, image_path, threshold=MARKER_THRESHOLD):
+        with open(image_path, "rb") as f:
+            return cls(base64.b64encode(f.read()), threshold)
+
+    @staticmethod
+    def _best_score(gray_img, pyramid, stop_at=None):
+        """מחזיר (ציון מקסימלי, הגודל שבו הושג). עוצר מוקדם כשהציון עובר את stop_at"""
+        best_val, best_scale = -1.0, None
+        for scale, resized_template in pyramid:
+            height, width = resized_template.shape
+            if height > gray_img.shape[0] or width > gray_img.shape[1]: continue
+            result = cv2.matchTemplate(gray_img, resized_template, cv2.TM_CCOEFF_NORMED)
+            _, max_val, _, _ = cv2.minMaxLoc(result)
+            if max_val > best_val:
+                best_val, best_scale = max_val, scale
+            if stop_at is not None and max_val >= stop_at:
+                break
+        return best_val, best_scale
+
+    def match(self, gray_img, scale_band=None):
+        """
+        מחזיר True אם התבנית נמצאה בתמונה (אפורה) באחד מהגדלים.
+        scale_band=(min, max) מצמצם את הבדיקה לטווח גדלים מסוים.
+        """
+        pyramid = self.pyramid
+        if scale_band is not None:
+            pyramid = [(s, t) for s, t in pyramid if scale_band[0] <= s <= scale_band[1]]
+        best_val, _ = self._best_score(gray_img, pyramid, stop_at=self.threshold)
+        return best_val >= self.threshold
+
+    def aspect_matches(self, width, height):
+        return bool(width and height) and abs(width / height - self.aspect) / self.aspect <= MARKER_DIGEST_ASPECT_TOLERANCE
+
+    def drawn_size_matches(self, bbox):
+        """האם התמונה מצוירת בעמוד ביחס מידות ובגודל שהסריקה החזותית הייתה מזהה (טווח הגדלים של הפירמידה)"""
+        tolerance = MARKER_DIGEST_ASPECT_TOLERANCE
+        if bbox.width <= 0 or bbox.height <= 0:
+            return False
+        if abs(bbox.width / bbox.height - self.aspect) / self.aspect > tolerance:
+            return False
+        scale = bbox.width * MARKER_RENDER_ZOOM / self.template.shape[1]
+        return self.scale_range[0] * (1 - tolerance) <= scale <= self.scale_range[1] * (1 + tolerance)
+
+    def match_embedded_image(self, images, xref, width, height, bbox):
+        """
+        בודק תמונה מוטמעת בלי לרנדר את העמוד. images הוא EmbeddedImages של המסמך, bbox המלבן שבו היא מצוירת.
+        סינון לפי יחס מידות וגודל הציור לא דורש פענוח; רק תמונות שעברו אותו מפוענחות (פעם אחת לכל xref).
+        """
+        if self.template is None or not self.aspect_matches(width, height) or not self.drawn_size_matches(bbox):
+            return False
+        digest = images.digest(xref)
+        if digest in self.known_digests:
+            return True
+        gray = images.gray(xref)
+        if gray is None:
+            return False
+        thumbnail = cv2.resize(gray, (self.thumbnail.shape[1], self.thumbnail.shape[0]), interpolation=cv2.INTER_AREA)
+        score = float(cv2.matchTemplate(thumbnail, self.thumbnail, cv2.TM_CCOEFF_NORMED)[0, 0])
+        if score >= MARKER_DIGEST_THRESHOLD:
+            self.known_digests.add(digest)
+            return True
+        return False
+
+    def match_page(self, raster, search_mode=MARKER_SEARCH_MODE, clip=None):
+        """
+        בודק עמוד (PageRaster) לפי מצב החיפוש - דו-שלבי או מלא.
+        clip מגביל את הבדיקה לאזור בעמוד (למשל היכן שהסימן צפוי); עם MARKER_BAND_HEIGHT האזור נסרק ברצועות.
+        """
+        # גובה התבנית הגדולה ביותר בנקודות PDF - החפיפה בין רצועות
+        overlap = self.template.shape[0] * max(s for s, _ in self.pyramid) / MARKER_RENDER_ZOOM if self.pyramid else 0.0
+        for band in raster.bands(clip, overlap):
+            found = self._match_region(raster, search_mode, band)
+            if band != clip:
+                # רצועה שנסרקה לא תידרש שוב - משחררים אותה מיד
+                raster.forget(band)
+            if found:
+                return True
+        return False
 
-def find_image_in_page(page_pixmap, template_b64, threshold=0.7):
-    img_array = np.frombuffer(page_pixmap.samples, dtype=np.uint8).reshape(page_pixmap.h, page_pixmap.w, page_pixmap.n)
+    def _match_region(self, raster, search_mode, clip):
+        if search_mode == "exhaustive":
+            return self.match(raster.gray(MARKER_RENDER_ZOOM, clip))
+
+        # שלב 1: מעבר גס ברזולוציה מוקטנת - מוצא את הגודל הטוב ביותר
+        coarse_val, coarse_scale = self._best_score(raster.gray(MARKER_RENDER_ZOOM * self.coarse_factor, clip), self.coarse_pyramid)
+        if coarse_scale is None or coarse_val < MARKER_COARSE_THRESHOLD:
+            return False
+
+        # שלב 2: אימות ברזולוציה מלאה ובסף הרגיל, רק סביב הגודל שנמצא
+        margin = self.scale_step * 1.01
+        return self.match(raster.gray(MARKER_RENDER_ZOOM, clip), scale_band=(coarse_scale - margin, coarse_scale + margin))
+
+def _digest_thumbnail(gray, aspect):
+    width = MARKER_DIGEST_WIDTH
+    height = max(1, round(width / aspect))
+    return cv2.resize(gray, (width, height), interpolation=cv2.INTER_AREA)
+
+class EmbeddedImages:
+    """פענוח עצל של התמונות המוטמעות במסמך: כל xref מפוענח לכל היותר פעם אחת, גם אם הוא חוזר בכמה עמודים"""
+    def __init__(self, doc):
+        self.doc = doc
+        self._digests = {}
+        self._grays = {}
+
+    def digest(self, xref):
+        if xref not in self._digests:
+            try:
+                self._digests[xref] = hashlib.sha1(self.doc.xref_stream_raw(xref) or b"").hexdigest()
+            except RuntimeError:
+                self._digests[xref] = None
+        return self._digests[xref]
+
+    def gray(self, xref):
+        """התמונה בגווני אפור, מוקטנת לרוחב של עד 256 פיקסלים (מספיק להשוואה מול התבנית המוקטנת)"""
+        if xref not in self._grays:
+            try:
+                pix = fitz.Pixmap(self.doc, xref)
+                if pix.alpha:
+                    pix = fitz.Pixmap(pix, 0)
+                if pix.n != 1:
+                    pix = fitz.Pixmap(fitz.csGRAY, pix)
+                gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.h, pix.w, pix.n)[:, :, 0]
+                if gray.shape[1] > 256:
+                    gray = cv2.resize(gray, (256, max(1, round(gray.shape[0] * 256 / gray.shape[1]))), interpolation=cv2.INTER_AREA)
+                self._grays[xref] = np.ascontiguousarray(gray)
+            except (RuntimeError, ValueError):
+                self._grays[xref] = None
+        return self._grays[xref]
+
+@st.cache_resource
+def get_marker_matchers(start_img="start.png", end_img="end.png"):
+    """טוען את תבניות ההתחלה והסיום פעם אחת ומשתף אותן בין כל הסשנים"""
+    return MarkerMatcher.from_file(start_img), MarkerMatcher.from_file(end_img)
+
+def _as_matcher(template, threshold=MARKER_THRESHOLD):
+    if isinstance(template, MarkerMatcher):
+        return template
+    return MarkerMatcher(template, threshold)
+
+def pixmap_to_gray(page_pixmap):
+    """
+    מערך אפור מתוך Pixmap. Pixmap אפור בלי שקיפות (כמו מ-render_gray) עטוף כתצוגה על הזיכרון שלו
+    בלי העתקה, ולכן הוא חייב להישאר בחיים כל עוד משתמשים במערך. RGB/RGBA מומר (עם העתקה).
+    """
+    img_array = np.frombuffer(page_pixmap.samples_mv, dtype=np.uint8).reshape(page_pixmap.h, page_pixmap.stride)
+    if page_pixmap.n == 1:
+        return img_array[:, :page_pixmap.w]
+    img_array = img_array[:, :page_pixmap.w * page_pixmap.n].reshape(page_pixmap.h, page_pixmap.w, page_pixmap.n)
     if page_pixmap.n >= 3:
-        img_array = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
-    img_data = base64.b64decode(template_b64)
-    np_arr_template = np.frombuffer(img_data, np.uint8)
-    template = cv2.imdecode(np_arr_template, cv2.IMREAD_GRAYSCALE)
-    if template is None: return False
-    
-    found = False
-    for scale in np.linspace(0.4, 1.6, 12):
-        width = int(template.shape[1] * scale)
-        height = int(template.shape[0] * scale)
-        if height == 0 or width == 0 or height > img_array.shape[0] or width > img_array.shape[1]: continue
-        resized_template = cv2.resize(template, (width, height), interpolation=cv2.INTER_AREA)
-        result = cv2.matchTemplate(img_array, resized_template, cv2.TM_CCOEFF_NORMED)
-        _, max_val, _, _ = cv2.minMaxLoc(result)
-        if max_val >= threshold: 
-            found = True
-            break
-            
-    return found
+        img_array = cv2.cvtColor(img_array, cv2.COLOR_RGBA2GRAY if page_pixmap.alpha else cv2.COLOR_RGB2GRAY)
+    else:
+        # אפור עם שקיפות
+        img_array = np.ascontiguousarray(img_array[:, :, 0])
+    return img_array
+
+def find_image_in_page(page_pixmap, template, threshold=MARKER_THRESHOLD):
+    """template יכול להיות MarkerMatcher מוכן (מומלץ) או מחרוזת base64 של התמונה"""
+    return _as_matcher(template, threshold).match(pixmap_to_gray(page_pixmap))
+
+# סריקה מקבילית: כל תהליך עובד פותח מסמך משלו וסורק טווח עמודים משלו.
+# ברירת המחדל היא תהליך אחד (סריקה רציפה) כדי לשמור על השרתים המוגבלים.
+# מספר תהליכי הסריקה: 0 - לפי מספר המעבדים הזמינים; בכל מקרה לא יותר מהם, ועם מעבד אחד הסריקה רציפה
+MARKER_SCAN_WORKERS = int(os.environ.get("MARKER_SCAN_WORKERS", "0"))
+MARKER_WORKER_MEMORY_MB = int(os.environ.get("MARKER_WORKER_MEMORY_MB", "768"))
+# זמן מקסימלי לסריקה המקבילה; עובד שנתקע בלי לקרוס לא יחזיק את הבנייה לנצח
+MARKER_SCAN_TIMEOUT_SECONDS = int(os.environ.get("MARKER_SCAN_TIMEOUT_SECONDS", "120"))
+
+def _available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # לא קיים ב-macOS/Windows
+        return os.cpu_count() or 1
 
-def extract_pdf_by_images(input_pdf_path, output_pdf_path, start_image_b64, end_image_b64):
-    doc = fitz.open(input_pdf_path)
+def _marker_scan_workers(requested):
+    """מספר התהליכים בפועל: requested (או MARKER_SCAN_WORKERS), 0 - מספר המעבדים, ולא יותר מהם"""
+    requested = MARKER_SCAN_WORKERS if requested is None else requested
+    cpus = _available_cpus()
+    return min(requested, cpus) if requested > 0 else cpus
+
+def _scan_markers_sequential(doc, start_matcher, end_matcher, search_mode):
     start_page = -1
     end_page = -1
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        pix = page.get_pixmap(matrix=fitz.Matrix(1.2, 1.2))
-        
-        if start_page == -1:
-            if find_image_in_page(pix, start_image_b64): 
-                start_page = page_num
-                
-        if start_page != -1 and end_page == -1:
-            if find_image_in_page(pix, end_image_b64):
-                end_page = page_num
-                # שחרור זיכרון מידי לפני יציאה מהלולאה
-                pix = None
-                page = None
+    with _MUPDF_LOCK:
+        page_count = len(doc)
+    for page_num in range(page_count):
+        with profile_stage("marker_scan_page", page=page_num, mode="sequential"):
+            # רק הטעינה והרינדור (בתוך PageRaster) תחת _MUPDF_LOCK; ההשוואה לתבניות רצה בלעדיו
+            with _MUPDF_LOCK:
+                raster = PageRaster(doc.load_page(page_num))
+            
+            if start_page == -1:
+                if start_matcher.match_page(raster, search_mode): 
+                    start_page = page_num
+                    
+            if start_page != -1 and end_page == -1:
+                if end_matcher.match_page(raster, search_mode):
+                    end_page = page_num
+                    # שחרור זיכרון מידי לפני יציאה מהלולאה
+                    raster.release()
+                    break
+                    
+            # שחרור זיכרון RAM אגרסיבי לאחר כל עמוד כדי למנוע קריסה
+            raster.release()
+            raster = None
+            gc.collect()
+    return start_page, end_page
+
+def _limit_process_memory(memory_limit_mb):
+    """תקרת זיכרון לתהליך בן, נמדדת מעבר לזיכרון שהתהליך כבר ירש מהתהליך הראשי"""
+    if not memory_limit_mb or resource is None:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * resource.getpagesize()
+        limit = current + memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError):
+        pass
+
+def _marker_scan_worker(input_pdf_path, page_count, start_matcher, end_matcher, search_mode, memory_limit_mb, results, stop_event, next_page, start_page):
+    """
+    תהליך עובד: לוקח את העמוד הבא מהמונה המשותף (כך שהעמודים נסרקים בערך לפי הסדר והעצירה המוקדמת
+    חוסכת את כל מה שאחרי הסימן), ומדווח על כל עמוד בנפרד לתהליך הראשי.
+    start_page הוא העמוד הנמוך ביותר שנמצא בו סימן התחלה עד כה: בעמודים שאחריו אין צורך לחפש התחלה,
+    ובעמודים שלפניו אין צורך לחפש סיום. כל עוד אף התחלה לא נמצאה גם הסיום לא נבדק (None),
+    והתהליך הראשי משלים את הבדיקה לעמודים הבודדים שיתבררו כנחוצים.
+    """
+    # ה-fork יכול לתפוס את תהליכון דגימת הזיכרון באמצע _RSS_WATCH_LOCK, ואז המנעול נשאר נעול אצל הבן
+    _reset_after_fork()
+    cv2.setNumThreads(1)
+    _limit_process_memory(memory_limit_mb)
+    try:
+        doc = fitz.open(input_pdf_path)
+        while not stop_event.is_set():
+            with next_page.get_lock():
+                page_num = next_page.value
+                next_page.value += 1
+            if page_num >= page_count:
                 break
-                
-        # שחרור זיכרון RAM אגרסיבי לאחר כל עמוד כדי למנוע קריסה
-        pix = None
-        page = None
-        gc.collect()
-
-    if start_page != -1 and end_page != -1:
-        new_doc = fitz.open()
-        new_doc.insert_pdf(doc, from_page=start_page, to_page=end_page)
-        new_doc.save(output_pdf_path)
-        new_doc.close()
+            before = _resource_snapshot()
+            watch, rss_start = _start_rss_watch()
+            wall_start = time.perf_counter()
+            raster = PageRaster(doc.load_page(page_num))
+            has_start = has_end = None
+            if start_page.value == -1 or page_num < start_page.value:
+                has_start = start_matcher.match_page(raster, search_mode)
+                if has_start:
+                    with start_page.get_lock():
+                        if start_page.value == -1 or page_num < start_page.value:
+                            start_page.value = page_num
+            if start_page.value != -1 and page_num >= start_page.value:
+                has_end = end_matcher.match_page(raster, search_mode)
+            raster.release()
+            raster = None
+            gc.collect()
+            # המדידה נרשמת בתהליך הראשי, שם נמצאים יומן האירועים ולוח הניטור
+            rss, peak = _stop_rss_watch(watch)
+            stats = {
+                "wall_s": round(time.perf_counter() - wall_start, 4),
+                "cpu_s": round(time.thread_time() - before["cpu"], 4),
+                "rss_mb": rss,
+                "peak_rss_mb": peak,
+                "peak_growth_mb": round(peak - rss_start, 1) if peak is not None and rss_start is not None else None,
+                "worker_pid": os.getpid(),
+            }
+            results.put((page_num, has_start, has_end, stats))
+        doc.close()
+    except (MemoryError, RuntimeError, cv2.error) as e:
+        # חריגה ממגבלת הזיכרון - התהליך הראשי יחזור לסריקה רציפה
+        try:
+            results.put(("error", str(e), None, None))
+        except Exception:
+            pass
+
+def _resolve_marker_pages(page_results, page_count, check_end=None):
+    """
+    מחשב את עמודי ההתחלה והסיום מתוך תוצאות חלקיות, באותה סמנטיקה של הסריקה הרציפה.
+    page_results: {עמוד: (יש התחלה, יש סיום)}, כש-None מסמן בדיקה שלא נעשתה. עמוד אחרי ההתחלה
+    שהסיום בו לא נבדק נבדק דרך check_end(עמוד). מחזיר None כל עוד חסרים עמודים כדי להכריע.
+    """
+    start_page = -1
+    for page_num in range(page_count):
+        if page_num not in page_results:
+            return None
+        if page_results[page_num][0]:
+            start_page = page_num
+            break
+    if start_page == -1:
+        return -1, -1
+    for page_num in range(start_page, page_count):
+        if page_num not in page_results:
+            return None
+        has_start, has_end = page_results[page_num]
+        if has_end is None:
+            if check_end is None:
+                return None
+            has_end = check_end(page_num)
+            page_results[page_num] = (has_start, has_end)
+        if has_end:
+            return start_page, page_num
+    return start_page, -1
+
+def _scan_markers_parallel(input_pdf_path, page_count, start_matcher, end_matcher, search_mode, workers, memory_limit_mb, timeout=None):
+    """
+    סורק בכמה תהליכים שלוקחים עמודים ממונה משותף, ועוצר את כולם ברגע שעמודי ההתחלה והסיום ידועים.
+    מחזיר None אם אחד העובדים קרס (למשל חריגה ממגבלת הזיכרון) או שהסריקה חרגה מ-timeout
+    (ברירת מחדל MARKER_SCAN_TIMEOUT_SECONDS), כדי לחזור לסריקה רציפה.
+    """
+    timeout = MARKER_SCAN_TIMEOUT_SECONDS if timeout is None else timeout
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    results = ctx.Queue()
+    stop_event = ctx.Event()
+    next_page = ctx.Value("i", 0)
+    start_page = ctx.Value("i", -1)
+    procs = []
+    for _ in range(workers):
+        proc = ctx.Process(
+            target=_marker_scan_worker,
+            args=(input_pdf_path, page_count, start_matcher, end_matcher, search_mode, memory_limit_mb,
+                  results, stop_event, next_page, start_page),
+            daemon=True
+        )
+        proc.start()
+        procs.append(proc)
+
+    doc = None
+
+    def check_end(page_num):
+        # עמוד שנסרק לפני שההתחלה נמצאה והתברר שהוא אחריה: בדיקת הסיום בלבד, בתהליך הראשי
+        nonlocal doc
+        with _MUPDF_LOCK:
+            doc = doc or fitz.open(input_pdf_path)
+            raster = PageRaster(doc.load_page(page_num))
+        has_end = end_matcher.match_page(raster, search_mode)
+        raster.release()
+        return has_end
+
+    page_results = {}
+    resolved = None
+    failed = False
+    deadline = time.monotonic() + timeout
+    try:
+        while resolved is None:
+            if time.monotonic() > deadline:
+                record_profile_event({"stage": "marker_scan_page", "mode": "parallel", "error": f"timeout after {timeout}s"})
+                failed = True
+                break
+            try:
+                page_num, has_start, has_end, stats = results.get(timeout=min(1, max(0.01, deadline - time.monotonic())))
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs) and results.empty():
+                    failed = True
+                    break
+                continue
+            if page_num == "error":
+                record_profile_event({"stage": "marker_scan_page", "mode": "parallel", "error": has_start})
+                failed = True
+                break
+            record_profile_event({"stage": "marker_scan_page", "page": page_num, "mode": "parallel", **stats})
+            page_results[page_num] = (has_start, has_end)
+            resolved = _resolve_marker_pages(page_results, page_count, check_end)
+    finally:
+        stop_event.set()
+        if failed:
+            for proc in procs:
+                proc.terminate()
+        for proc in procs:
+            proc.join(timeout=5)
+            if proc.is_alive():
+                proc.kill()
+                proc.join()
+        if doc is not None:
+            with _MUPDF_LOCK:
+                doc.close()
+
+    if failed and resolved is None:
+        return None
+    return resolved
+
+def _scan_markers_embedded(doc, start_matcher, end_matcher):
+    """
+    מחפש את הסימנים בין התמונות שכל עמוד מצייר בפועל (get_image_info), בלי לרנדר אף עמוד.
+    לא משתמשים ב-get_page_images: הוא מחזיר כל תמונה במילון /Resources, שלעתים משותף לכמה עמודים,
+    גם אם העמוד לא מצייר אותה.
+    מחזיר (עמוד התחלה, עמוד סיום), או None אם אחד הסימנים לא נמצא כתמונה מוטמעת -
+    למשל כשהוא צויר כגרפיקה וקטורית או שהוא חלק מתמונה גדולה יותר - ואז עוברים לסריקה החזותית.
+    """
+    images = EmbeddedImages(doc)
+    start_page = -1
+    with _MUPDF_LOCK:
+        page_count = len(doc)
+    for page_num in range(page_count):
+        # כל עמוד תחת _MUPDF_LOCK בנפרד: קריאת המשאבים ופענוח התמונות הם קריאות ל-PyMuPDF
+        with _MUPDF_LOCK:
+            # סינון זול לפי המשאבים: עמוד שאין בהם תמונה ביחס המידות של סימן לא יכול לצייר סימן
+            if not any(matcher.aspect_matches(img[2], img[3]) for img in doc.get_page_images(page_num)
+                       for matcher in (start_matcher, end_matcher) if matcher.template is not None):
+                continue
+            page_images = [(info["xref"], info["width"], info["height"], fitz.Rect(info["bbox"]))
+                           for info in doc[page_num].get_image_info(xrefs=True) if info["xref"]]
+            if start_page == -1 and any(start_matcher.match_embedded_image(images, *img) for img in page_images):
+                start_page = page_num
+            if start_page != -1 and any(end_matcher.match_embedded_image(images, *img) for img in page_images):
+                return start_page, page_num
+    return None
+
+def _probe_order(page_count, center, min_page=0):
+    """סדר בדיקה שמתחיל בעמוד המשוער ומתרחב החוצה לשני הכיוונים (במקרה של תיקו - העמוד המוקדם קודם)"""
+    center = min(max(center, min_page), page_count - 1)
+    return sorted(range(min_page, page_count), key=lambda p: (abs(p - center), p))
+
+def _scan_markers_hinted(doc, start_matcher, end_matcher, search_mode, scan_hint):
+    """
+    סריקה לפי מיקומי הסימנים בגיליונות הקודמים: בודק קודם את העמודים המשוערים ומתרחב החוצה.
+    מניח סימן התחלה אחד וסימן סיום אחד בגיליון, כך שבמקרה הרגיל מרונדרים עמודים בודדים בלבד.
+    """
+    with _MUPDF_LOCK:
+        page_count = len(doc)
+    hint_start, hint_end = scan_hint
+    checked = {}
+
+    def has_marker(page_num, matcher):
+        key = (page_num, id(matcher))
+        if key not in checked:
+            with profile_stage("marker_scan_page", page=page_num, mode="hinted"):
+                with _MUPDF_LOCK:
+                    raster = PageRaster(doc.load_page(page_num))
+                checked[key] = matcher.match_page(raster, search_mode)
+                raster.release()
+                raster = None
+                gc.collect()
+        return checked[key]
+
+    start_page = next((p for p in _probe_order(page_count, hint_start) if has_marker(p, start_matcher)), -1)
+    if start_page == -1:
+        return -1, -1
+    end_page = next((p for p in _probe_order(page_count, hint_end, start_page) if has_marker(p, end_matcher)), -1)
+    return start_page, end_page
+
+def get_scan_hint(config):
+    """מחזיר את מיקומי הסימנים מהריצה הקודמת (כפי שנשמרו ע"י save_config), או None"""
+    hint_start = config.get("last_start_page")
+    hint_end = config.get("last_end_page")
+    if isinstance(hint_start, int) and isinstance(hint_end, int):
+        return hint_start, hint_end
+    return None
+
+def extract_pdf_by_images(input_pdf_path, output_pdf_path, start_marker, end_marker, search_mode=MARKER_SEARCH_MODE, workers=None, memory_limit_mb=None, scan_hint=None, scan_info=None):
+    """
+    start_marker / end_marker: אובייקטי MarkerMatcher (או base64 של התמונות, לתאימות לאחור).
+    search_mode: "coarse" (דו-שלבי, ברירת מחדל) או "exhaustive" (כל הגדלים ברזולוציה מלאה בכל עמוד).
+    workers: מספר תהליכי סריקה מקבילים (ברירת מחדל MARKER_SCAN_WORKERS, לא יותר ממספר המעבדים). memory_limit_mb: תקרת זיכרון לכל תהליך.
+    scan_hint: (עמוד התחלה, עמוד סיום) משוערים מהריצה הקודמת - נבדקים ראשונים ומשם מתרחבים החוצה.
+    scan_info: מילון אופציונלי שיתמלא במספרי העמודים שנמצאו (לשמירה לריצה הבאה).
+    """
+    # פענוח התבניות ובניית פירמידת הגדלים פעם אחת לכל המסמך ולא בכל עמוד
+    start_matcher = _as_matcher(start_marker)
+    end_matcher = _as_matcher(end_marker)
+    workers = _marker_scan_workers(workers)
+    memory_limit_mb = MARKER_WORKER_MEMORY_MB if memory_limit_mb is None else memory_limit_mb
+    with _MUPDF_LOCK:
+        doc = fitz.open(input_pdf_path)
+        page_count = len(doc)
+
+    found = None
+    with profile_stage("marker_scan", page_count=page_count, search_mode=search_mode) as prof:
+        if MARKER_DIGEST_SCAN:
+            prof["strategy"] = "embedded"
+            found = _scan_markers_embedded(doc, start_matcher, end_matcher)
+        if found is None and scan_hint is not None and page_count > 0:
+            prof["strategy"] = "hinted"
+            found = _scan_markers_hinted(doc, start_matcher, end_matcher, search_mode, scan_hint)
+        elif found is None and workers > 1 and page_count > 1:
+            prof["strategy"] = "parallel"
+            found = _scan_markers_parallel(input_pdf_path, page_count, start_matcher, end_matcher, search_mode, min(workers, page_count), memory_limit_mb)
+        if found is None:
+            prof["strategy"] = "sequential"
+            found = _scan_markers_sequential(doc, start_matcher, end_matcher, search_mode)
+        start_page, end_page = found
+        prof["start_page"], prof["end_page"] = start_page, end_page
+    if scan_info is not None:
+        scan_info.update({"start_page": start_page, "end_page": end_page, "page_count": page_count})
+
+    with _MUPDF_LOCK:
+        if start_page != -1 and end_page != -1:
+            new_doc = fitz.open()
+            new_doc.insert_pdf(doc, from_page=start_page, to_page=end_page)
+            new_doc.save(output_pdf_path)
+            new_doc.close()
+            doc.close()
+            return True
+
         doc.close()
-        return True
-        
-    doc.close()
     return False
 
+# --- תזמון שלבי העיבוד ---
+
+PIPELINE_WORKERS = int(os.environ.get("PIPELINE_WORKERS", "2"))
+# PyMuPDF אינו בטוח לשימוש מכמה תהליכונים במקביל, ולכן כל קריאה אליו (בכל הסשנים ובכל השלבים)
+# נעשית תחת המנעול הזה. המנעול נלקח סביב הקריאות עצמן - לכל היותר עמוד אחד בכל פעם - ולא סביב שלב שלם,
+# כך שתצוגה מקדימה לא ממתינה לסוף בנייה. הוא רקורסיבי כי פונקציות מוגנות קוראות זו לזו.
+_MUPDF_LOCK = process_shared("mupdf_rlock", threading.RLock)
+
+class PipelineStage:
+    """שלב בגרף העיבוד: פונקציה, השלבים שהוא תלוי בהם וקובץ הפלט שלו"""
+    def __init__(self, name, func, deps=(), output=None):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.output = output
+
+    def run(self):
+        start = time.perf_counter()
+        with profile_stage(f"stage:{self.name}") as prof:
+            result = self.func()
+            prof["ok"] = result is not False
+        return result is not False, time.perf_counter() - start
+
+def run_stages(stages, max_workers=PIPELINE_WORKERS, skip_existing=False, timings=None):
+    """
+    מריץ גרף שלבים (DAG): כל שלב מתחיל ברגע שכל התלויות שלו הסתיימו, עד max_workers במקביל.
+    שלב שמחזיר False עוצר את כל מה שתלוי בו. skip_existing מדלג על שלבים שקובץ הפלט שלהם כבר קיים.
+    מחזיר True אם כל השלבים הצליחו. timings (מילון אופציונלי) מתמלא בזמן הריצה של כל שלב בשניות.
+    """
+    timings = {} if timings is None else timings
+    pending = {}
+    for stage in stages:
+        if skip_existing and stage.output and os.path.exists(stage.output):
+            continue
+        pending[stage.name] = stage
+    # תלות בשלב שדולג או שלא קיים בגרף נחשבת כמסופקת
+    scheduled = set(pending)
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if all(dep in done or dep not in scheduled for dep in stage.deps):
+                    running[pool.submit(stage.run)] = name
+                    del pending[name]
+            if not running:
+                # שלבים שנשארו תלויים בשלב שנכשל
+                return False
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                ok, seconds = future.result()
+                timings[name] = round(seconds, 4)
+                if ok:
+                    done.add(name)
+                else:
+                    for future_left in running:
+                        future_left.cancel()
+                    wait(running)
+                    return False
+    return True
+
+# מצב עצל: רק הקובץ הרגיל נוצר מיד, וכל גרסה אחרת נבנית בפעם הראשונה שמבקשים אותה
+# (ונשמרת על הדיסק לשימוש כל הסשנים). "0" מחזיר את הבנייה המלאה מראש.
+LAZY_VARIANTS = os.environ.get("LAZY_VARIANTS", "1") == "1"
+EAGER_VARIANTS = ("regular",) if LAZY_VARIANTS else ("regular", "regular_bw", "cut", "cut_bw")
+
+# איך נבנית כל גרסה מתוך הגרסאות שהיא תלויה בהן: (תלויות, פונקציית בנייה(outputs, output_path))
+VARIANT_BUILDERS = {
+    "regular_bw": (("regular",), lambda outputs, path: convert_pdf_to_bw(outputs["regular"], path)),
+    "cut": (("regular",), lambda outputs, path: split_pdf_to_columns(outputs["regular"], path)),
+    "cut_bw": (("regular", "regular_bw"), lambda outputs, path: split_bw_pdf_to_columns(outputs["regular"], outputs["regular_bw"], path)),
+}
+
+def _variant_closure(targets):
+    """כל הגרסאות שצריך לבנות כדי לקבל את targets (כולל תלויות)"""
+    needed = set()
+    stack = list(targets)
+    while stack:
+        variant = stack.pop()
+        if variant in needed:
+            continue
+        needed.add(variant)
+        if variant in VARIANT_BUILDERS:
+            stack.extend(VARIANT_BUILDERS[variant][0])
+    return needed
+
+def process_document(input_path, outputs, start_matcher=None, end_matcher=None, scan_hint=None, scan_info=None, skip_existing=False, timings=None, targets=None):
+    """
+    שרשרת העיבוד המשותפת לאוטומטי ולידני: חיתוך לפי הסימנים, ואז המרה לשחור-לבן וחיתוך לטורים,
+    ולבסוף חיתוך הגרסה השחור-לבן. outputs הוא מילון {variant: path}.
+    השלבים מתוזמנים יחד, אבל קריאות PyMuPDF שלהם עוברות אחת-אחת דרך _MUPDF_LOCK (עמוד בכל פעם);
+    חפיפה אמיתית יש רק ל-Ghostscript, להשוואת התבניות ולחישובי NumPy.
+    input_path=None מדלג על שלב החיתוך (כשהקובץ הרגיל כבר קיים).
+    targets: הגרסאות שיש לבנות עכשיו (ברירת מחדל EAGER_VARIANTS); השאר ייבנו לפי דרישה ב-ensure_variant.
+    """
+    needed = _variant_closure(EAGER_VARIANTS if targets is None else targets)
+    stages = []
+    if input_path:
+        stages.append(PipelineStage("extract", lambda: extract_pdf_by_images(
+            input_path, outputs["regular"], start_matcher, end_matcher, scan_hint=scan_hint, scan_info=scan_info
+        ), output=outputs["regular"]))
+    for variant, (deps, build) in VARIANT_BUILDERS.items():
+        if variant not in needed:
+            continue
+        stages.append(PipelineStage(
+            variant, lambda build=build, variant=variant: build(outputs, outputs[variant]),
+            deps=["extract" if dep == "regular" else dep for dep in deps],
+            output=outputs[variant]
+        ))
+    return run_stages(stages, skip_existing=skip_existing, timings=timings)
+
+_VARIANT_LOCKS = process_shared("variant_locks", dict)
+_VARIANT_LOCKS_GUARD = process_shared("variant_locks_guard", threading.Lock)
+
+def _path_lock(path):
+    with _VARIANT_LOCKS_GUARD:
+        return _VARIANT_LOCKS.setdefault(os.path.abspath(path), threading.Lock())
+
+def ensure_variant(outputs, variant):
+    """
+    מחזיר את הנתיב של הגרסה המבוקשת, ובונה אותה (ואת התלויות שלה) אם עדיין לא קיימת.
+    הבנייה נעשית לקובץ זמני שמוחלף בשינוי שם אטומי, ומנעול לכל קובץ מונע בנייה כפולה בין סשנים.
+    """
+    path = outputs[variant]
+    if os.path.exists(path) or variant not in VARIANT_BUILDERS:
+        return path
+    with _path_lock(path):
+        if os.path.exists(path):
+            return path
+        deps, build = VARIANT_BUILDERS[variant]
+        for dep in deps:
+            ensure_variant(outputs, dep)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            PipelineStage(variant, lambda: build(outputs, tmp_path)).run()
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+    return path
+
+# --- מאגר תוצרים משותף (לפי תוכן) ---
+
+# יש להעלות את הגרסה בכל שינוי שמשפיע על קבצי הפלט, כדי שתוצאות ישנות לא יוגשו מהמטמון
+PIPELINE_VERSION = "7"
+RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB", "500"))
+RESULT_CACHE_MAX_AGE_DAYS = int(os.environ.get("RESULT_CACHE_MAX_AGE_DAYS", "30"))
+# סשן שהציג רשומה בשעה האחרונה מחזיק בה הפניה, והיא לא תימחק מתחתיו
+RESULT_REF_TTL_SECONDS = 3600
+RESULT_VARIANTS = ("regular", "regular_bw", "cut", "cut_bw")
+_REFS_DIR = ".refs"
+_ALIASES_DIR = ".aliases"
+
+def _file_sha256(path, hasher=None):
+    hasher = hasher or hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hasher.update(chunk)
+    return hasher
+
+def result_cache_key(input_path, start_img="start.png", end_img="end.png"):
+    """מפתח המטמון: hash של קובץ הקלט, של תמונות הסימנים, של גרסת התהליך ושל מנוע השחור-לבן"""
+    hasher = hashlib.sha256(f"pipeline-v{PIPELINE_VERSION}-{GRAYSCALE_BACKEND}".encode())
+    for path in (start_img, end_img, input_path):
+        _file_sha256(path, hasher)
+    return hasher.hexdigest()
+
+def _result_cache_paths(entry_dir):
+    return {variant: os.path.join(entry_dir, f"{variant}.pdf") for variant in RESULT_VARIANTS}
+
+def result_cache_entry_key(paths):
+    """המפתח של הרשומה שאליה שייכים הנתיבים שהוחזרו מ-result_cache_get / run_cached_pipeline"""
+    return os.path.basename(os.path.dirname(paths["regular"]))
+
+def result_cache_get(key):
+    """מחזיר את נתיבי ארבע הגרסאות ברשומת המטמון, או None. פגיעה מעדכנת את זמן השימוש (LRU)"""
+    entry_dir = os.path.join(RESULT_CACHE_DIR, key)
+    paths = _result_cache_paths(entry_dir)
+    # במצב עצל הרשומה מכילה לפחות את הקובץ הרגיל, ושאר הגרסאות נבנות לתוכה לפי דרישה
+    if not all(os.path.exists(paths[v]) for v in EAGER_VARIANTS):
+        return None
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+    return paths
+
+def result_cache_put(key, output_paths):
+    """
+    מעביר את הקבצים שנוצרו אל המטמון ומחזיר את הנתיבים החדשים (של כל ארבע הגרסאות).
+    הכתיבה נעשית לתיקייה זמנית שמוחלפת בשינוי שם אטומי, כך שסשנים אחרים לא יראו רשומה חלקית.
+    """
+    os.makedirs(RESULT_CACHE_DIR, exist_ok=True)
+    entry_dir = os.path.join(RESULT_CACHE_DIR, key)
+    staging_dir = tempfile.mkdtemp(prefix=f".{key}.", dir=RESULT_CACHE_DIR)
+    for variant, target in _result_cache_paths(staging_dir).items():
+        if os.path.exists(output_paths[variant]):
+            shutil.move(output_paths[variant], target)
+    try:
+        os.rename(staging_dir, entry_dir)
+    except OSError:
+        # סשן אחר כבר שמר את אותה תוצאה בדיוק
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    _result_cache_evict()
+    return result_cache_get(key) or _result_cache_paths(entry_dir)
+
+def result_cache_alias(alias, key):
+    """שם נוסף לרשומה (למשל post-<id>), נכתב אטומית"""
+    alias_dir = os.path.join(RESULT_CACHE_DIR, _ALIASES_DIR)
+    os.makedirs(alias_dir, exist_ok=True)
+    tmp_path = os.path.join(alias_dir, f".{alias}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(key)
+    os.replace(tmp_path, os.path.join(alias_dir, alias))
+
+def result_cache_resolve(alias):
+    try:
+        with open(os.path.join(RESULT_CACHE_DIR, _ALIASES_DIR, alias)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def result_cache_add_ref(key, owner, ttl_seconds=None):
+    """
+    רושם (או מרענן) הפניה של סשן פעיל לרשומה, כדי שניקוי המאגר לא ימחק אותה בזמן שהיא מוצגת.
+    ההפניה פגה RESULT_REF_TTL_SECONDS אחרי הרענון האחרון, או אחרי ttl_seconds אם ניתן (למשל לפלט של אצווה).
+    """
+    if not key:
+        return
+    ref_dir = os.path.join(RESULT_CACHE_DIR, _REFS_DIR, key)
+    for _ in range(2):
+        os.makedirs(ref_dir, exist_ok=True)
+        try:
+            with open(os.path.join(ref_dir, owner), "w", encoding="utf-8") as f:
+                # תוקף מפורש נשמר בתוכן הקובץ; קובץ ריק פג לפי זמן השינוי
+                if ttl_seconds is not None:
+                    f.write(str(time.time() + ttl_seconds))
+            return
+        except FileNotFoundError:
+            # ניקוי מקביל מחק את התיקייה הריקה בין היצירה לכתיבה - יוצרים אותה שוב
+            continue
+
+def _result_ref_expiry(ref_path):
+    with open(ref_path, encoding="utf-8") as f:
+        content = f.read().strip()
+    try:
+        return float(content)
+    except ValueError:
+        return os.path.getmtime(ref_path) + RESULT_REF_TTL_SECONDS
+
+def _result_cache_pinned_keys(now):
+    """רשומות שאסור למחוק: הגיליון האוטומטי הנוכחי והקודם, וכל רשומה עם הפניה טרייה"""
+    pinned = set()
+    try:
+        with open(AUTO_CURRENT_FILE, encoding="utf-8") as f:
+            current = json.load(f)
+        pinned.update(k for k in (current.get("key"), current.get("previous_key")) if k)
+    except (OSError, ValueError):
+        pass
+    # תהליכים אחרים מוסיפים ומנקים הפניות במקביל, ולכן קובץ או תיקייה יכולים להיעלם באמצע הסריקה
+    refs_root = os.path.join(RESULT_CACHE_DIR, _REFS_DIR)
+    try:
+        keys = os.listdir(refs_root)
+    except OSError:
+        keys = []
+    for key in keys:
+        ref_dir = os.path.join(refs_root, key)
+        try:
+            owners = os.listdir(ref_dir)
+        except OSError:
+            continue
+        fresh = False
+        for owner in owners:
+            ref_path = os.path.join(ref_dir, owner)
+            try:
+                if now < _result_ref_expiry(ref_path):
+                    fresh = True
+                else:
+                    os.remove(ref_path)
+            except OSError:
+                pass
+        if fresh:
+            pinned.add(key)
+        else:
+            try:
+                # נכשל אם בינתיים נוספה הפניה - והרשומה נשארת נעוצה בסריקה הבאה
+                os.rmdir(ref_dir)
+            except OSError:
+                pass
+    return pinned
+
+def _result_entry_size(entry_dir):
+    """גודל הקבצים ברשומה. קבצי .tmp (גרסה עצלה בבנייה) וקבצים שנעלמו באמצע הסריקה לא נספרים"""
+    size = 0
+    for name in os.listdir(entry_dir):
+        if name.endswith(".tmp"):
+            continue
+        try:
+            size += os.path.getsize(os.path.join(entry_dir, name))
+        except OSError:
+            pass
+    return size
+
+def _result_cache_evict(max_bytes=None, max_age_days=None):
+    """
+    ניקוי המאגר: רשומות שלא נעשה בהן שימוש יותר מ-max_age_days נמחקות, ואחר כך הרשומות
+    הכי פחות בשימוש נמחקות עד שהגודל יורד מתחת למגבלה. רשומות נעוצות לא נמחקות לעולם.
+    """
+    max_bytes = RESULT_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    max_age = (RESULT_CACHE_MAX_AGE_DAYS if max_age_days is None else max_age_days) * 86400
+    now = time.time()
+    pinned = _result_cache_pinned_keys(now)
+    entries = []
+    total = 0
+    try:
+        names = os.listdir(RESULT_CACHE_DIR)
+    except OSError:
+        return
+    for name in names:
+        entry_dir = os.path.join(RESULT_CACHE_DIR, name)
+        if not os.path.isdir(entry_dir) or name in (_REFS_DIR, _ALIASES_DIR):
+            continue
+        try:
+            if name.startswith("."):
+                # תיקיית כתיבה זמנית שנשארה מתהליך שקרס
+                if now - os.path.getmtime(entry_dir) > 86400:
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                continue
+            size = _result_entry_size(entry_dir)
+            mtime = os.path.getmtime(entry_dir)
+        except OSError:
+            # הרשומה נמחקה או הוחלפה על ידי תהליך אחר באמצע הסריקה
+            continue
+        total += size
+        if name not in pinned:
+            entries.append((mtime, size, entry_dir))
+    for mtime, size, entry_dir in sorted(entries):
+        if total <= max_bytes and now - mtime <= max_age:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total -= size
+
+def run_cached_pipeline(input_path, start_matcher, end_matcher, scan_hint=None, timings=None, scan_info=None, alias=None):
+    """
+    מריץ חיתוך, המרה לשחור-לבן וחיתוך לטורים - או מחזיר מיד את התוצאה מהמטמון אם הקובץ כבר עובד.
+    מחזיר מילון {variant: path} או None אם סימני ההתחלה והסיום לא נמצאו.
+    alias: שם נוסף לרשומה במאגר (למשל מזהה הפוסט של הגיליון האוטומטי).
+    """
+    with profile_stage("pipeline", input_bytes=os.path.getsize(input_path)) as prof:
+        key = result_cache_key(input_path)
+        cached = result_cache_get(key)
+        prof["cache"] = "hit" if cached else "miss"
+        if cached:
+            if alias: result_cache_alias(alias, key)
+            return cached
+
+        work_dir = tempfile.mkdtemp(prefix="pipeline_")
+        outputs = {variant: os.path.join(work_dir, f"{variant}.pdf") for variant in RESULT_VARIANTS}
+        try:
+            if not process_document(input_path, outputs, start_matcher, end_matcher, scan_hint=scan_hint, scan_info=scan_info, timings=timings):
+                prof["ok"] = False
+                return None
+            paths = result_cache_put(key, outputs)
+            if alias: result_cache_alias(alias, key)
+            return paths
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def _session_owner():
+    """מזהה יציב לסשן הנוכחי, לרישום הפניות במאגר התוצרים"""
+    if "artifact_owner" not in st.session_state:
+        st.session_state["artifact_owner"] = uuid.uuid4().hex
+    return st.session_state["artifact_owner"]
+
+# --- תור עבודות לעיבוד ידני ---
+
+# מספר העבודות שרצות במקביל; כל עבודה רצה בתהליך נפרד עם תקרת זיכרון משלה
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# כמה עבודות יכולות להמתין בתור; מעבר לזה בקשה חדשה נדחית מיד במקום להעמיס על השרת
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "8"))
+JOB_MEMORY_MB = int(os.environ.get("JOB_MEMORY_MB", "1024"))
+JOB_MAX_PAGES = int(os.environ.get("JOB_MAX_PAGES", "300"))
+JOB_MAX_INPUT_MB = int(os.environ.get("JOB_MAX_INPUT_MB", "100"))
+JOB_TIMEOUT_SECONDS = int(os.environ.get("JOB_TIMEOUT_SECONDS", "600"))
+# כמה זמן עבודה שהסתיימה נשמרת, כדי שהסשן שהגיש אותה יוכל לקרוא את התוצאה
+JOB_RESULT_TTL_SECONDS = 3600
+
+JOB_FINAL_STATES = ("done", "no_markers", "rejected", "error")
+
+_JOBS = process_shared("jobs", dict)
+# מפתח העבודה (hash של הקובץ או מזהה הדרייב) -> מזהה העבודה שבתור או בעיבוד
+_JOBS_INFLIGHT = process_shared("jobs_inflight", dict)
+_JOB_QUEUE = process_shared("job_queue", deque)
+_JOBS_COND = process_shared("jobs_cond", threading.Condition)
+_job_workers = process_shared("job_workers", list)
+
+class JobRejected(Exception):
+    """העבודה לא התקבלה לתור: התור מלא או שהקובץ חורג מהמגבלות"""
+
+def _check_pdf_limits(path):
+    """מחזיר את מספר העמודים, או זורק JobRejected אם הקובץ גדול מדי או אינו PDF תקין"""
+    size_mb = os.path.getsize(path) / 2**20
+    if size_mb > JOB_MAX_INPUT_MB:
+        raise JobRejected(f"הקובץ גדול מדי ({size_mb:.0f}MB, המקסימום הוא {JOB_MAX_INPUT_MB}MB).")
+    try:
+        with _MUPDF_LOCK, fitz.open(path) as doc:
+            page_count = len(doc)
+    except (RuntimeError, ValueError):
+        raise JobRejected("הקובץ אינו PDF תקין.")
+    if page_count > JOB_MAX_PAGES:
+        raise JobRejected(f"הקובץ ארוך מדי ({page_count} עמודים, המקסימום הוא {JOB_MAX_PAGES}).")
+    return page_count
+
+def _reset_after_fork():
+    """
+    מנעולים וחיבורים שהועתקו מהתהליך הראשי (אולי באמצע שימוש של תהליכון אחר) מוחלפים בחדשים.
+    התהליך הראשי מריץ תהליכונים נוספים (תזמון הגיליון האוטומטי, כותב ההגדרות, דוגם ה-RSS, תור העבודות
+    וסשנים אחרים), ולכן fork יכול להעתיק מנעול תפוס שאף אחד לא ישחרר בתהליך הבן.
+    מוחלפים כאן כל המנעולים שקוד התהליך הבן (_job_process, _marker_scan_worker) נוגע בהם:
+    _MUPDF_LOCK (כל קריאה ל-PyMuPDF), _VARIANT_LOCKS_GUARD ו-_VARIANT_LOCKS (ensure_variant, download_drive_file),
+    _PROFILE_LOCK ו-_RSS_WATCH_LOCK (profile_stage), ו-_drive_session (מאגר החיבורים של requests).
+    לא מוחלפים, כי הבן לא משתמש בהם: _config_lock, _http_cache_lock, _AUTO_BUILD_LOCK, _PREVIEW_CACHE_LOCK,
+    _JOBS_COND והמנעול של _process_state. קוד שמתחיל להשתמש באחד מהם בתהליך בן צריך להוסיף אותו כאן.
+    """
+    global _MUPDF_LOCK, _VARIANT_LOCKS_GUARD, _PROFILE_LOCK, _RSS_WATCH_LOCK, _drive_session
+    _MUPDF_LOCK = threading.RLock()
+    _VARIANT_LOCKS_GUARD = threading.Lock()
+    _VARIANT_LOCKS.clear()
+    _PROFILE_LOCK = threading.Lock()
+    # שלבים שהיו פעילים בתהליכונים אחרים של התהליך הראשי לא יסתיימו כאן
+    _RSS_WATCH_LOCK = threading.Lock()
+    _RSS_WATCHES.clear()
+    _drive_session = requests.Session()
+
+def _job_process(spec, start_matcher, end_matcher, messages):
+    """תהליך בן לעבודה אחת: הורדה (לקישור דרייב), בדיקת מגבלות והרצת שרשרת העיבוד, או בניית גרסה אחת"""
+    global MARKER_SCAN_WORKERS, _PROFILE_SINK
+    _reset_after_fork()
+    cv2.setNumThreads(1)
+    # תהליך daemon לא יכול לפתוח תהליכי סריקה משלו, והמקביליות כבר מגיעה ממאגר העבודות
+    MARKER_SCAN_WORKERS = 1
+    _limit_process_memory(JOB_MEMORY_MB)
+    _PROFILE_SINK = lambda event: messages.put(("event", {**event, "job": spec["id"]}))
+    try:
+        if spec["kind"] == "variant":
+            ensure_variant(spec["outputs"], spec["variant"])
+            messages.put(("done", spec["outputs"], None))
+            return
+        if spec["kind"] == "drive":
+            # קובץ גדול מהמגבלה נדחה כבר בהורדה, לפי Content-Length או ברגע שעבר אותה
+            input_path, title = download_drive_file(spec["file_id"], max_bytes=JOB_MAX_INPUT_MB * 2**20)
+            messages.put(("page_count", _check_pdf_limits(input_path)))
+        else:
+            input_path, title = spec["path"], spec["name"]
+        outputs = run_cached_pipeline(input_path, start_matcher, end_matcher, scan_hint=spec.get("scan_hint"))
+        messages.put(("done" if outputs else "no_markers", outputs, title))
+    except (JobRejected, DriveFileTooLarge) as e:
+        messages.put(("rejected", str(e)))
+    except DriveDownloadError as e:
+        messages.put(("error", f"ההורדה מגוגל דרייב נכשלה: {e}"))
+    except MemoryError:
+        messages.put(("error", f"העיבוד חרג ממגבלת הזיכרון ({JOB_MEMORY_MB}MB)."))
+    except Exception as e:
+        messages.put(("error", f"{type(e).__name__}: {e}"))
+
+def _finish_job(job, state, outputs=None, title=None, error=None):
+    with _JOBS_COND:
+        job.update({"state": state, "outputs": outputs, "error": error, "finished": time.time()})
+        if title:
+            job["title"] = title
+        if _JOBS_INFLIGHT.get(job["key"]) == job["id"]:
+            del _JOBS_INFLIGHT[job["key"]]
+    record_profile_event({"stage": "job", "job": job["id"], "state": state, "kind": job["spec"]["kind"],
+                          "queue_wait_s": round(job["started"] - job["submitted"], 4),
+                          "wall_s": round(job["finished"] - job["started"], 4)})
+
+def _run_job(job):
+    """מריץ עבודה בתהליך בן ומעדכן את מצבה מההודעות שהוא שולח, עד תוצאה, קריסה או חריגה מהזמן"""
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    messages = ctx.Queue()
+    proc = ctx.Process(target=_job_process, args=(job["spec"], *job["matchers"], messages), daemon=True)
+    proc.start()
+    deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+    result = None
+    try:
+        while result is None:
+            if time.monotonic() > deadline:
+                result = ("error", f"העיבוד לא הסתיים תוך {JOB_TIMEOUT_SECONDS} שניות.")
+                break
+            try:
+                message = messages.get(timeout=1)
+            except queue.Empty:
+                if proc.is_alive():
+                    continue
+                # הודעה אחרונה שאולי עוד לא נקראה לפני היציאה
+                try:
+                    message = messages.get(timeout=1)
+                except queue.Empty:
+                    break
+            if message[0] == "event":
+                event = message[1]
+                with _PROFILE_LOCK:
+                    _PROFILE_EVENTS.append(event)
+                with _JOBS_COND:
+                    job["stage"] = event["stage"]
+                    if event["stage"] == "marker_scan_page":
+                        job["pages_scanned"] += 1
+            elif message[0] == "page_count":
+                with _JOBS_COND:
+                    job["page_count"] = message[1]
+            else:
+                result = message
+    finally:
+        proc.join(timeout=5)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join()
+
+    if result is None:
+        # התהליך נהרג בלי לדווח - בדרך כלל חריגה ממגבלת הזיכרון
+        _finish_job(job, "error", error=f"העיבוד נעצר באמצע בלי תוצאה (קוד יציאה {proc.exitcode}). ייתכן שהקובץ דורש יותר מ-{JOB_MEMORY_MB}MB זיכרון.")
+    elif result[0] in ("done", "no_markers"):
+        _finish_job(job, result[0], outputs=result[1], title=result[2])
+    else:
+        _finish_job(job, result[0], error=result[1])
+
+def _job_worker_loop():
+    while True:
+        with _JOBS_COND:
+            while not _JOB_QUEUE:
+                _JOBS_COND.wait()
+            job = _JOBS[_JOB_QUEUE.popleft()]
+            job["state"] = "running"
+            job["started"] = time.time()
+        try:
+            _run_job(job)
+        except Exception as e:
+            _finish_job(job, "error", error=f"{type(e).__name__}: {e}")
+        finally:
+            if job["spec"]["kind"] == "upload" and os.path.exists(job["spec"]["path"]):
+                os.remove(job["spec"]["path"])
+
+def _ensure_job_workers():
+    """נקרא עם _JOBS_COND: מפעיל את תהליכוני התור בפעם הראשונה (ומחליף תהליכון שמת)"""
+    _job_workers[:] = [worker for worker in _job_workers if worker.is_alive()]
+    while len(_job_workers) < max(1, JOB_WORKERS):
+        worker = threading.Thread(target=_job_worker_loop, name=f"job-worker-{len(_job_workers)}", daemon=True)
+        worker.start()
+        _job_workers.append(worker)
+
+def _prune_jobs(now):
+    for job_id, job in list(_JOBS.items()):
+        if job["state"] in JOB_FINAL_STATES and now - job["finished"] > JOB_RESULT_TTL_SECONDS:
+            del _JOBS[job_id]
+
+def submit_job(spec, start_matcher, end_matcher):
+    """
+    מגיש עבודה לתור ומחזיר את המזהה שלה מיד, בלי לחכות לעיבוד.
+    spec: {"kind": "upload", "path", "name"} (קובץ זמני שעובר לבעלות התור), {"kind": "drive", "file_id"}
+    (ואופציונלית "scan_hint"), או {"kind": "variant", "outputs", "variant"} לבניית גרסה עצלה (ensure_variant).
+    עבודה זהה שכבר בתור או בעיבוד לא מוגשת שוב - מוחזר המזהה של הקיימת.
+    זורק JobRejected אם התור מלא או שהקובץ חורג מהמגבלות.
+    """
+    now = time.time()
+    job = {"id": uuid.uuid4().hex, "spec": dict(spec), "matchers": (start_matcher, end_matcher),
+           "state": "queued", "submitted": now, "started": None, "finished": None,
+           "page_count": None, "pages_scanned": 0, "stage": None,
+           "outputs": None, "title": spec.get("name"), "error": None}
+    job["spec"]["id"] = job["id"]
+    owns_file = spec["kind"] == "upload"
+    try:
+        if owns_file:
+            job["page_count"] = _check_pdf_limits(spec["path"])
+            job["key"] = result_cache_key(spec["path"])
+            cached = result_cache_get(job["key"])
+            if cached:
+                # כבר עובד בעבר - אין צורך לתפוס מקום בתור
+                job.update({"state": "done", "outputs": cached, "started": now, "finished": now})
+                with _JOBS_COND:
+                    _JOBS[job["id"]] = job
+                return job["id"]
+        elif spec["kind"] == "variant":
+            job["key"] = f"variant-{os.path.abspath(spec['outputs'][spec['variant']])}"
+        else:
+            job["key"] = f"drive-{spec['file_id']}"
+
+        with _JOBS_COND:
+            _prune_jobs(now)
+            existing = _JOBS_INFLIGHT.get(job["key"])
+            if existing:
+                return existing
+            if len(_JOB_QUEUE) >= JOB_QUEUE_MAX:
+                raise JobRejected("השרת עמוס כרגע. נסו שוב בעוד דקה.")
+            _JOBS[job["id"]] = job
+            _JOBS_INFLIGHT[job["key"]] = job["id"]
+            _JOB_QUEUE.append(job["id"])
+            owns_file = False
+            _ensure_job_workers()
+            _JOBS_COND.notify()
+        return job["id"]
+    finally:
+        if owns_file and os.path.exists(spec["path"]):
+            os.remove(spec["path"])
+
+def job_status(job_id):
+    """עותק של מצב העבודה, עם המיקום בתור (1 = הבאה בתור) ומספר העבודות שרצות כרגע"""
+    with _JOBS_COND:
+        job = _JOBS.get(job_id)
+        if job is None:
+            return None
+        status = {k: v for k, v in job.items() if k not in ("matchers", "spec")}
+        status["kind"] = job["spec"]["kind"]
+        status["position"] = _JOB_QUEUE.index(job_id) + 1 if job["state"] == "queued" else None
+        status["queue_length"] = len(_JOB_QUEUE)
+        status["running"] = sum(1 for j in _JOBS.values() if j["state"] == "running")
+    return status
+
 # --- ממשק משתמש ---
 
+def _profile_panel_enabled():
+    """הלוח מוצג עם PROFILE_ADMIN=1, או בכתובת ?admin=<ADMIN_KEY> כשהמפתח מוגדר ב-secrets"""
+    if PROFILE_ADMIN:
+        return True
+    admin_key = st.query_params.get("admin")
+    try:
+        return bool(admin_key) and admin_key == st.secrets.get("ADMIN_KEY")
+    except Exception:
+        return False
+
+def render_profile_panel():
+    summary, events = profile_summary()
+    with st.expander("ניטור ביצועים (מנהל)"):
+        if not events:
+            st.info("עדיין לא נרשמו מדידות בתהליך הזה.")
+            return
+        st.markdown("**סיכום לפי שלב**")
+        st.dataframe(summary, use_container_width=True)
+        st.markdown("**אירועים אחרונים**")
+        st.dataframe(events[-200:][::-1], use_container_width=True)
+        st.download_button("הורדת כל המדידות (JSON)", json.dumps(events, ensure_ascii=False, default=str),
+                           file_name="profile_events.json", mime="application/json")
+
+def _manual_base_name(title):
+    """שם הקובץ להורדה בעיבוד ידני: שם המקור בלי תווים אסורים, עם הסיומת _fixed"""
+    name = re.sub(r'[\\/*?:"<>|]', "", title or "").strip() or "document.pdf"
+    if name.lower().endswith(".pdf"):
+        name = name[:-4]
+    return f"{name}_fixed.pdf"
+
+def _job_progress(status):
+    """(שבר התקדמות, טקסט) להצגת עבודה שרצה"""
+    if status["kind"] == "variant":
+        return 0.5, "מכין את הגרסה המבוקשת..."
+    if status["stage"] in ("marker_scan", "stage:extract", "pipeline"):
+        return 0.9, "הסימנים נמצאו, מכין את הקבצים..."
+    if status["page_count"] and status["pages_scanned"]:
+        fraction = min(status["pages_scanned"] / status["page_count"], 1.0)
+        return 0.1 + 0.8 * fraction, f"מחפש את סימני ההתחלה והסיום ({status['pages_scanned']}/{status['page_count']} עמודים)..."
+    if status["kind"] == "drive" and status["stage"] is None:
+        return 0.05, "מוריד את הקובץ מ-Google Drive..."
+    return 0.1, "מחפש את סימני ההתחלה והסיום..."
+
+def collect_job_result():
+    """
+    אם העבודה של הסשן הסתיימה: מעביר את התוצאה (או הודעת השגיאה) ל-session_state ומחזיר True.
+    מחזיר False כל עוד העבודה בתור או בעיבוד.
+    """
+    job_id = st.session_state.get("manual_job")
+    status = job_status(job_id) if job_id else None
+    if status is not None and status["state"] not in JOB_FINAL_STATES:
+        return False
+    st.session_state.pop("manual_job", None)
+    if status is None:
+        st.session_state["manual_job_result"] = ("error", "העבודה לא נמצאה (ייתכן שהשרת הופעל מחדש). נא להפעיל שוב.")
+    elif status["state"] == "done":
+        outputs = status["outputs"]
+        st.session_state["manual_files"] = {
+            "reg_col": outputs["regular"],
+            "reg_bw": outputs["regular_bw"],
+            "cut_col": outputs["cut"],
+            "cut_bw": outputs["cut_bw"],
+            "base_name": _manual_base_name(status["title"])
+        }
+        st.session_state["manual_job_result"] = ("success", "העיבוד בוצע בהצלחה!")
+    elif status["state"] == "no_markers":
+        st.session_state["manual_job_result"] = ("error", "לא הצלחנו למצוא את סימני ההתחלה והסיום בתוך הקובץ.")
+    elif status["state"] == "rejected":
+        st.session_state["manual_job_result"] = ("warning", status["error"])
+    else:
+        st.session_state["manual_job_result"] = ("error", f"אירעה שגיאה: {status['error']}")
+    return True
+
+@st.fragment(run_every=1)
+def render_job_status(job_id):
+    """מתעדכן כל שנייה בלי לחסום את שאר הדף; בסיום העבודה מריץ מחדש את הדף כולו להצגת התוצאה"""
+    status = job_status(job_id)
+    if status is None or status["state"] in JOB_FINAL_STATES:
+        st.rerun()
+    if status["state"] == "queued":
+        ahead = status["position"] - 1
+        st.info(f"⏳ הבקשה ממתינה בתור (מקום {status['position']}). "
+                f"{'הבאה בתור' if ahead == 0 else f'לפניה {ahead} בקשות'}, {status['running']} בעיבוד כרגע.")
+        st.progress(0.0)
+    else:
+        fraction, text = _job_progress(status)
+        st.progress(fraction, text=text)
+
 def main():
     st.set_page_config(page_title="הורדת סיכום פרשה - משכן שילה", page_icon="📄")
     st.markdown("<style>.block-container { direction: rtl; text-align: right; }</style>", unsafe_allow_html=True)
@@ -472,34 +2555,39 @@ def main():
             del st.session_state["manual_files"]
         if "auto_pdf_processed" in st.session_state:
             del st.session_state["auto_pdf_processed"]
+        st.session_state.pop("manual_job", None)
+        st.session_state.pop("manual_job_result", None)
     
     START_IMG, END_IMG = "start.png", "end.png"
 
     if upload_option == "שליפה אוטומטית (משכן שילה)":
-        # מניעת הורדה ועיבוד מחדש בכל לחיצה על כפתורי הממשק
+        # מניעת הורדה ועיבוד מחדש בכל לחיצה על כפתורי הממשק. הסשן נשאר עם הגיליון (מפתח הרשומה)
+        # שקיבל, גם אם בינתיים פורסם גיליון חדש; רק אם הרשומה כבר נמחקה מהמאגר עוברים לגיליון הנוכחי
+        if "auto_pdf_processed" in st.session_state:
+            success, error_msg, target_title, auto_key = st.session_state["auto_pdf_processed"]
+            if success and not os.path.exists(get_auto_outputs({"key": auto_key})["regular"]):
+                del st.session_state["auto_pdf_processed"]
         if "auto_pdf_processed" not in st.session_state:
             with st.spinner("מוודא ומכין את הגיליון העדכני ביותר..."):
-                success, error_msg, target_title = prepare_auto_pdf()
-                st.session_state["auto_pdf_processed"] = (success, error_msg, target_title)
-        else:
-            success, error_msg, target_title = st.session_state["auto_pdf_processed"]
-        
-        if success and os.path.exists(AUTO_REGULAR_PDF):
+                success, error_msg, target_title, auto_key = prepare_auto_pdf()
+                st.session_state["auto_pdf_processed"] = (success, error_msg, target_title, auto_key)
+
+        auto_outputs = get_auto_outputs({"key": auto_key or ""})
+        if success and os.path.exists(auto_outputs["regular"]):
+            result_cache_add_ref(auto_key, _session_owner())
             st.success("✅ הקובץ מוכן עבורך!")
             
-            safe_filename = re.sub(r'[\\/*?:"<>|]', "", target_title).strip()
-            if not safe_filename.lower().endswith('.pdf'):
-                safe_filename += ".pdf"
+            safe_filename = safe_pdf_filename(target_title)
             
             display_title = safe_filename.replace(".pdf", "")
             st.markdown(f'<h3 style="text-align: right; direction: rtl;">ניהול מסמך מ-"{display_title}"</h3>', unsafe_allow_html=True)
             
             render_download_view_ui(
                 base_filename=safe_filename,
-                regular_color=AUTO_REGULAR_PDF,
-                regular_bw=AUTO_REGULAR_BW_PDF,
-                cut_color=AUTO_CUT_PDF,
-                cut_bw=AUTO_CUT_BW_PDF,
+                regular_color=auto_outputs["regular"],
+                regular_bw=auto_outputs["regular_bw"],
+                cut_color=auto_outputs["cut"],
+                cut_bw=auto_outputs["cut_bw"],
                 key_prefix="auto"
             )
 
@@ -520,99 +2608,51 @@ def main():
                 st.error("שגיאה: קבצי התמונות (start.png / end.png) חסרים.")
                 return
 
-            with st.spinner("מבצע משיכה, חיתוך והכנת הטורים..."):
-                try:
-                    with open(START_IMG, "rb") as f: start_b64 = base64.b64encode(f.read())
-                    with open(END_IMG, "rb") as f: end_b64 = base64.b64encode(f.read())
+            try:
+                start_matcher, end_matcher = get_marker_matchers(START_IMG, END_IMG)
+                scan_hint = get_scan_hint(get_config())
 
-                    input_path = ""
-                    
-                    if upload_option == "העלאת קובץ מהמחשב":
-                        if not uploaded_file:
-                            st.warning("נא להעלות קובץ.")
-                            return
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                            tmp.write(uploaded_file.getvalue())
-                            input_path = tmp.name
-                        
-                        output_regular = input_path.replace(".pdf", "_regular.pdf")
-                        output_regular_bw = input_path.replace(".pdf", "_regular_bw.pdf")
-                        output_cut = input_path.replace(".pdf", "_cut.pdf")
-                        output_cut_bw = input_path.replace(".pdf", "_cut_bw.pdf")
-                        
-                        if extract_pdf_by_images(input_path, output_regular, start_b64, end_b64):
-                            convert_pdf_to_bw(output_regular, output_regular_bw)
-                            split_pdf_to_columns(output_regular, output_cut)
-                            convert_pdf_to_bw(output_cut, output_cut_bw)
-                            
-                            safe_manual_name = uploaded_file.name
-                            if not safe_manual_name.lower().endswith('.pdf'):
-                                safe_manual_name += ".pdf"
-                            safe_manual_name = safe_manual_name.replace(".pdf", "_fixed.pdf")
-                            
-                            st.session_state["manual_files"] = {
-                                "reg_col": output_regular,
-                                "reg_bw": output_regular_bw,
-                                "cut_col": output_cut,
-                                "cut_bw": output_cut_bw,
-                                "base_name": safe_manual_name
-                            }
-                            st.success("העיבוד בוצע בהצלחה!")
-                        else:
-                            st.error("לא הצלחנו למצוא את סימני ההתחלה והסיום בתוך הקובץ.")
-                    
-                    elif upload_option == "קישור מ-Google Drive":
-                        if not manual_link:
-                            st.warning("נא להזין לינק.")
-                            return
-                        
-                        file_id = None
-                        id_match = re.search(r'/d/([a-zA-Z0-9_-]+)', manual_link)
-                        if id_match:
-                            file_id = id_match.group(1)
-                        else:
-                            st.warning("הקישור לא תקין או לא מכיל מזהה (ID).")
-                            return
-                            
-                        downloaded_path = gdown.download(id=file_id, quiet=False)
-                        if downloaded_path:
-                            original_filename = urllib.parse.unquote(os.path.basename(downloaded_path))
-                            
-                            safe_manual_name = re.sub(r'[\\/*?:"<>|]', "", original_filename).strip()
-                            if safe_manual_name.lower().endswith('.pdf'):
-                                safe_manual_name = safe_manual_name.replace(".pdf", "_fixed.pdf")
-                            else:
-                                safe_manual_name += "_fixed.pdf"
-                            
-                            output_regular = "temp_regular_drive.pdf"
-                            output_regular_bw = "temp_regular_bw_drive.pdf"
-                            output_cut = "temp_cut_drive.pdf"
-                            output_cut_bw = "temp_cut_bw_drive.pdf"
-                            
-                            if extract_pdf_by_images(downloaded_path, output_regular, start_b64, end_b64):
-                                convert_pdf_to_bw(output_regular, output_regular_bw)
-                                split_pdf_to_columns(output_regular, output_cut)
-                                convert_pdf_to_bw(output_cut, output_cut_bw)
-                                
-                                st.session_state["manual_files"] = {
-                                    "reg_col": output_regular,
-                                    "reg_bw": output_regular_bw,
-                                    "cut_col": output_cut,
-                                    "cut_bw": output_cut_bw,
-                                    "base_name": safe_manual_name
-                                }
-                                st.success("העיבוד בוצע בהצלחה!")
-                            else:
-                                st.error("לא הצלחנו למצוא את סימני ההתחלה והסיום בתוך הקובץ.")
-                            if os.path.exists(downloaded_path): os.remove(downloaded_path)
-                        else:
-                            st.error("לא הצלחנו להוריד את הקובץ מהלינק שסופק.")
-                
-                except Exception as e:
-                    st.error(f"אירעה שגיאה: {e}")
+                if upload_option == "העלאת קובץ מהמחשב":
+                    if not uploaded_file:
+                        st.warning("נא להעלות קובץ.")
+                        return
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
+                        tmp.write(uploaded_file.getvalue())
+                    # הקובץ הזמני עובר לבעלות התור, שמוחק אותו בסיום העבודה
+                    job_id = submit_job({"kind": "upload", "path": tmp.name, "name": uploaded_file.name, "scan_hint": scan_hint},
+                                        start_matcher, end_matcher)
+
+                elif upload_option == "קישור מ-Google Drive":
+                    if not manual_link:
+                        st.warning("נא להזין לינק.")
+                        return
+
+                    id_match = re.search(r'/d/([a-zA-Z0-9_-]+)', manual_link)
+                    if not id_match:
+                        st.warning("הקישור לא תקין או לא מכיל מזהה (ID).")
+                        return
+                    job_id = submit_job({"kind": "drive", "file_id": id_match.group(1), "scan_hint": scan_hint},
+                                        start_matcher, end_matcher)
+
+                st.session_state.pop("manual_files", None)
+                st.session_state.pop("manual_job_result", None)
+                st.session_state["manual_job"] = job_id
+
+            except JobRejected as e:
+                st.warning(str(e))
+            except Exception as e:
+                st.error(f"אירעה שגיאה: {e}")
+
+        if "manual_job" in st.session_state and not collect_job_result():
+            render_job_status(st.session_state["manual_job"])
+
+        if "manual_job_result" in st.session_state:
+            level, message = st.session_state["manual_job_result"]
+            getattr(st, level)(message)
 
         if "manual_files" in st.session_state:
             f = st.session_state["manual_files"]
+            result_cache_add_ref(result_cache_entry_key({"regular": f["reg_col"]}), _session_owner())
             display_manual_title = f["base_name"].replace(".pdf", "")
             st.markdown(f'<h3 style="text-align: right; direction: rtl;">ניהול מסמך מ-"{display_manual_title}"</h3>', unsafe_allow_html=True)
             
@@ -625,5 +2665,8 @@ def main():
                 key_prefix="manual"
             )
 
+    if _profile_panel_enabled():
+        render_profile_panel()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,282 @@
+"""
+עיבוד אצווה של ארכיון גיליונות, בלי הממשק.
+
+הרצה:
+    python batch.py archive/ extra.pdf --post 72680 --post 72700,72712 --out batch_output --workers 4
+
+כל קלט (קובץ PDF, תיקייה של קבצים או מזהה פוסט באתר) עובר את אותה שרשרת של האפליקציה
+(run_cached_pipeline ו-ensure_variant), כך שהפלט זהה לזה שמוגש בממשק ונשמר גם במאגר התוצרים.
+כל תוצאה נרשמת מיד ביומן (--journal); הרצה חוזרת מדלגת על מה שכבר הסתיים, כך שאפשר להמשיך
+אחרי קריסה. בסוף נכתב דוח מסכם (--report).
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import app
+
+# הפניה שמגינה על רשומות שהאצווה יצרה מפני ניקוי המאגר, גם אחרי שהיא הסתיימה (--keep-days).
+# בלעדיה הרשומות יכולות להימחק לפי גודל המאגר, והרצה חוזרת בלי --out לא תמצא אותן
+BATCH_REF_OWNER = "batch"
+BATCH_KEEP_DAYS = 30
+
+_matchers = None
+
+
+def _init_worker(profile_log):
+    """נטען פעם אחת בכל תהליך עובד: תבניות הסימנים מפוענחות כאן ולא לכל גיליון"""
+    global _matchers
+    app.PROFILE_LOG = profile_log
+    _matchers = (app.MarkerMatcher.from_file("start.png"), app.MarkerMatcher.from_file("end.png"))
+
+
+def _parse_post_ids(values):
+    post_ids = []
+    for value in values or ():
+        post_ids.extend(int(part) for part in value.split(",") if part.strip())
+    return post_ids
+
+
+def collect_jobs(inputs, post_ids):
+    """רשימת העבודות לפי הסדר, בלי כפילויות. תיקיות נסרקות רקורסיבית לקבצי PDF"""
+    jobs = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(item)
+                for name in names if name.lower().endswith(".pdf")
+            )
+        else:
+            paths = [item]
+        for path in paths:
+            path = os.path.abspath(path)
+            jobs.append({"id": path, "kind": "file", "path": path, "name": os.path.basename(path)})
+    for post_id in post_ids:
+        jobs.append({"id": f"post-{post_id}", "kind": "post", "post_id": post_id, "name": f"post-{post_id}"})
+
+    unique = {}
+    for job in jobs:
+        unique.setdefault(job["id"], job)
+    return list(unique.values())
+
+
+def _input_signature(job):
+    """קובץ מקומי שהשתנה מאז הריצה הקודמת מעובד מחדש"""
+    if job["kind"] != "file":
+        return None
+    stat = os.stat(job["path"])
+    return [stat.st_size, int(stat.st_mtime)]
+
+
+def _export(outputs, title, export_dir):
+    """מעתיק את ארבע הגרסאות לתיקיית הפלט בשמות של כפתור ההורדה. כל קובץ נכתב אטומית"""
+    os.makedirs(export_dir, exist_ok=True)
+    base_filename = app.safe_pdf_filename(title)
+    files = []
+    for variant in app.RESULT_VARIANTS:
+        target = os.path.join(export_dir, app.variant_filename(base_filename, variant))
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        shutil.copyfile(outputs[variant], tmp_path)
+        os.replace(tmp_path, target)
+        files.append(target)
+    return files
+
+
+def run_job(job, export_dir=None, keep_days=BATCH_KEEP_DAYS):
+    """מעבד עבודה אחת בתהליך עובד ומחזיר את רשומת התוצאה ליומן"""
+    started = time.perf_counter()
+    result = {"id": job["id"], "kind": job["kind"], "pipeline_version": app.PIPELINE_VERSION,
+              "input_signature": _input_signature(job)}
+    try:
+        if job["kind"] == "post":
+            drive_id = app.find_post_drive_id(job["post_id"])
+            if not drive_id:
+                result["status"] = "no_drive_link"
+                return result
+            input_path, title = app.download_drive_file(drive_id)
+            alias = f"post-{job['post_id']}"
+            result["drive_id"] = drive_id
+        else:
+            input_path, title, alias = job["path"], job["name"], None
+
+        scan_info = {}
+        outputs = app.run_cached_pipeline(input_path, *_matchers, scan_info=scan_info, alias=alias)
+        if not outputs:
+            result["status"] = "no_markers"
+            return result
+        key = app.result_cache_entry_key(outputs)
+        app.result_cache_add_ref(key, BATCH_REF_OWNER, ttl_seconds=keep_days * 86400)
+        # במצב עצל רק הקובץ הרגיל נבנה; באצווה בונים מיד את כל הגרסאות
+        for variant in app.RESULT_VARIANTS:
+            app.ensure_variant(outputs, variant)
+
+        result.update({"status": "done", "key": key, "title": title,
+                       "start_page": scan_info.get("start_page"), "end_page": scan_info.get("end_page"),
+                       "cache": "miss" if scan_info else "hit"})
+        if export_dir:
+            result["files"] = _export(outputs, title, export_dir)
+    except app.DriveDownloadError as e:
+        result.update({"status": "download_error", "error": str(e)})
+    except Exception as e:
+        result.update({"status": "error", "error": f"{type(e).__name__}: {e}"})
+    finally:
+        result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def load_journal(journal_path):
+    """התוצאה האחרונה של כל עבודה מהיומן (שורת JSON לכל עבודה שהסתיימה)"""
+    latest = {}
+    if not os.path.exists(journal_path):
+        return latest
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # שורה חלקית מקריסה באמצע כתיבה
+                continue
+            latest[entry["id"]] = entry
+    return latest
+
+
+# תוצאות סופיות: גם גיליון בלי סימנים לא ייסרק שוב (עד שגרסת העיבוד משתנה)
+SETTLED_STATUSES = ("done", "no_markers")
+
+
+def _is_done(job, entry, export_dir=None):
+    """
+    עבודה מדולגת רק אם התוצאה שלה עדיין קיימת: רשומה במאגר עם ארבע הגרסאות (ניקוי המאגר יכול
+    למחוק אותה מאז), וכשמבקשים ייצוא - גם הקבצים בתיקיית הפלט הנוכחית.
+    """
+    if not entry or entry.get("status") not in SETTLED_STATUSES or entry.get("pipeline_version") != app.PIPELINE_VERSION:
+        return False
+    if job["kind"] == "file" and entry.get("input_signature") != _input_signature(job):
+        return False
+    if entry["status"] != "done":
+        return True
+    cached = app.result_cache_get(entry.get("key") or "")
+    if not cached or not all(os.path.exists(cached[variant]) for variant in app.RESULT_VARIANTS):
+        return False
+    files = entry.get("files") or []
+    if export_dir and not (files and all(os.path.abspath(os.path.dirname(path)) == os.path.abspath(export_dir)
+                                         for path in files)):
+        return False
+    return all(os.path.exists(path) for path in files)
+
+
+def _append_journal(journal, entry):
+    journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    journal.flush()
+    os.fsync(journal.fileno())
+
+
+def _export_dirs(jobs, out_dir):
+    """תיקיית פלט לכל עבודה לפי שם הקלט; שמות כפולים מקבלים מספר"""
+    dirs = {}
+    used = set()
+    for job in jobs:
+        stem = os.path.splitext(app.safe_pdf_filename(job["name"]))[0]
+        name, n = stem, 2
+        while name in used:
+            name, n = f"{stem} ({n})", n + 1
+        used.add(name)
+        dirs[job["id"]] = os.path.join(out_dir, name)
+    return dirs
+
+
+def run_batch(jobs, out_dir=None, workers=2, journal_path="batch_journal.jsonl", force=False, profile_log="off",
+              keep_days=BATCH_KEEP_DAYS):
+    """מריץ את העבודות במאגר תהליכים, מדווח התקדמות ל-stderr ומחזיר את הדוח המסכם"""
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+    started = time.perf_counter()
+    previous = {} if force else load_journal(journal_path)
+    export_dirs = _export_dirs(jobs, out_dir) if out_dir else {}
+
+    results = {}
+    pending = []
+    for job in jobs:
+        entry = previous.get(job["id"])
+        if _is_done(job, entry, export_dirs.get(job["id"])):
+            results[job["id"]] = {**entry, "skipped": True}
+            app.result_cache_add_ref(entry.get("key"), BATCH_REF_OWNER, ttl_seconds=keep_days * 86400)
+        else:
+            pending.append(job)
+    total = len(jobs)
+    finished = len(results)
+    print(f"{total} jobs, {finished} already done, {len(pending)} to run with {workers} workers", file=sys.stderr)
+
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    with open(journal_path, "a", encoding="utf-8") as journal, \
+            ProcessPoolExecutor(max_workers=max(1, workers), mp_context=ctx, initializer=_init_worker, initargs=(profile_log,)) as pool:
+        futures = {pool.submit(run_job, job, export_dirs.get(job["id"]), keep_days): job for job in pending}
+        try:
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # תהליך עובד שנהרג (למשל מחוסר זיכרון)
+                    result = {"id": job["id"], "kind": job["kind"], "pipeline_version": app.PIPELINE_VERSION,
+                              "status": "crashed", "error": f"{type(e).__name__}: {e}"}
+                _append_journal(journal, result)
+                results[job["id"]] = result
+                finished += 1
+                elapsed = time.perf_counter() - started
+                print(f"[{finished}/{total}] {result['status']:<14} {job['name']} ({result.get('seconds', 0):.1f}s, elapsed {elapsed:.0f}s)",
+                      file=sys.stderr)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("interrupted - run again to resume", file=sys.stderr)
+            raise
+
+    ordered = [results[job["id"]] for job in jobs if job["id"] in results]
+    counts = {}
+    for result in ordered:
+        status = "skipped" if result.get("skipped") else result["status"]
+        counts[status] = counts.get(status, 0) + 1
+    return {
+        "started": started_at,
+        "finished": datetime.datetime.now().isoformat(timespec="seconds"),
+        "seconds": round(time.perf_counter() - started, 1),
+        "pipeline_version": app.PIPELINE_VERSION,
+        "workers": workers,
+        "counts": counts,
+        "jobs": ordered,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("inputs", nargs="*", help="קבצי PDF או תיקיות")
+    parser.add_argument("--post", action="append", help="מזהה פוסט באתר (אפשר כמה, מופרדים בפסיק)")
+    parser.add_argument("--out", help="תיקייה לייצוא ארבע הגרסאות של כל גיליון (ברירת מחדל: רק מאגר התוצרים)")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--journal", default="batch_journal.jsonl", help="יומן ההתקדמות, להמשך אחרי קריסה")
+    parser.add_argument("--report", default="batch_report.json")
+    parser.add_argument("--force", action="store_true", help="מעבד מחדש גם עבודות שכבר הסתיימו")
+    parser.add_argument("--profile-log", default="off", help="PROFILE_LOG לתהליכים העובדים")
+    parser.add_argument("--keep-days", type=float, default=BATCH_KEEP_DAYS,
+                        help="כמה ימים רשומות האצווה מוגנות מניקוי המאגר")
+    args = parser.parse_args()
+
+    jobs = collect_jobs(args.inputs, _parse_post_ids(args.post))
+    if not jobs:
+        parser.error("no inputs")
+    report = run_batch(jobs, args.out, args.workers, args.journal, args.force, args.profile_log, args.keep_days)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report["counts"], ensure_ascii=False), file=sys.stderr)
+    failed = sum(n for status, n in report["counts"].items() if status not in SETTLED_STATUSES + ("skipped",))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+מדידת ביצועים לשלבי העיבוד.
+
+הרצה:
+    python benchmark.py grayscale file1.pdf [file2.pdf ...]
+    python benchmark.py suite --out baseline.json [--baseline old.json] [--repeat 3]
+    python benchmark.py generate out.pdf [--pages 12] [--density 1.0] [--marker-scale 0.95]
+
+suite מייצר גיליונות סינתטיים (שלושה טורים מימין לשמאל, תמונות סימון בגדלים שונים ותמונות
+שחוצות טורים), מודד כל פונקציה בנפרד ואת כל השרשרת, וכותב JSON. עם --baseline מושווים
+הזמנים לריצה קודמת, ויציאה עם קוד 1 אם שלב כלשהו האט יותר מ---tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+import cv2
+import fitz
+import numpy as np
+
+import app
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842
+# הקצה הימני של כל טור (טקסט עברי מיושר לימין)
+COLUMN_RIGHT_EDGES = (560, 370, 180)
+COLUMN_WIDTH = 170
+HEBREW_WORDS = ("בראשית", "ויאמר", "משה", "אל", "העם", "שבת", "שלום", "פרשת", "השבוע", "והנה", "כי", "על", "דבר", "ישראל", "תורה")
+LATIN_WORDS = ("alpha", "beta", "gamma", "delta", "epsilon", "zeta", "eta", "theta")
+HEBREW_FONT_CANDIDATES = (
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+)
+
+# רוב גודלי הסימן נלקחים מתוך MARKER_SCALES: ההתאמה החזותית רגישה לגודל, וסימן שנופל בין שני צעדים
+# בפירמידה (למשל 0.75 בין 0.73 ל-0.84) מקבל ציון נמוך ולא מזוהה. מקרי off_grid מודדים בדיוק את זה:
+# הזיהוי לפי התמונות המוטמעות מוצא אותם, והסריקה החזותית (כרגע) לא - markers_found_by_path מראה את הפער
+DEFAULT_MARKER_SCALE = round(float(app.MARKER_SCALES[5]), 4)
+
+# המקרים שנמדדים כברירת מחדל: גודל, צפיפות וגודל סימן שונים
+SUITE_CASES = (
+    {"name": "small", "pages": 12, "density": 1.0, "marker_scale": DEFAULT_MARKER_SCALE},
+    {"name": "dense", "pages": 12, "density": 2.0, "marker_scale": DEFAULT_MARKER_SCALE},
+    {"name": "long", "pages": 40, "density": 1.0, "marker_scale": DEFAULT_MARKER_SCALE},
+    {"name": "small_markers", "pages": 12, "density": 1.0, "marker_scale": round(float(app.MARKER_SCALES[2]), 4)},
+    {"name": "large_markers", "pages": 12, "density": 1.0, "marker_scale": round(float(app.MARKER_SCALES[9]), 4)},
+    {"name": "off_grid_markers", "pages": 12, "density": 1.0, "marker_scale": 0.75},
+    {"name": "off_grid_large_markers", "pages": 12, "density": 1.0, "marker_scale": 1.1},
+)
+
+
+def bench_grayscale(pdf_paths, backends=None, repeat=3):
+    """מריץ כל מנוע על כל קובץ ומחזיר זמן ממוצע וגודל פלט"""
+    backends = backends or list(app.GRAYSCALE_BACKENDS)
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="bench_")
+    try:
+        for pdf_path in pdf_paths:
+            for backend in backends:
+                if backend == "ghostscript" and not shutil.which("gs"):
+                    results.append({"file": pdf_path, "backend": backend, "skipped": "gs not installed"})
+                    continue
+                output_path = os.path.join(work_dir, f"{backend}.pdf")
+                times = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    app.GRAYSCALE_BACKENDS[backend](pdf_path, output_path)
+                    times.append(time.perf_counter() - start)
+                results.append({
+                    "file": pdf_path,
+                    "backend": backend,
+                    "seconds": round(sum(times) / len(times), 4),
+                    "input_bytes": os.path.getsize(pdf_path),
+                    "output_bytes": os.path.getsize(output_path),
+                })
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+# --- גיליונות סינתטיים ---
+
+def _find_hebrew_font(font_path=None):
+    for path in ((font_path,) if font_path else HEBREW_FONT_CANDIDATES):
+        if path and os.path.exists(path) and fitz.Font(fontfile=path).has_glyph(ord("א")):
+            return fitz.Font(fontfile=path)
+    return None
+
+
+def _banner_image(width, height, rng):
+    """תמונה צבעונית (מעבר צבע עם רעש) שמדמה צילום רחב בגיליון"""
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    rgb = np.stack([np.broadcast_to(x, (height, width)), np.broadcast_to(y, (height, width)),
+                    np.full((height, width), 128, np.float32)], axis=2)
+    rgb += rng.normal(0, 20, rgb.shape)
+    return fitz.Pixmap(fitz.csRGB, width, height, np.clip(rgb, 0, 255).astype(np.uint8).tobytes(), 0)
+
+
+def _marker_size(template_path, marker_scale):
+    """גודל הסימן בעמוד כך שברינדור לסריקה הוא יהיה marker_scale מגודל התבנית"""
+    height_px, width_px = cv2.imread(template_path).shape[:2]
+    return width_px / app.MARKER_RENDER_ZOOM * marker_scale, height_px / app.MARKER_RENDER_ZOOM * marker_scale
+
+
+def _covered_columns(rect):
+    """הטורים שהמלבן עולה עליהם (סימן גדול יכול לחצות יותר מטור אחד)"""
+    return [col for col, right in enumerate(COLUMN_RIGHT_EDGES) if rect.x0 < right and rect.x1 > right - COLUMN_WIDTH]
+
+
+def make_synthetic_issue(output_path, pages=12, density=1.0, marker_scale=DEFAULT_MARKER_SCALE, start_page=None, end_page=None,
+                         spanning_images=True, seed=0, font_path=None, start_img="start.png", end_img="end.png"):
+    """
+    יוצר גיליון בפריסת שלושה טורים מימין לשמאל. density מגדיל את מספר המילים בעמוד (גופן קטן יותר),
+    סימן ההתחלה מופיע בראש הטור הימני של start_page וסימן הסיום בתחתית הטור השמאלי של end_page.
+    מחזיר את מספרי העמודים של הסימנים.
+    """
+    rng = np.random.default_rng(seed)
+    word_rng = random.Random(seed)
+    start_page = min(2, pages - 1) if start_page is None else start_page
+    end_page = max(start_page, pages - 3) if end_page is None else end_page
+    font = _find_hebrew_font(font_path)
+    words = HEBREW_WORDS if font else LATIN_WORDS
+    font = font or fitz.Font("helv")
+    fontsize = 9.0 / density
+    line_height = fontsize * 1.35
+    space = font.text_length(" ", fontsize=fontsize)
+    word_widths = {word: font.text_length(word, fontsize=fontsize) for word in words}
+
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        writer = fitz.TextWriter(page.rect)
+        column_tops = [70.0, 70.0, 70.0]
+        column_bottoms = [790.0, 790.0, 790.0]
+
+        if page_num == 0:
+            # כותרת רחבה משותפת לכל הטורים
+            title = " ".join(word_rng.choice(words) for _ in range(6))
+            title = title[::-1] if words is HEBREW_WORDS else title
+            writer.append((COLUMN_RIGHT_EDGES[0] - font.text_length(title, fontsize=20), 52), title, font=font, fontsize=20)
+        if spanning_images and page_num % 4 == 1:
+            # תמונה שחוצה את שני הטורים הימניים
+            image_rect = fitz.Rect(COLUMN_RIGHT_EDGES[1] - COLUMN_WIDTH, 70, COLUMN_RIGHT_EDGES[0], 210)
+            page.insert_image(image_rect, pixmap=_banner_image(360, 140, rng))
+            column_tops[0] = column_tops[1] = image_rect.y1 + 14
+        if page_num == start_page:
+            # מיושר לימין הטור הימני, מתחת לתמונה אם יש
+            width, height = _marker_size(start_img, marker_scale)
+            top = max(column_tops[col] for col in _covered_columns(fitz.Rect(COLUMN_RIGHT_EDGES[0] - width, 0, COLUMN_RIGHT_EDGES[0], 1)))
+            rect = fitz.Rect(COLUMN_RIGHT_EDGES[0] - width, top, COLUMN_RIGHT_EDGES[0], top + height)
+            page.insert_image(rect, filename=start_img)
+            for col in _covered_columns(rect):
+                column_tops[col] = rect.y1 + 14
+        if page_num == end_page:
+            # מיושר לשמאל הטור השמאלי, בתחתית העמוד
+            width, height = _marker_size(end_img, marker_scale)
+            left = COLUMN_RIGHT_EDGES[2] - COLUMN_WIDTH
+            rect = fitz.Rect(left, 780 - height, left + width, 780)
+            page.insert_image(rect, filename=end_img)
+            for col in _covered_columns(rect):
+                column_bottoms[col] = rect.y0 - 14
+
+        for col, right in enumerate(COLUMN_RIGHT_EDGES):
+            y = column_tops[col] + fontsize
+            while y < column_bottoms[col]:
+                # שורה מיושרת לימין עם קצה שמאלי לא אחיד. השורה נכתבת כרצף אחד בסדר חזותי
+                # (המחרוזת הלוגית הפוכה), והמילים מופרדות ברווחים כמו בגיליון אמיתי
+                limit = COLUMN_WIDTH * word_rng.uniform(0.8, 1.0)
+                line, line_width = [], -space
+                while True:
+                    word = word_rng.choice(words)
+                    if line_width + space + word_widths[word] > limit:
+                        break
+                    line.append(word)
+                    line_width += space + word_widths[word]
+                text = " ".join(line)
+                text = text[::-1] if words is HEBREW_WORDS else text
+                writer.append((right - line_width, y), text, font=font, fontsize=fontsize)
+                y += line_height
+        writer.write_text(page)
+    doc.save(output_path, garbage=3, deflate=True)
+    doc.close()
+    return start_page, end_page
+
+
+# --- מדידה ---
+
+def _timed(func, repeat, setup=None):
+    """
+    מריץ func repeat פעמים ומחזיר (חציון, מינימום, התוצאה האחרונה).
+    setup: אם ניתן, נקרא לפני כל חזרה (מחוץ למדידה) והתוצאה שלו מועברת ל-func.
+    """
+    times = []
+    result = None
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - start)
+    return round(statistics.median(times), 4), round(min(times), 4), result
+
+
+# מסלולי הזיהוי שנמדדים בכל מקרה: טביעות התמונות המוטמעות (ברירת המחדל) והסריקה החזותית,
+# שאליה חוזרים כשהסימן לא מוטמע כתמונה - כך שהאטה באחד מהם לא מוסתרת ע"י השני
+SCAN_PATHS = {"digest": True, "raster": False}
+
+
+def bench_case(case, work_dir, repeat=3, start_img="start.png", end_img="end.png"):
+    """
+    מודד מקרה אחד: כל פונקציה בנפרד ואת process_document מקצה לקצה. הזיהוי והשרשרת נמדדים בכל
+    אחד מ-SCAN_PATHS, ובכל חזרה עם MarkerMatcher חדשים - known_digests של ריצה קודמת לא מקצר את הבאה.
+    """
+    def fresh_matchers():
+        return app.MarkerMatcher.from_file(start_img), app.MarkerMatcher.from_file(end_img)
+
+    start_matcher, end_matcher = fresh_matchers()
+    case_dir = os.path.join(work_dir, case["name"])
+    os.makedirs(case_dir, exist_ok=True)
+    input_path = os.path.join(case_dir, "input.pdf")
+    start_page, end_page = make_synthetic_issue(
+        input_path, pages=case["pages"], density=case["density"], marker_scale=case["marker_scale"], seed=case.get("seed", 0)
+    )
+    regular_path = os.path.join(case_dir, "regular.pdf")
+    result = {**case, "input_bytes": os.path.getsize(input_path), "timings": {}}
+    timings = result["timings"]
+
+    doc = fitz.open(input_path)
+    matrix = fitz.Matrix(app.MARKER_RENDER_ZOOM, app.MARKER_RENDER_ZOOM)
+    marker_pix = doc[start_page].get_pixmap(matrix=matrix)
+    plain_pix = doc[(start_page + 1) % len(doc)].get_pixmap(matrix=matrix)
+    doc.close()
+    timings["find_image_in_page.marker"], _, found = _timed(lambda: app.find_image_in_page(marker_pix, start_matcher), repeat)
+    timings["find_image_in_page.plain"], _, _ = _timed(lambda: app.find_image_in_page(plain_pix, start_matcher), repeat)
+    result["marker_detected"] = bool(found)
+
+    result["markers_found_by_path"] = {}
+    for path_name, digest_scan in SCAN_PATHS.items():
+        scan_info = {}
+        with _digest_scan(digest_scan):
+            timings[f"extract_pdf_by_images.{path_name}"], _, ok = _timed(
+                lambda start, end: app.extract_pdf_by_images(input_path, regular_path, start, end, scan_info=scan_info),
+                repeat, fresh_matchers
+            )
+        result["markers_found_by_path"][path_name] = (
+            bool(ok) and (scan_info.get("start_page"), scan_info.get("end_page")) == (start_page, end_page))
+    result["markers_found"] = all(result["markers_found_by_path"].values())
+    if not any(result["markers_found_by_path"].values()):
+        return result
+    result["regular_pages"] = end_page - start_page + 1
+
+    cut_path = os.path.join(case_dir, "cut.pdf")
+    timings["split_pdf_to_columns"], _, _ = _timed(lambda: app.split_pdf_to_columns(regular_path, cut_path), repeat)
+    result["cut_bytes"] = os.path.getsize(cut_path)
+    # אותו חיתוך בשמירה הרגילה, להשוואת הגודל מול השמירה הדחוסה
+    plain_cut_path = os.path.join(case_dir, "cut_plain.pdf")
+    app.split_pdf_to_columns(regular_path, plain_cut_path, compact=False)
+    result["cut_bytes_plain"] = os.path.getsize(plain_cut_path)
+    for backend in app.GRAYSCALE_BACKENDS:
+        if backend == "ghostscript" and not shutil.which("gs"):
+            continue
+        bw_path = os.path.join(case_dir, f"bw_{backend}.pdf")
+        timings[f"convert_pdf_to_bw.{backend}"], _, _ = _timed(lambda: app.convert_pdf_to_bw(regular_path, bw_path, backend), repeat)
+
+    def end_to_end(start, end):
+        outputs = {variant: os.path.join(case_dir, f"e2e_{variant}.pdf") for variant in app.RESULT_VARIANTS}
+        for path in outputs.values():
+            if os.path.exists(path):
+                os.remove(path)
+        return app.process_document(input_path, outputs, start, end, targets=app.RESULT_VARIANTS)
+    for path_name, digest_scan in SCAN_PATHS.items():
+        with _digest_scan(digest_scan):
+            timings[f"end_to_end.{path_name}"], _, _ = _timed(end_to_end, repeat, fresh_matchers)
+    return result
+
+
+@contextmanager
+def _digest_scan(enabled):
+    previous = app.MARKER_DIGEST_SCAN
+    app.MARKER_DIGEST_SCAN = enabled
+    try:
+        yield
+    finally:
+        app.MARKER_DIGEST_SCAN = previous
+
+
+def _environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "pipeline_version": app.PIPELINE_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "pymupdf": fitz.VersionBind,
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "grayscale_backend": app.GRAYSCALE_BACKEND,
+        "marker_search_mode": app.MARKER_SEARCH_MODE,
+        "ghostscript": bool(shutil.which("gs")),
+    }
+
+
+def run_suite(cases=SUITE_CASES, repeat=3, profile_log="off"):
+    # כברירת מחדל הפלט לא נכתב ליומן המדידות של האפליקציה כדי לא להעמיס על זמני המדידה
+    app.PROFILE_LOG = profile_log
+    if app.GRAYSCALE_BACKEND == "ghostscript" and not shutil.which("gs"):
+        # בלי gs השרשרת הייתה מודדת רק את ההעתקה של מסלול הכישלון
+        app.GRAYSCALE_BACKEND = "pymupdf"
+    work_dir = tempfile.mkdtemp(prefix="bench_suite_")
+    try:
+        results = [bench_case(case, work_dir, repeat) for case in cases]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {"environment": _environment(), "repeat": repeat, "cases": results}
+
+
+def compare_to_baseline(current, baseline, tolerance=0.3):
+    """מחזיר רשימת האטות: כל מדידה שגדלה ביותר מ-tolerance לעומת הבסיס, וכל מסלול זיהוי שנשבר"""
+    baseline_cases = {case["name"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in current["cases"]:
+        old = baseline_cases.get(case["name"])
+        if not old:
+            continue
+        if old.get("markers_found") and not case.get("markers_found"):
+            regressions.append({"case": case["name"], "metric": "markers_found", "baseline": True, "current": False})
+        # במקרי off_grid markers_found כבר False בבסיס, ולכן כל מסלול נבדק גם בנפרד
+        for path_name, found in case.get("markers_found_by_path", {}).items():
+            if old.get("markers_found_by_path", {}).get(path_name) and not found:
+                regressions.append({"case": case["name"], "metric": f"markers_found.{path_name}", "baseline": True, "current": False})
+        for metric, seconds in case["timings"].items():
+            old_seconds = old.get("timings", {}).get(metric)
+            if old_seconds and seconds > old_seconds * (1 + tolerance):
+                regressions.append({"case": case["name"], "metric": metric, "baseline": old_seconds,
+                                    "current": seconds, "ratio": round(seconds / old_seconds, 2)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gray = sub.add_parser("grayscale", help="השוואת מנועי השחור-לבן (מהירות וגודל קובץ)")
+    gray.add_argument("pdfs", nargs="+")
+    gray.add_argument("--backend", action="append", choices=list(app.GRAYSCALE_BACKENDS))
+    gray.add_argument("--repeat", type=int, default=3)
+
+    suite = sub.add_parser("suite", help="מדידת כל השלבים על גיליונות סינתטיים")
+    suite.add_argument("--out", help="קובץ JSON לתוצאות (ברירת מחדל: הדפסה)")
+    suite.add_argument("--baseline", help="קובץ JSON מריצה קודמת להשוואה")
+    suite.add_argument("--tolerance", type=float, default=0.3, help="האטה יחסית מותרת לפני שמדווחת רגרסיה")
+    suite.add_argument("--repeat", type=int, default=3)
+    suite.add_argument("--case", action="append", choices=[case["name"] for case in SUITE_CASES])
+    suite.add_argument("--profile-log", default="off", help="PROFILE_LOG בזמן המדידה (stdout או נתיב לקובץ, לדיבוג)")
+
+    generate = sub.add_parser("generate", help="יצירת גיליון סינתטי לבדיקה ידנית")
+    generate.add_argument("output")
+    generate.add_argument("--pages", type=int, default=12)
+    generate.add_argument("--density", type=float, default=1.0)
+    generate.add_argument("--marker-scale", type=float, default=DEFAULT_MARKER_SCALE)
+    generate.add_argument("--seed", type=int, default=0)
+    generate.add_argument("--font", help="קובץ גופן עם אותיות עבריות")
+
+    args = parser.parse_args()
+    if args.command == "grayscale":
+        print(json.dumps(bench_grayscale(args.pdfs, args.backend, args.repeat), indent=2, ensure_ascii=False))
+    elif args.command == "generate":
+        pages = make_synthetic_issue(args.output, args.pages, args.density, args.marker_scale, seed=args.seed, font_path=args.font)
+        print(json.dumps({"output": args.output, "start_page": pages[0], "end_page": pages[1]}))
+    elif args.command == "suite":
+        cases = [case for case in SUITE_CASES if not args.case or case["name"] in args.case]
+        report = run_suite(cases, args.repeat, args.profile_log)
+        if args.baseline:
+            with open(args.baseline, encoding="utf-8") as f:
+                report["regressions"] = compare_to_baseline(report, json.load(f), args.tolerance)
+        text = json.dumps(report, indent=2, ensure_ascii=False)
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+        else:
+            print(text)
+        if report.get("regressions"):
+            print(json.dumps(report["regressions"], indent=2, ensure_ascii=False), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,690 @@
+"""
+המרה לגווני אפור בתוך התהליך (מנוע "pymupdf" של convert_pdf_to_bw), בלי Ghostscript.
+
+בסריקת זרמי התוכן מחרוזות, הערות ונתוני תמונות inline מדולגים, כך שטקסט שנראה כמו פקודת צבע
+לא משתנה. מרחבי RGB/CMYK/Lab/ICC מומרים בזרם עצמו; Indexed/Separation/DeviceN
+מומרים בהגדרת המרחב (טבלת הצבעים או פונקציית הגוון), כך שמספר הרכיבים בזרם לא משתנה.
+אובייקטים קיימים משתנים מפתח-מפתח (xref_set_key), ורק הערכים שהומרו נכתבים מחדש.
+"""
+import re
+import zlib
+
+import fitz
+import numpy as np
+
+_PDF_WS = rb"\x00\t\n\x0c\r "
+_PDF_REGULAR = rb"[^\x00\t\n\x0c\r ()<>\[\]{}/%]"
+_PDF_TOKEN = re.compile(
+    rb"(?P<ws>[" + _PDF_WS + rb"]+)"
+    rb"|(?P<comment>%[^\r\n]*)"
+    rb"|(?P<string>\()"
+    rb"|(?P<dict><<|>>)"
+    rb"|(?P<hex><[^>]*>)"
+    rb"|(?P<array>[\[\]])"
+    rb"|(?P<proc>[{}])"
+    rb"|(?P<name>/" + _PDF_REGULAR + rb"*)"
+    rb"|(?P<number>[+-]?(?:\d+\.?\d*|\.\d+)(?!" + _PDF_REGULAR + rb"))"
+    rb"|(?P<op>" + _PDF_REGULAR + rb"+)"
+)
+_PDF_STRING_BODY = re.compile(rb"(?:\\.|[^\\()])*", re.S)
+_PDF_INLINE_END = re.compile(rb"[" + _PDF_WS + rb"]EI(?=[" + _PDF_WS + rb"]|$)")
+_PDF_ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f"}
+# חיפוש מהיר בזרם תוכן: מחרוזות והערות מדולגות, ופקודות הצבע והמצב נתפסות יחד עם האופרנדים שלפניהן
+_COLOR_CONTENT = re.compile(
+    rb"(?P<string>\()"
+    rb"|(?P<comment>%[^\r\n]*)"
+    rb"|(?<![^" + _PDF_WS + rb"\])>}])"
+    rb"(?P<operands>(?:(?:[+-]?(?:\d+\.?\d*|\.\d+)|/" + _PDF_REGULAR + rb"*)[" + _PDF_WS + rb"]+)*)"
+    rb"(?P<op>rg|RG|k|K|g|G|cs|CS|scn?|SCN?|q|Q|BI)(?!" + _PDF_REGULAR + rb")"
+)
+_COLOR_OPERATORS = re.compile(rb"(?:^|[" + _PDF_WS + rb"\])>])(?:rg|RG|k|K|cs|CS|scn?|SCN?|BI)(?=[" + _PDF_WS + rb"/\[<(]|$)")
+
+def _pdf_string_end(data, pos):
+    """מחזיר את המיקום שאחרי סוף מחרוזת ליטרלית שנפתחה לפני pos (סוגריים מקוננים ותווי escape)"""
+    depth = 1
+    while depth and pos < len(data):
+        pos = _PDF_STRING_BODY.match(data, pos).end()
+        if pos < len(data):
+            depth += 1 if data[pos] == 0x28 else -1
+            pos += 1
+    return pos
+
+def _pdf_tokens(data, pos=0):
+    """מפרק בתים של PDF לאסימונים (סוג, ערך, התחלה, סוף). מחרוזות נבלעות בשלמותן, כולל סוגריים מקוננים"""
+    end = len(data)
+    while pos < end:
+        m = _PDF_TOKEN.match(data, pos)
+        if m is None:  # בית שלא פותח אסימון (למשל ')' יתום)
+            yield "junk", data[pos:pos + 1], pos, pos + 1
+            pos += 1
+            continue
+        kind = m.lastgroup
+        stop = m.end()
+        if kind == "string":
+            stop = _pdf_string_end(data, stop)
+        yield kind, data[pos:stop], pos, stop
+        pos = stop
+
+def _pdf_string_bytes(token):
+    """מחזיר את הבתים של מחרוזת PDF (ליטרלית או הקסדצימלית)"""
+    if token.startswith(b"<"):
+        digits = re.sub(rb"[^0-9A-Fa-f]", b"", token)
+        return bytes.fromhex((digits + b"0" * (len(digits) % 2)).decode())
+    out = []
+    body = token[1:-1]
+    i = 0
+    while i < len(body):
+        ch = body[i:i + 1]
+        if ch != b"\\":
+            out.append(ch)
+            i += 1
+            continue
+        nxt = body[i + 1:i + 2]
+        octal = re.match(rb"[0-7]{1,3}", body[i + 1:i + 4])
+        if octal:
+            out.append(bytes([int(octal.group(), 8) & 0xFF]))
+            i += 1 + len(octal.group())
+        elif nxt in (b"\r", b"\n"):
+            i += 3 if body[i + 1:i + 3] == b"\r\n" else 2
+        else:
+            out.append(_PDF_ESCAPES.get(nxt, nxt))
+            i += 2
+    return b"".join(out)
+
+class _PdfRef(int):
+    """הפניה עקיפה (N G R) בתוצאת _pdf_parse: הערך הוא מספר האובייקט, ו-gen נשמר כדי להיכתב חזרה כמו שהוא"""
+    def __new__(cls, num, gen=0):
+        ref = super().__new__(cls, num)
+        ref.gen = gen
+        return ref
+
+def _pdf_parse(text):
+    """
+    מפענח אובייקט PDF בודד (כפי שמחזירים xref_object/xref_get_key) למבני פייתון:
+    מילון -> dict, מערך -> list, שם -> str ('/Name'), מספר -> int/float, הפניה -> _PdfRef, מחרוזת -> bytes.
+    """
+    if isinstance(text, str):
+        text = text.encode("latin-1")
+    tokens = [t for t in _pdf_tokens(text) if t[0] not in ("ws", "comment")]
+    pos = 0
+
+    def value():
+        nonlocal pos
+        kind, token = tokens[pos][:2]
+        pos += 1
+        if kind == "number":
+            if (pos + 1 < len(tokens) and tokens[pos][0] == "number" and tokens[pos + 1][1] == b"R"
+                    and b"." not in token):
+                gen = int(tokens[pos][1])
+                pos += 2
+                return _PdfRef(int(token), gen)
+            return float(token) if b"." in token else int(token)
+        if kind == "name":
+            return token.decode("latin-1")
+        if kind in ("string", "hex"):
+            return _pdf_string_bytes(token)
+        if token == b"[":
+            items = []
+            while tokens[pos][1] != b"]":
+                items.append(value())
+            pos += 1
+            return items
+        if token == b"<<":
+            items = {}
+            while tokens[pos][1] != b">>":
+                key = value()
+                items[key] = value()
+            pos += 1
+            return items
+        if kind == "proc":  # תוכנית PostScript - לא נדרשת כאן
+            return token.decode("latin-1")
+        return {b"true": True, b"false": False, b"null": None}.get(token, token.decode("latin-1"))
+
+    return value() if tokens else None
+
+def _pdf_number(value):
+    text = "%.5f" % value
+    return text.rstrip("0").rstrip(".") if "." in text else text
+
+def _pdf_serialize(obj):
+    """הפעולה ההפוכה ל-_pdf_parse: מבנה פייתון לטקסט PDF"""
+    if isinstance(obj, _PdfRef):
+        return f"{int(obj)} {obj.gen} R"
+    if isinstance(obj, bool):
+        return "true" if obj else "false"
+    if obj is None:
+        return "null"
+    if isinstance(obj, int):
+        return str(obj)
+    if isinstance(obj, float):
+        return _pdf_number(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return "<" + bytes(obj).hex() + ">"
+    if isinstance(obj, list):
+        return "[" + " ".join(_pdf_serialize(v) for v in obj) + "]"
+    if isinstance(obj, dict):
+        return "<<" + " ".join(f"{k} {_pdf_serialize(v)}" for k, v in obj.items()) + ">>"
+    return str(obj)
+
+def _pdf_resolve(doc, obj):
+    while isinstance(obj, _PdfRef):
+        obj = _pdf_parse(doc.xref_object(obj, compressed=True))
+    return obj
+
+_GRAY_FORMULAS = {
+    "gray": lambda v: v[0],
+    "rgb": lambda v: 0.3 * v[0] + 0.59 * v[1] + 0.11 * v[2],
+    "cmyk": lambda v: 1.0 - np.minimum(1.0, 0.3 * v[0] + 0.59 * v[1] + 0.11 * v[2] + v[3]),
+    "lab": lambda v: v[0] / 100.0,
+}
+_COLOR_COMPONENTS = {"gray": 1, "rgb": 3, "cmyk": 4, "lab": 3}
+_COLORSPACE_KINDS = {
+    "/DeviceGray": "gray", "/G": "gray", "/CalGray": "gray",
+    "/DeviceRGB": "rgb", "/RGB": "rgb", "/CalRGB": "rgb",
+    "/DeviceCMYK": "cmyk", "/CMYK": "cmyk", "/Lab": "lab",
+}
+_ICC_KINDS = {1: "gray", 3: "rgb", 4: "cmyk"}
+# קוד PostScript שמצטרף לסוף פונקציה מסוג 4 וממיר את הפלט שלה לרכיב אפור אחד
+_GRAY_POSTSCRIPT = {
+    "gray": "",
+    "rgb": " 0.11 mul exch 0.59 mul add exch 0.3 mul add",
+    "cmyk": " 4 1 roll 0.11 mul exch 0.59 mul add exch 0.3 mul add add dup 1 gt {pop 1} if 1 exch sub",
+    "lab": " pop pop 100 div",
+}
+
+def _to_gray(kind, values):
+    return min(1.0, max(0.0, float(_GRAY_FORMULAS[kind](values))))
+
+def _gray_samples(samples, kind):
+    """ממיר דגימות של 8 ביט (רכיבים שזורים) לדגימות אפורות של 8 ביט"""
+    n = _COLOR_COMPONENTS[kind]
+    values = np.frombuffer(samples, np.uint8)[:len(samples) // n * n].reshape(-1, n).T / 255.0
+    if kind == "lab":
+        values = values * 100.0
+    return (np.clip(_GRAY_FORMULAS[kind](values), 0.0, 1.0) * 255 + 0.5).astype(np.uint8)
+
+def _colorspace_kind(doc, cs):
+    """
+    מסווג מרחב צבע: 'gray'/'rgb'/'cmyk'/'lab' כשאפשר להמיר את הרכיבים ישירות (כולל ICCBased ו-Cal*),
+    אחרת שם המשפחה ('/Indexed', '/Separation', '/DeviceN', '/Pattern') או השם עצמו אם אינו מוכר.
+    """
+    cs = _pdf_resolve(doc, cs)
+    if isinstance(cs, list) and cs:
+        if cs[0] == "/ICCBased" and len(cs) > 1:
+            return _ICC_KINDS.get(_pdf_resolve(doc, cs[1]).get("/N"), "/ICCBased")
+        return _COLORSPACE_KINDS.get(cs[0], cs[0])
+    if isinstance(cs, str):
+        return _COLORSPACE_KINDS.get(cs, cs)
+    return None
+
+def _new_stream_object(doc, obj, data):
+    xref = doc.get_new_xref()
+    doc.update_object(xref, _pdf_serialize({k: v for k, v in obj.items()
+                                            if k not in ("/Length", "/Filter", "/DecodeParms")}))
+    doc.update_stream(xref, data, new=True)
+    return _PdfRef(xref)
+
+def _gray_function(doc, fn, kind, cache):
+    """
+    מחזיר פונקציה שמחשבת ישירות את הגוון האפור של הפלט של fn במרחב kind (סוגים 0, 2, 3 ו-4,
+    או מערך של פונקציות מסוג 2), או None אם הפונקציה לא נתמכת.
+    """
+    if kind == "gray":
+        return fn
+    key = (int(fn), kind) if isinstance(fn, _PdfRef) else None
+    if key in cache:
+        return cache[key]
+    obj = _pdf_resolve(doc, fn)
+    result = None
+    if isinstance(obj, list):
+        parts = [_pdf_resolve(doc, f) for f in obj]
+        if (len(parts) == _COLOR_COMPONENTS[kind] and all(p.get("/FunctionType") == 2 for p in parts)
+                and len({(p.get("/N"), str(p.get("/Domain"))) for p in parts}) == 1):
+            result = dict(parts[0])
+            result["/C0"] = [_to_gray(kind, [p.get("/C0", [0.0])[0] for p in parts])]
+            result["/C1"] = [_to_gray(kind, [p.get("/C1", [1.0])[0] for p in parts])]
+            result.pop("/Range", None)
+    elif isinstance(obj, dict):
+        ftype = obj.get("/FunctionType")
+        gray = dict(obj)
+        if "/Range" in gray:
+            gray["/Range"] = [0, 1]
+        if ftype == 2:
+            gray["/C0"] = [_to_gray(kind, obj.get("/C0", [0.0]))]
+            gray["/C1"] = [_to_gray(kind, obj.get("/C1", [1.0]))]
+            result = gray
+        elif ftype == 3:
+            parts = [_gray_function(doc, f, kind, cache) for f in obj.get("/Functions", [])]
+            if parts and None not in parts:
+                gray["/Functions"] = parts
+                result = gray
+        elif ftype == 4 and isinstance(fn, _PdfRef):
+            program = doc.xref_stream(fn).decode("latin-1")
+            close = program.rfind("}")
+            if close > 0:
+                result = _new_stream_object(doc, gray, (program[:close] + _GRAY_POSTSCRIPT[kind]
+                                                        + " " + program[close:]).encode("latin-1"))
+        elif ftype == 0 and isinstance(fn, _PdfRef) and obj.get("/BitsPerSample") in (8, 16):
+            n = _COLOR_COMPONENTS[kind]
+            bps = obj["/BitsPerSample"]
+            decode = obj.get("/Decode", obj.get("/Range"))
+            count = int(np.prod(obj.get("/Size", [0]))) * n
+            raw = np.frombuffer(doc.xref_stream(fn), ">u2" if bps == 16 else np.uint8)
+            if decode and len(decode) >= 2 * n and len(raw) >= count:
+                values = raw[:count].reshape(-1, n).T / float(2 ** bps - 1)
+                values = np.array([decode[2 * i] + values[i] * (decode[2 * i + 1] - decode[2 * i]) for i in range(n)])
+                samples = (np.clip(_GRAY_FORMULAS[kind](values), 0.0, 1.0) * 255 + 0.5).astype(np.uint8)
+                gray.update({"/BitsPerSample": 8, "/Range": [0, 1], "/Decode": [0, 1]})
+                result = _new_stream_object(doc, gray, samples.tobytes())
+    if key:
+        cache[key] = result
+    return result
+
+def _gray_colorspace(doc, cs, cache):
+    """
+    מחזיר הגדרה אפורה למרחב Indexed/Separation/DeviceN/Pattern שמבוסס על צבע, או None אם אין מה
+    להמיר או שההמרה לא נתמכת. טבלת הצבעים, פונקציית הגוון או מרחב הבסיס מומרים; הרכיבים שבזרם לא משתנים.
+    """
+    if not isinstance(cs, list) or not cs:
+        return None
+    family = cs[0]
+    if family in ("/Indexed", "/I") and len(cs) == 4:
+        base = _colorspace_kind(doc, cs[1])
+        if base not in _GRAY_FORMULAS or base == "gray":
+            return None
+        lookup = cs[3]
+        lookup = doc.xref_stream(lookup) if isinstance(lookup, _PdfRef) else bytes(lookup)
+        size = (int(cs[2]) + 1) * _COLOR_COMPONENTS[base]
+        return [family, "/DeviceGray", cs[2], _gray_samples(lookup[:size].ljust(size, b"\0"), base).tobytes()]
+    if family in ("/Separation", "/DeviceN") and len(cs) >= 4:
+        alt = _colorspace_kind(doc, cs[2])
+        if alt not in _GRAY_FORMULAS or alt == "gray":
+            return None
+        tint = _gray_function(doc, cs[3], alt, cache)
+        return None if tint is None else [family, cs[1], "/DeviceGray", tint] + cs[4:]
+    if family == "/Pattern" and len(cs) == 2:
+        base = _colorspace_kind(doc, cs[1])
+        if base in _GRAY_FORMULAS and base != "gray":
+            return ["/Pattern", "/DeviceGray"]
+    return None
+
+def _gray_mesh(shading, data, kind):
+    """ממיר את צבעי הקודקודים של הצללת רשת (סוגים 4-7) לרכיב אפור אחד. רק שדות ברוחב של בתים שלמים"""
+    stype = shading.get("/ShadingType")
+    n = _COLOR_COMPONENTS[kind]
+    bpf = shading.get("/BitsPerFlag", 8) if stype != 5 else 0
+    bpc = shading.get("/BitsPerCoordinate", 0)
+    bpcomp = shading.get("/BitsPerComponent", 0)
+    decode = shading.get("/Decode", [])
+    if any(bits % 8 for bits in (bpf, bpc, bpcomp)) or not bpc or not bpcomp or len(decode) < 4 + 2 * n:
+        return None
+    flag_len, coord_len, comp_len = bpf // 8, 2 * bpc // 8, bpcomp // 8
+    top = float(2 ** bpcomp - 1)
+
+    def gray_color(chunk):
+        raw = [int.from_bytes(chunk[i * comp_len:(i + 1) * comp_len], "big") for i in range(n)]
+        values = [decode[4 + 2 * i] + raw[i] / top * (decode[5 + 2 * i] - decode[4 + 2 * i]) for i in range(n)]
+        return int(round(_to_gray(kind, values) * top)).to_bytes(comp_len, "big")
+
+    out = []
+    pos = 0
+    while True:
+        flag = data[pos:pos + flag_len]
+        first = int.from_bytes(flag, "big") == 0 if flag_len else True
+        if stype in (4, 5):
+            points, colors = 1, 1
+        else:
+            points = (12 if stype == 6 else 16) if first else (8 if stype == 6 else 12)
+            colors = 4 if first else 2
+        size = flag_len + points * coord_len + colors * n * comp_len
+        if pos + size > len(data):
+            break
+        head = pos + flag_len + points * coord_len
+        out.append(data[pos:head])
+        for c in range(colors):
+            out.append(gray_color(data[head + c * n * comp_len:head + (c + 1) * n * comp_len]))
+        pos += size
+    return b"".join(out)
+
+def _gray_shading(doc, shading, data, cache):
+    """
+    מחזיר את המפתחות שיש לשנות בהצללה (ColorSpace, Function, Background, Decode) ואת הנתונים החדשים
+    של רשת ללא פונקציה; None אם אין מה להמיר או שההמרה לא נתמכת.
+    """
+    kind = _colorspace_kind(doc, shading.get("/ColorSpace"))
+    if kind not in _GRAY_FORMULAS or kind == "gray":
+        return None
+    changes = {"/ColorSpace": "/DeviceGray"}
+    background = _pdf_resolve(doc, shading.get("/Background"))
+    if isinstance(background, list) and len(background) == _COLOR_COMPONENTS[kind]:
+        changes["/Background"] = [_to_gray(kind, background)]
+    if "/Function" in shading:
+        fn = _gray_function(doc, shading["/Function"], kind, cache)
+        if fn is None:
+            return None
+        changes["/Function"] = fn
+        return changes, None
+    if data is None:
+        return None
+    mesh = _gray_mesh(shading, data, kind)
+    if mesh is None:
+        return None
+    changes["/Decode"] = shading["/Decode"][:4] + [0, 1]
+    return changes, mesh
+
+def _inline_image_to_gray(stream, start, colorspace):
+    """
+    ממיר תמונת inline (החל מ-BI) לאפור אם היא RGB/CMYK ב-8 ביט, לא דחוסה או ב-Flate.
+    מחזיר (בתים חלופיים או None, מיקום הסוף שאחרי EI).
+    """
+    tokens = _pdf_tokens(stream, start + 2)
+    data_start = None
+    for kind, token, _, end in tokens:
+        if kind == "op" and token == b"ID":
+            data_start = end + 1
+            header = stream[start + 2:end - 2]
+            break
+    if data_start is None:
+        return None, len(stream)
+    params = _pdf_parse(b"<<" + header + b">>") or {}
+
+    def param(*keys):
+        return next((params[k] for k in keys if k in params), None)
+
+    width, height = param("/W", "/Width"), param("/H", "/Height")
+    cs, filters = param("/CS", "/ColorSpace"), param("/F", "/Filter")
+    kind = colorspace(cs)[0] if isinstance(cs, str) else None
+    filters = filters if isinstance(filters, list) else [filters] if filters else []
+    length = None
+    if not filters and kind in _COLOR_COMPONENTS and param("/BPC", "/BitsPerComponent") == 8 and width and height:
+        length = width * _COLOR_COMPONENTS[kind] * height
+    end_match = None
+    if length is not None:
+        end_match = _PDF_INLINE_END.match(stream, data_start + length)
+        end_match = end_match or re.compile(rb"[" + _PDF_WS + rb"]*EI").match(stream, data_start + length)
+    end_match = end_match or _PDF_INLINE_END.search(stream, data_start)
+    if end_match is None:
+        return None, len(stream)
+    end = end_match.end()
+    if (kind not in _GRAY_FORMULAS or kind == "gray" or param("/IM", "/ImageMask")
+            or param("/BPC", "/BitsPerComponent") != 8 or param("/D", "/Decode") or param("/DP", "/DecodeParms")
+            or any(f not in ("/Fl", "/FlateDecode") for f in filters) or not width or not height):
+        return None, end
+    data = stream[data_start:end_match.start()]
+    if filters:
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            return None, end
+    size = width * height * _COLOR_COMPONENTS[kind]
+    if len(data) < size:
+        return None, end
+    gray = _gray_samples(data[:size], kind).tobytes()
+    return b"BI /W %d /H %d /CS /G /BPC 8 ID " % (width, height) + gray + b"\nEI", end
+
+def _device_colorspace(name):
+    return _COLORSPACE_KINDS.get(name, name), None
+
+def _content_to_gray(stream, colorspace=None, state=None, stats=None):
+    """
+    ממיר את פקודות הצבע בזרם תוכן לאפור: rg/RG/k/K הופכות ל-g/G, ו-cs/CS במרחבי RGB/CMYK/Lab/ICC
+    הופכות ל-DeviceGray יחד עם רכיבי sc/scn/SC/SCN שאחריהן (גם לפני שם של Pattern לא צבעוני).
+    colorspace(name) מחזיר (סוג, סוג הבסיס של Pattern) לשם משאב; state נמשך בין חלקי התוכן של עמוד.
+    """
+    if not _COLOR_OPERATORS.search(stream):
+        return stream
+    colorspace = colorspace or _device_colorspace
+    state = state if state is not None else {}
+    state.setdefault("fill", ("gray", None))
+    state.setdefault("stroke", ("gray", None))
+    stack = state.setdefault("stack", [])
+    stats = stats if stats is not None else {}
+    out = []
+    emit = pos = 0
+    while True:
+        m = _COLOR_CONTENT.search(stream, pos)
+        if m is None:
+            break
+        pos = m.end()
+        if m.lastgroup == "string":
+            pos = _pdf_string_end(stream, pos)
+            continue
+        if m.lastgroup != "op":
+            continue
+        token = m.group("op")
+        operands = m.group("operands").split()
+        numbers = [float(v) for v in operands if not v.startswith(b"/")]
+        plain = len(numbers) == len(operands)
+        stroke = token.isupper()
+        target = "stroke" if stroke else "fill"
+        replacement = None
+        if token == b"q":
+            stack.append((state["fill"], state["stroke"]))
+        elif token == b"Q":
+            if stack:
+                state["fill"], state["stroke"] = stack.pop()
+        elif token in (b"g", b"G"):
+            state[target] = ("gray", None)
+        elif token in (b"rg", b"RG", b"k", b"K"):
+            space = "rgb" if token in (b"rg", b"RG") else "cmyk"
+            state[target] = (space, None)
+            if plain and len(numbers) == _COLOR_COMPONENTS[space]:
+                replacement = b"%s %s" % (_pdf_number(_to_gray(space, numbers)).encode(), b"G" if stroke else b"g")
+        elif token in (b"cs", b"CS") and operands and operands[-1].startswith(b"/"):
+            state[target] = colorspace(operands[-1].decode("latin-1"))
+            if state[target][0] in _GRAY_FORMULAS and operands[-1] != b"/DeviceGray":
+                replacement = b"/DeviceGray " + token
+        elif token in (b"sc", b"scn", b"SC", b"SCN"):
+            space, base = state[target]
+            if space in _GRAY_FORMULAS and space != "gray" and plain and len(numbers) == _COLOR_COMPONENTS[space]:
+                replacement = b"%s %s" % (_pdf_number(_to_gray(space, numbers)).encode(), token)
+            elif (space == "/Pattern" and base in _GRAY_FORMULAS and base != "gray" and operands
+                  and operands[-1].startswith(b"/") and len(numbers) == len(operands) - 1 == _COLOR_COMPONENTS[base]):
+                replacement = b"%s %s %s" % (_pdf_number(_to_gray(base, numbers)).encode(), operands[-1], token)
+        elif token == b"BI":
+            # נתוני התמונה אינם אסימונים - ממשיכים לסרוק מאחרי EI
+            replacement, pos = _inline_image_to_gray(stream, m.start("op"), colorspace)
+            if replacement is not None:
+                stats["inline_images"] = stats.get("inline_images", 0) + 1
+                out.append(stream[emit:m.start("op")])
+                out.append(replacement)
+                emit = pos
+            continue
+        if replacement is not None:
+            stats["operators"] = stats.get("operators", 0) + 1
+            out.append(stream[emit:m.start("operands")])
+            out.append(replacement)
+            emit = m.end()
+    out.append(stream[emit:])
+    return b"".join(out)
+
+def _resource_colorspaces(doc, xref):
+    """מחזיר {שם: הגדרה} של מרחבי הצבע במשאבים של עמוד, Form או Pattern (כולל ירושה בעץ העמודים)"""
+    while xref:
+        kind, value = doc.xref_get_key(xref, "Resources")
+        if kind != "null":
+            spaces = _pdf_resolve(doc, _pdf_resolve(doc, _pdf_parse(value)).get("/ColorSpace"))
+            return spaces if isinstance(spaces, dict) else {}
+        kind, value = doc.xref_get_key(xref, "Parent")
+        xref = int(value.split()[0]) if kind == "xref" else 0
+    return {}
+
+def _content_colorspace(doc, spaces):
+    cache = {}
+
+    def colorspace(name):
+        if name not in cache:
+            cs = spaces.get(name, name)
+            kind = _colorspace_kind(doc, cs)
+            base = None
+            if kind == "/Pattern":
+                resolved = _pdf_resolve(doc, cs)
+                if isinstance(resolved, list) and len(resolved) > 1:
+                    base = _colorspace_kind(doc, resolved[1])
+            cache[name] = (kind, base)
+        return cache[name]
+
+    return colorspace
+
+def _key_path(path, name):
+    """
+    נתיב ל-xref_set_key מנתיב קיים ושם PDF ('/Name'). קודי #xx מפוענחים, כי xref_set_key מקבל את השם
+    עצמו; None אם השם מכיל '/' ולכן לא ניתן לכתוב אותו כחלק מנתיב.
+    """
+    name = re.sub(r"#([0-9A-Fa-f]{2})", lambda m: chr(int(m.group(1), 16)), name[1:])
+    if "/" in name:
+        return None
+    return f"{path}/{name}" if path else name
+
+def _xref_set_path(doc, xref, path, value):
+    """
+    xref_set_key לנתיב ('Resources/ColorSpace/CS0'). PyMuPDF לא כותב דרך הפניה עקיפה באמצע הנתיב,
+    ולכן בכל הפניה כזו עוברים לאובייקט שהיא מצביעה עליו וממשיכים משם עם שארית הנתיב.
+    """
+    *parents, last = path.split("/")
+    prefix = []
+    for part in parents:
+        kind, ref = doc.xref_get_key(xref, "/".join(prefix + [part]))
+        if kind == "xref":
+            xref, prefix = int(ref.split()[0]), []
+        else:
+            prefix.append(part)
+    doc.xref_set_key(xref, "/".join(prefix + [last]), value)
+
+def convert_pdf_to_gray(input_path, output_path):
+    """
+    המרה לגווני אפור בתוך התהליך, בארבעה מעברים:
+    1. זרמי התוכן של העמודים, ה-Form XObjects וה-Tiling Patterns (ראו _content_to_gray).
+    2. הגדרות מרחבי Indexed/Separation/DeviceN/Pattern - בקובץ ובמילוני המשאבים.
+    3. הצללות: הפונקציה (סוגים 0/2/3/4) או צבעי הקודקודים של רשת מומרים, והמרחב הופך ל-DeviceGray.
+    4. תמונות מוטמעות מומרות ל-DeviceGray (ה-SMask נשמר); color key (‏/Mask כמערך) הופך ל-SMask.
+    מבנים שלא נתמכים נשארים בצבע: פונקציה מסוג 0 שאינה 8/16 ביט, רשת עם שדות שאינם בתים שלמים,
+    תמונת inline דחוסה שאינה Flate וגליפים צבעוניים של גופני Type3. הצללות כאלה נספרות ב-"unsupported".
+    מחזיר מונים שנרשמים באירוע grayscale.
+    """
+    doc = fitz.open(input_path)
+    stats = {"unsupported": 0}
+    cache = {}
+
+    def count(key, amount=1):
+        stats[key] = stats.get(key, 0) + amount
+
+    contents = [(page.get_contents(), page.xref) for page in doc]
+    for xref in range(1, doc.xref_length()):
+        if (doc.xref_get_key(xref, "Subtype") == ("name", "/Form")
+                or doc.xref_get_key(xref, "PatternType") == ("int", "1")):
+            contents.append(([xref], xref))
+    for xrefs, owner in contents:
+        colorspace = _content_colorspace(doc, _resource_colorspaces(doc, owner))
+        state = {}
+        for xref in xrefs:
+            stream = doc.xref_stream(xref)
+            if stream:
+                gray_stream = _content_to_gray(stream, colorspace, state, stats)
+                if gray_stream != stream:
+                    doc.update_stream(xref, gray_stream)
+
+    def convert_spaces(xref, path, spaces):
+        # רק הרשומות שהומרו נכתבות, כל אחת במקומה; שאר המילון לא נוגע
+        for name, cs in spaces.items():
+            gray = _gray_colorspace(doc, cs, cache)
+            if gray is None:
+                continue
+            key = _key_path(path, name)
+            if key is None:
+                count("unsupported")
+                continue
+            _xref_set_path(doc, xref, key, _pdf_serialize(gray))
+            count("colorspaces")
+
+    indirect_spaces = set()
+    for xref in range(1, doc.xref_length()):
+        text = doc.xref_object(xref, compressed=True)
+        if text.startswith("["):
+            gray = _gray_colorspace(doc, _pdf_parse(text), cache)
+            if gray is not None:
+                doc.update_object(xref, _pdf_serialize(gray))
+                count("colorspaces")
+        for key in ("ColorSpace", "Resources/ColorSpace"):
+            kind, value = doc.xref_get_key(xref, key)
+            if kind == "array":
+                gray = _gray_colorspace(doc, _pdf_parse(value), cache)
+                if gray is not None:
+                    _xref_set_path(doc, xref, key, _pdf_serialize(gray))
+                    count("colorspaces")
+            elif kind == "dict":
+                convert_spaces(xref, key, _pdf_parse(value))
+            elif kind == "xref" and doc.xref_object(int(value.split()[0]), compressed=True).startswith("<<"):
+                indirect_spaces.add(int(value.split()[0]))
+    for xref in indirect_spaces:
+        if not doc.xref_is_stream(xref):
+            convert_spaces(xref, "", _pdf_parse(doc.xref_object(xref, compressed=True)))
+
+    def convert_shading(shading, data=None):
+        kind = _colorspace_kind(doc, shading.get("/ColorSpace"))
+        if kind not in _GRAY_FORMULAS or kind == "gray":
+            return None
+        result = _gray_shading(doc, shading, data, cache)
+        count("shadings" if result else "unsupported")
+        return result
+
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "ShadingType")[0] != "null":
+            shading = _pdf_parse(doc.xref_object(xref, compressed=True))
+            result = convert_shading(shading, doc.xref_stream(xref) if doc.xref_is_stream(xref) else None)
+            if result:
+                changes, mesh = result
+                if mesh is not None:
+                    doc.update_stream(xref, mesh)
+                for key, value in changes.items():
+                    doc.xref_set_key(xref, key[1:], _pdf_serialize(value))
+        for key in ("Shading", "Resources/Shading"):
+            kind, value = doc.xref_get_key(xref, key)
+            if kind != "dict":
+                continue
+            shadings = _pdf_parse(value)
+            # מפתח Shading של Pattern מכיל את ההצללה עצמה; במשאבים - מילון של הצללות לפי שם
+            direct = {None: shadings} if "/ShadingType" in shadings else shadings
+            for name, shading in direct.items():
+                result = convert_shading(shading) if isinstance(shading, dict) else None
+                path = key if name is None else _key_path(key, name)
+                if result and path:
+                    for change, change_value in result[0].items():
+                        _xref_set_path(doc, xref, f"{path}/{change[1:]}", _pdf_serialize(change_value))
+                elif result:
+                    count("unsupported")
+
+    for xref in range(1, doc.xref_length()):
+        if doc.xref_get_key(xref, "Subtype") != ("name", "/Image"):
+            continue
+        pix = fitz.Pixmap(doc, xref)
+        if pix.colorspace is None or pix.colorspace.n == 1:
+            continue
+        if pix.alpha:
+            if doc.xref_get_key(xref, "Mask")[0] == "array" and doc.xref_get_key(xref, "SMask")[0] == "null":
+                # ה-color key מתייחס לערכי הצבע המקוריים, ולכן נשמר כ-SMask שנגזר מהשקיפות שחושבה
+                alpha = np.frombuffer(pix.samples, np.uint8)[pix.n - 1::pix.n]
+                smask = _new_stream_object(doc, {
+                    "/Type": "/XObject", "/Subtype": "/Image", "/Width": pix.width, "/Height": pix.height,
+                    "/ColorSpace": "/DeviceGray", "/BitsPerComponent": 8}, alpha.tobytes())
+                doc.xref_set_key(xref, "SMask", _pdf_serialize(smask))
+                count("masks")
+            pix = fitz.Pixmap(pix, 0)
+        if doc.xref_get_key(xref, "Mask")[0] == "array":
+            doc.xref_set_key(xref, "Mask", "null")
+        gray = fitz.Pixmap(fitz.csGRAY, pix)
+        # החלפת הזרם במקום: ה-SMask ושאר ההפניות לתמונה נשארים כמו שהם
+        if doc.xref_get_key(xref, "Filter")[1] == "/DCTDecode":
+            doc.update_stream(xref, gray.tobytes("jpeg"), compress=False)
+            doc.xref_set_key(xref, "Filter", "/DCTDecode")
+        else:
+            doc.update_stream(xref, gray.samples, compress=True)
+        doc.xref_set_key(xref, "ColorSpace", "/DeviceGray")
+        doc.xref_set_key(xref, "BitsPerComponent", "8")
+        doc.xref_set_key(xref, "DecodeParms", "null")
+        doc.xref_set_key(xref, "Decode", "null")
+        count("images")
+        pix = gray = None
+    doc.save(output_path, garbage=3, deflate=True)
+    doc.close()
+    return stats
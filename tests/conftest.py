@@ -0,0 +1,92 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import fitz
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _isolated_app(tmp_path, monkeypatch):
+    """כל בדיקה עם מאגר תוצרים משלה, בלי יומן מדידות, ומתיקיית הפרויקט (שם נמצאות start.png / end.png)"""
+    monkeypatch.chdir(ROOT)
+    monkeypatch.setattr(app, "PROFILE_LOG", "off")
+    monkeypatch.setattr(app, "RESULT_CACHE_DIR", str(tmp_path / "result_cache"))
+    monkeypatch.setattr(app, "CONFIG_CACHE_FILE", str(tmp_path / "result_cache" / ".config.json"))
+    monkeypatch.setattr(app, "AUTO_CURRENT_FILE", str(tmp_path / "result_cache" / ".auto_current.json"))
+    monkeypatch.setattr(app, "AUTO_LOCK_FILE", str(tmp_path / "result_cache" / ".auto_build.lock"))
+
+
+@pytest.fixture
+def store_entry(tmp_path):
+    """
+    store_entry(key, title=None) שומר רשומה במאגר התוצרים ומחזיר את הנתיבים שלה. כל גרסה היא PDF
+    של עמוד אחד עם הטקסט "<title> <variant>", כך שאפשר לזהות מאיזו רשומה הגיע קובץ.
+    """
+    def put(key, title=None):
+        outputs = {}
+        for variant in app.RESULT_VARIANTS:
+            outputs[variant] = str(tmp_path / f"{key}_{variant}.pdf")
+            with fitz.open() as doc:
+                doc.new_page().insert_text((50, 50), f"{title or key} {variant}")
+                doc.save(outputs[variant])
+        return app.result_cache_put(key, outputs)
+    return put
+
+
+@pytest.fixture(scope="session")
+def matchers():
+    return app.MarkerMatcher.from_file(os.path.join(ROOT, "start.png")), app.MarkerMatcher.from_file(os.path.join(ROOT, "end.png"))
+
+
+class StubServer:
+    """
+    שרת HTTP מקומי במקום JSONBin / גוגל דרייב. כל בקשה נרשמת ב-requests כ-(method, path, headers, body)
+    ונענית ע"י handler(method, path, headers, body) -> (status, headers, body). Content-Length שנקבע
+    ב-headers נשלח כמו שהוא, כך שתשובה עם גוף קצר ממנו מדמה חיבור שנקטע.
+    """
+    def __init__(self):
+        self.requests = []
+        self.handler = lambda method, path, headers, body: (404, {}, b"")
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                stub.requests.append((self.command, self.path, dict(self.headers), body))
+                status, headers, payload = stub.handler(self.command, self.path, self.headers, body)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                if "Content-Length" not in headers:
+                    self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                self.close_connection = True
+
+            do_GET = do_PUT = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
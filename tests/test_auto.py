@@ -0,0 +1,17 @@
+import app
+
+
+def test_session_keeps_the_issue_it_was_given(store_entry, monkeypatch):
+    monkeypatch.setattr(app, "start_auto_scheduler", lambda: None)
+    old = store_entry("a" * 32, "old")
+    new = store_entry("b" * 32, "new")
+
+    app._publish_auto_issue("a" * 32, "old.pdf", 1)
+    success, _, title, key = app.prepare_auto_pdf()
+    assert (success, title, key) == (True, "old.pdf", "a" * 32)
+
+    app._publish_auto_issue("b" * 32, "new.pdf", 2)
+    # הסשן ממשיך לקבל את הקבצים של הגיליון שהוצג לו, והגיליון הקודם נשאר נעוץ
+    assert app.get_auto_outputs({"key": key}) == old
+    assert app.get_auto_outputs() == new
+    assert {"a" * 32, "b" * 32} <= app._result_cache_pinned_keys(0)
@@ -0,0 +1,35 @@
+import os
+
+import app
+import batch
+
+
+def _done_entry(job, key):
+    return {"id": job["id"], "kind": job["kind"], "status": "done", "key": key,
+            "pipeline_version": app.PIPELINE_VERSION, "input_signature": batch._input_signature(job)}
+
+
+def test_done_job_is_rerun_when_its_entry_was_evicted(tmp_path, store_entry):
+    source = tmp_path / "issue.pdf"
+    source.write_bytes(b"%PDF-1.4\n")
+    job = batch.collect_jobs([str(source)], [])[0]
+    entry = _done_entry(job, "abc")
+    assert not batch._is_done(job, entry)
+
+    paths = store_entry("abc")
+    assert batch._is_done(job, entry)
+    # עם --out צריך גם את הקבצים המיוצאים
+    assert not batch._is_done(job, entry, str(tmp_path / "out"))
+
+    os.remove(paths["cut_bw"])
+    assert not batch._is_done(job, entry)
+
+
+def test_batch_refs_outlive_session_refs(store_entry, monkeypatch):
+    store_entry("batch-entry")
+    app.result_cache_add_ref("batch-entry", batch.BATCH_REF_OWNER, ttl_seconds=batch.BATCH_KEEP_DAYS * 86400)
+    store_entry("session-entry")
+    app.result_cache_add_ref("session-entry", "session")
+    monkeypatch.setattr(app, "RESULT_REF_TTL_SECONDS", -1)
+
+    assert app._result_cache_pinned_keys(app.time.time()) == {"batch-entry"}
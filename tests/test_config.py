@@ -0,0 +1,76 @@
+import json
+import threading
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def jsonbin(stub_server, monkeypatch):
+    """JSONBin מדומה עם מצב הגדרות נקי (בלי עותק בזיכרון ובלי קובץ מקומי)"""
+    monkeypatch.setattr(app, "JSONBIN_BASE_URL", stub_server.url)
+    monkeypatch.setattr(app.st, "secrets", {"JSONBIN_BIN_ID": "bin", "JSONBIN_API_KEY": "key"})
+    monkeypatch.setattr(app, "_config_state", {"record": None, "fetched_at": 0.0, "dirty": False})
+    monkeypatch.setattr(app, "_config_refreshing", threading.Event())
+    return stub_server
+
+
+def _wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return
+        time.sleep(0.05)
+    raise AssertionError("condition not reached")
+
+
+def _cached():
+    with open(app.CONFIG_CACHE_FILE, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_save_is_written_behind_and_retried(jsonbin):
+    puts = []
+
+    def handler(method, path, headers, body):
+        if method == "PUT":
+            puts.append(json.loads(body))
+            # הכתיבה הראשונה נכשלת, השנייה מצליחה
+            return (503 if len(puts) == 1 else 200), {}, b"{}"
+        stored = puts[-1] if len(puts) > 1 else {}
+        return 200, {"Content-Type": "application/json"}, json.dumps({"record": stored}).encode()
+    jsonbin.handler = handler
+
+    app.save_config({"last_issue": "42"})
+    # השמירה לא מחכה לענן: העותק המקומי כבר מעודכן ומסומן כממתין
+    assert app.get_config() == {"last_issue": "42"}
+    assert _cached() == {"record": {"last_issue": "42"}, "dirty": True}
+
+    _wait_until(lambda: not app._config_state["dirty"])
+    assert puts == [{"last_issue": "42"}, {"last_issue": "42"}]
+    assert all(path == "/bin" and headers["X-Master-Key"] == "key" for method, path, headers, _ in jsonbin.requests if method == "PUT")
+    assert _cached() == {"record": {"last_issue": "42"}, "dirty": False}
+
+
+def test_offline_jsonbin_falls_back_to_local_copy(jsonbin, tmp_path):
+    jsonbin.handler = lambda method, path, headers, body: (503, {}, b"")
+
+    # בלי עותק מקומי: קריאה אחת שנכשלת, ואז ברירות מחדל
+    assert app.get_config() == {}
+
+    # עם עותק מקומי (כולל שינוי שלא הגיע לענן בהפעלה הקודמת): הוא מוחזר, והשינוי נשלח שוב ברקע
+    app._config_state.update(record=None, fetched_at=0.0, dirty=False)
+    (tmp_path / "result_cache").mkdir(exist_ok=True)
+    with open(app.CONFIG_CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump({"record": {"last_issue": "41"}, "dirty": True}, f)
+    jsonbin.requests.clear()
+    jsonbin.handler = lambda method, path, headers, body: ((200, {}, b"{}") if method == "PUT" else (503, {}, b""))
+
+    assert app.get_config() == {"last_issue": "41"}
+    _wait_until(lambda: not app._config_state["dirty"])
+    assert [json.loads(body) for method, _, _, body in jsonbin.requests if method == "PUT"] == [{"last_issue": "41"}]
+    # הרענון ברקע נכשל, אבל ההגדרות המקומיות נשארות
+    _wait_until(lambda: not app._config_refreshing.is_set())
+    assert app.get_config() == {"last_issue": "41"}
@@ -0,0 +1,121 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+import app
+
+PDF = b"%PDF-1.4\n" + bytes(range(256)) * 400 + b"\n%%EOF\n"
+
+
+@pytest.fixture
+def drive(stub_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DRIVE_DOWNLOAD_URL", f"{stub_server.url}/download")
+    monkeypatch.setattr(app, "DRIVE_DOWNLOAD_DIR", str(tmp_path / "drive"))
+    monkeypatch.setattr(app, "DRIVE_CHUNK_SIZE", 1024)
+    return stub_server
+
+
+def _pdf_response(headers):
+    """PDF מלא, או ההמשך שלו כשיש Range עם If-Range תואם"""
+    common = {"Content-Type": "application/pdf", "ETag": '"v1"',
+              "Content-Disposition": "attachment; filename*=UTF-8''%D7%92%D7%99%D7%9C%D7%99%D7%95%D7%9F.pdf"}
+    start = headers.get("Range", "bytes=0-")[len("bytes="):].rstrip("-")
+    if int(start) and headers.get("If-Range") == '"v1"':
+        return 206, {**common, "Content-Range": f"bytes {start}-{len(PDF) - 1}/{len(PDF)}"}, PDF[int(start):]
+    return 200, common, PDF
+
+
+def test_interrupted_download_resumes_from_the_cut(drive):
+    cut = 32 * app.DRIVE_CHUNK_SIZE
+
+    def handler(method, path, headers, body):
+        status, response_headers, payload = _pdf_response(headers)
+        if len(drive.requests) == 1:
+            # החיבור הראשון נקטע באמצע הקובץ
+            return status, {**response_headers, "Content-Length": str(len(PDF))}, payload[:cut]
+        return status, response_headers, payload
+    drive.handler = handler
+
+    path, filename = app.download_drive_file("abc_1")
+    with open(path, "rb") as f:
+        assert f.read() == PDF
+    assert filename == "גיליון.pdf"
+    assert len(drive.requests) == 2
+    resumed = drive.requests[1][2]
+    assert resumed["Range"] == f"bytes={cut}-" and resumed["If-Range"] == '"v1"'
+    assert not os.path.exists(os.path.join(app.DRIVE_DOWNLOAD_DIR, "abc_1.part"))
+
+
+def test_html_instead_of_pdf_is_rejected(drive):
+    drive.handler = lambda method, path, headers, body: (
+        200, {"Content-Type": "text/html; charset=utf-8"}, b"<html><body>Sign in</body></html>")
+    with pytest.raises(app.DriveDownloadError):
+        app.download_drive_file("blocked")
+
+    drive.handler = lambda method, path, headers, body: (200, {"Content-Type": "application/octet-stream"}, b"<html>" * 100)
+    with pytest.raises(app.DriveDownloadError):
+        app.download_drive_file("not_a_pdf")
+    # לא נשאר חלק של קובץ פגום שההורדה הבאה "תמשיך" ממנו
+    assert not [name for name in os.listdir(app.DRIVE_DOWNLOAD_DIR) if ".part" in name]
+
+
+def test_oversized_file_is_rejected_before_the_download_finishes(drive):
+    limit = len(PDF) // 2
+    drive.handler = lambda method, path, headers, body: _pdf_response(headers)
+    with pytest.raises(app.DriveFileTooLarge):
+        app.download_drive_file("big_declared", max_bytes=limit)
+
+    # בלי גודל שאפשר לסמוך עליו (תשובה מקודדת) ההורדה נעצרת ברגע שעברה את המגבלה
+    drive.handler = lambda method, path, headers, body: (
+        200, {"Content-Type": "application/pdf", "Content-Encoding": "identity"}, PDF)
+    with pytest.raises(app.DriveFileTooLarge):
+        app.download_drive_file("big_streamed", max_bytes=limit)
+    assert not [name for name in os.listdir(app.DRIVE_DOWNLOAD_DIR) if not name.endswith(".lock")]
+
+    path, _ = app.download_drive_file("big_declared", max_bytes=len(PDF))
+    assert os.path.getsize(path) == len(PDF)
+
+
+def test_repeated_id_is_downloaded_once(drive):
+    def handler(method, path, headers, body):
+        # תשובה איטית, כך שכל הבקשות המקבילות מגיעות בזמן שההורדה הראשונה עוד רצה
+        time.sleep(0.3)
+        return _pdf_response(headers)
+    drive.handler = handler
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app.download_drive_file("same_id"))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.append(app.download_drive_file("same_id"))
+
+    assert len(drive.requests) == 1
+    assert len(set(results)) == 1
+
+
+def _download_in_job_child(file_id):
+    app._reset_after_fork()
+    app.download_drive_file(file_id)
+
+
+def test_job_child_and_scheduler_thread_download_once(drive):
+    def handler(method, path, headers, body):
+        time.sleep(0.3)
+        return _pdf_response(headers)
+    drive.handler = handler
+
+    # תהליך עבודה (fork) ותהליכון התזמון של השרת מורידים את אותו קובץ באותו זמן
+    child = multiprocessing.get_context("fork").Process(target=_download_in_job_child, args=("shared_id",))
+    child.start()
+    path, _ = app.download_drive_file("shared_id")
+    child.join(timeout=30)
+
+    assert child.exitcode == 0
+    assert len(drive.requests) == 1
+    with open(path, "rb") as f:
+        assert f.read() == PDF
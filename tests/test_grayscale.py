@@ -0,0 +1,138 @@
+import struct
+
+import fitz
+import numpy as np
+
+import grayscale
+
+
+def _object(doc, text, stream=None):
+    xref = doc.get_new_xref()
+    doc.update_object(xref, text)
+    if stream is not None:
+        doc.update_stream(xref, stream, new=True)
+    return xref
+
+
+def _color_sample(path):
+    """עמוד אחד עם כל משפחות הצבע: Device/ICC/Lab, Separation/DeviceN/Indexed, הצללות, תבניות ותמונות"""
+    doc = fitz.open()
+    page = doc.new_page(width=300, height=300)
+    icc = _object(doc, "<< /N 3 /Alternate /DeviceRGB >>", b"not a real profile")
+    tint = _object(doc, "<< /FunctionType 2 /Domain [0 1] /C0 [1 1 1] /C1 [1 0.5 0] /N 1 >>")
+    tint_ps = _object(doc, "<< /FunctionType 4 /Domain [0 1] /Range [0 1 0 1 0 1 0 1] >>", b"{ 0 0 3 -1 roll 0 }")
+    tint_n = _object(doc, "<< /FunctionType 4 /Domain [0 1 0 1] /Range [0 1 0 1 0 1 0 1] >>", b"{ 0 0 }")
+    sampled = _object(doc, "<< /FunctionType 0 /Domain [0 1] /Range [0 1 0 1 0 1] /Size [3] /BitsPerSample 8 >>",
+                      bytes([255, 0, 0, 0, 255, 0, 0, 0, 255]))
+    stitched = _object(doc, f"<< /FunctionType 3 /Domain [0 1] /Functions [{tint} 0 R << /FunctionType 2 /Domain [0 1]"
+                            f" /C0 [0 1 0] /C1 [0 0 1] /N 1 >>] /Bounds [0.5] /Encode [0 1 0 1] >>")
+    axial = _object(doc, "<< /ShadingType 2 /ColorSpace /DeviceRGB /Coords [10 0 90 0] /Function << /FunctionType 2"
+                         " /Domain [0 1] /C0 [1 0 0] /C1 [0 0 1] /N 1 >> /Extend [true true] >>")
+    axial_icc = _object(doc, f"<< /ShadingType 2 /ColorSpace [/ICCBased {icc} 0 R] /Coords [100 0 190 0] /Function {sampled} 0 R >>")
+    radial = _object(doc, f"<< /ShadingType 3 /ColorSpace /DeviceRGB /Coords [245 50 0 245 50 40] /Function {stitched} 0 R >>")
+    vertices = [(10, 110, (255, 0, 0)), (90, 110, (0, 255, 0)), (50, 190, (0, 0, 255))]
+    mesh = _object(doc, "<< /ShadingType 4 /ColorSpace /DeviceRGB /BitsPerCoordinate 16 /BitsPerComponent 8 /BitsPerFlag 8"
+                        " /Decode [0 300 0 300 0 1 0 1 0 1] >>",
+                   b"".join(struct.pack(">BHHBBB", 0, int(x / 300 * 65535), int(y / 300 * 65535), *c) for x, y, c in vertices))
+    shading_pattern = _object(doc, "<< /PatternType 2 /Shading << /ShadingType 2 /ColorSpace /DeviceCMYK /Coords [100 0 190 0]"
+                                   " /Function << /FunctionType 2 /Domain [0 1] /C0 [1 0 0 0] /C1 [0 1 0 0] /N 1 >> >> >>")
+    stencil_tiling = _object(doc, "<< /PatternType 1 /PaintType 2 /TilingType 1 /BBox [0 0 10 10] /XStep 10 /YStep 10"
+                                  " /Resources << >> >>", b"0 0 5 5 re f")
+    colored_tiling = _object(doc, "<< /PatternType 1 /PaintType 1 /TilingType 1 /BBox [0 0 10 10] /XStep 10 /YStep 10"
+                                  " /Resources << >> >>", b"0 0 1 rg 0 0 5 5 re f 1 0 0 0 k 5 5 5 5 re f")
+    keyed = _object(doc, "<< /Type /XObject /Subtype /Image /Width 10 /Height 10 /ColorSpace /DeviceRGB /BitsPerComponent 8"
+                         " /Mask [250 255 0 5 0 5] >>", bytes([255, 0, 0] * 50 + [0, 0, 255] * 50))
+    form = _object(doc, "<< /Type /XObject /Subtype /Form /BBox [0 0 300 300] /Resources << >> >>",
+                   b"q /DeviceRGB cs 0 0 1 sc Q 0.5 sc 200 200 20 20 re f 0 0.5 0 rg 230 200 20 20 re f")
+    font = _object(doc, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    doc.xref_set_key(page.xref, "Resources", (
+        f"<< /ColorSpace << /CSicc [/ICCBased {icc} 0 R] /CSsep [/Separation /Orange /DeviceRGB {tint} 0 R]"
+        f" /CSsep4 [/Separation /Yellow /DeviceCMYK {tint_ps} 0 R] /CSidx [/Indexed /DeviceRGB 1 <ff00000000ff>]"
+        f" /CSlab [/Lab << /WhitePoint [0.9505 1 1.089] >>] /CSdn [/DeviceN [/Cyan /Magenta] /DeviceCMYK {tint_n} 0 R]"
+        f" /CSpat [/Pattern /DeviceRGB] >>"
+        f" /Shading << /Sh0 {axial} 0 R /Sh1 {axial_icc} 0 R /Sh2 {radial} 0 R /Sh3 {mesh} 0 R >>"
+        f" /Pattern << /P0 {shading_pattern} 0 R /P1 {stencil_tiling} 0 R /P2 {colored_tiling} 0 R >>"
+        f" /XObject << /Im0 {keyed} 0 R /Fm0 {form} 0 R >> /Font << /F1 {font} 0 R >> >>"))
+    content = _object(doc, "<< >>", b"""
+q 0 0 100 100 re W n /Sh0 sh Q
+q 100 0 100 100 re W n /Sh1 sh Q
+q 200 0 100 100 re W n /Sh2 sh Q
+/Sh3 sh
+1 0 0 rg 10 260 30 30 re f
+/DeviceRGB cs 0 1 0 sc 50 260 30 30 re f
+/CSicc cs 0 0 1 scn 90 260 30 30 re f
+0 1 1 0 k 130 260 30 30 re f
+/CSsep cs 1 scn 170 260 30 30 re f
+/CSsep4 cs 0.7 scn 210 260 30 30 re f
+/CSidx cs 0 sc 250 260 20 30 re f 1 sc 270 260 20 30 re f
+/CSlab cs 50 60 -40 sc 10 220 30 30 re f
+/CSdn cs 0.8 0.3 scn 50 220 30 30 re f
+/CSpat cs 1 0 0 /P1 scn 90 220 30 30 re f
+/Pattern cs /P2 scn 130 220 30 30 re f
+0 0 1 RG 4 w 170 225 20 20 re S
+q 20 0 0 20 200 220 cm /Im0 Do Q
+BT /F1 14 Tf 0 0.6 0 rg 10 195 Td (1 0 0 rg \\(x\\) 0 0 1 RG) Tj ET
+/Pattern cs /P0 scn 100 110 90 60 re f
+q 40 0 0 20 250 220 cm BI /W 2 /H 1 /CS /RGB /BPC 8 ID \xff\x00\x00\x00\x00\xff EI Q
+q /Fm0 Do Q
+""")
+    doc.xref_set_key(page.xref, "Contents", f"{content} 0 R")
+    doc.save(path)
+    doc.close()
+
+
+def _render(path):
+    with fitz.open(path) as doc:
+        pix = doc[0].get_pixmap()
+        return np.frombuffer(pix.samples, np.uint8).reshape(pix.h, pix.w, 3).astype(float)
+
+
+def test_pymupdf_backend_leaves_no_color(tmp_path):
+    color, gray = str(tmp_path / "color.pdf"), str(tmp_path / "gray.pdf")
+    _color_sample(color)
+    stats = grayscale.convert_pdf_to_gray(color, gray)
+    assert stats["unsupported"] == 0
+
+    pixels = _render(gray)
+    assert np.abs(pixels - pixels.mean(axis=2, keepdims=True)).max() <= 2
+    # ריבוע ה-/DeviceRGB cs 0 1 0 sc: הבהירות של ירוק טהור
+    assert abs(pixels[25, 65, 0] - 0.59 * 255) <= 2
+    # הרכיב האדום של התמונה שקוף לפי ה-color key, והכחול מצויר
+    assert pixels[65, 210].min() >= 250 and pixels[75, 210, 0] < 128
+    with fitz.open(gray) as doc:
+        assert "1 0 0 rg (x) 0 0 1 RG" in doc[0].get_text()
+
+
+def test_content_to_gray_skips_strings_and_restores_state():
+    stream = b"(0 0 1 rg) Tj q /DeviceRGB cs 1 0 0 sc Q 0.5 sc [(1 0 0 RG)] TJ 0 0 1 RG"
+    assert grayscale._content_to_gray(stream) == b"(0 0 1 rg) Tj q /DeviceGray cs 0.3 sc Q 0.5 sc [(1 0 0 RG)] TJ 0.11 G"
+
+
+def test_references_keep_their_generation_number():
+    text = "<< /Alt [/ICCBased 12 3 R] /Attrs 9 2 R /Plain 4 0 R /Pair [1 2] >>"
+    obj = grayscale._pdf_parse(text)
+    assert obj["/Attrs"] == 9 and obj["/Attrs"].gen == 2
+    assert grayscale._pdf_serialize(obj) == "<</Alt [/ICCBased 12 3 R] /Attrs 9 2 R /Plain 4 0 R /Pair [1 2]>>"
+
+
+def test_converted_colorspace_is_written_without_touching_its_neighbours(tmp_path):
+    color, gray = str(tmp_path / "color.pdf"), str(tmp_path / "gray.pdf")
+    doc = fitz.open()
+    page = doc.new_page(width=100, height=100)
+    tint = _object(doc, "<< /FunctionType 2 /Domain [0 1] /C0 [1 1 1] /C1 [1 0 0] /N 1 >>")
+    resources = _object(doc, f"<< /ColorSpace << /CSsep [/Separation /Red /DeviceRGB {tint} 0 R]"
+                             " /CSkeep [/Indexed /DeviceGray 1 <00ff>] /CS#20sp /DeviceRGB >> >>")
+    doc.xref_set_key(page.xref, "Resources", f"{resources} 0 R")
+    content = _object(doc, "<< >>", b"/CSsep cs 1 scn 0 0 50 50 re f /CS#20sp cs 0 0 1 sc 50 50 50 50 re f")
+    doc.xref_set_key(page.xref, "Contents", f"{content} 0 R")
+    doc.save(color)
+    doc.close()
+
+    grayscale.convert_pdf_to_gray(color, gray)
+    with fitz.open(gray) as doc:
+        spaces = grayscale._pdf_parse(doc.xref_get_key(doc[0].xref, "Resources/ColorSpace")[1])
+    assert spaces["/CSkeep"] == ["/Indexed", "/DeviceGray", 1, b"\x00\xff"]
+    assert spaces["/CS#20sp"] == "/DeviceRGB"
+    assert spaces["/CSsep"][:3] == ["/Separation", "/Red", "/DeviceGray"]
+    pixels = _render(gray)
+    assert np.abs(pixels - pixels.mean(axis=2, keepdims=True)).max() <= 2
@@ -0,0 +1,32 @@
+import os
+import time
+
+import app
+import benchmark
+
+
+def _wait_for(job_id, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = app.job_status(job_id)
+        if status["state"] in app.JOB_FINAL_STATES:
+            return status
+        time.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_lazy_variant_is_built_by_the_job_queue(tmp_path):
+    regular = str(tmp_path / "issue.pdf")
+    benchmark.make_synthetic_issue(regular, pages=4, start_page=0, end_page=3, seed=2)
+    outputs = {variant: str(tmp_path / f"{variant}.pdf") for variant in app.RESULT_VARIANTS}
+    outputs["regular"] = regular
+
+    spec = {"kind": "variant", "outputs": outputs, "variant": "cut"}
+    job_id = app.submit_job(spec, None, None)
+    # בקשה נוספת לאותה גרסה בזמן שהיא בתור או בבנייה מצטרפת לעבודה הקיימת
+    assert app.submit_job(spec, None, None) == job_id
+
+    status = _wait_for(job_id)
+    assert status["state"] == "done", status["error"]
+    assert os.path.exists(outputs["cut"])
+    assert not os.path.exists(outputs["cut_bw"])
@@ -0,0 +1,113 @@
+import os
+import time
+
+import fitz
+
+import app
+import benchmark
+
+
+def test_embedded_scan_matches_raster_scan(tmp_path, matchers):
+    path = str(tmp_path / "issue.pdf")
+    start_page, end_page = benchmark.make_synthetic_issue(path, pages=8, start_page=2, end_page=6, seed=1)
+    with fitz.open(path) as doc:
+        assert app._scan_markers_embedded(doc, *matchers) == (start_page, end_page)
+        assert app._scan_markers_sequential(doc, *matchers, "coarse") == (start_page, end_page)
+
+
+def test_embedded_scan_ignores_images_a_page_does_not_draw(tmp_path, matchers):
+    # עמודים 0-2 מפנים למילון המשאבים של עמוד 3 (שבו סימן ההתחלה) אבל לא מציירים אותו
+    path = str(tmp_path / "issue.pdf")
+    benchmark.make_synthetic_issue(path, pages=12, start_page=3, end_page=9, seed=3)
+    doc = fitz.open(path)
+    kind, value = doc.xref_get_key(doc[3].xref, "Resources")
+    if kind == "dict":
+        xref = doc.get_new_xref()
+        doc.update_object(xref, value)
+        value = f"{xref} 0 R"
+        doc.xref_set_key(doc[3].xref, "Resources", value)
+    for page_num in range(3):
+        doc.xref_set_key(doc[page_num].xref, "Resources", value)
+    assert any(img[0] for img in doc.get_page_images(0))
+
+    assert app._scan_markers_embedded(doc, *matchers) == (3, 9)
+    assert app._scan_markers_sequential(doc, *matchers, "coarse") == (3, 9)
+    doc.close()
+
+
+def test_parallel_scan_matches_sequential(tmp_path, matchers):
+    path = str(tmp_path / "issue.pdf")
+    start_page, end_page = benchmark.make_synthetic_issue(path, pages=10, start_page=2, end_page=7, seed=4)
+    assert app._scan_markers_parallel(path, 10, *matchers, "coarse", 3, None) == (start_page, end_page)
+
+
+def test_resolve_checks_end_only_where_it_was_skipped():
+    # עמודים 0-1 נסרקו לפני שההתחלה נמצאה (הסיום לא נבדק), ועמוד 3 נסרק במקביל לעמוד 2
+    page_results = {0: (False, None), 1: (False, None), 2: (True, False), 3: (False, None), 4: (None, True)}
+    checked = []
+    assert app._resolve_marker_pages(dict(page_results), 5) is None
+    assert app._resolve_marker_pages(page_results, 5, lambda page: checked.append(page) or page == 3) == (2, 3)
+    assert checked == [3]
+
+
+def test_hung_scan_worker_falls_back_to_sequential(tmp_path, matchers, monkeypatch):
+    path = str(tmp_path / "issue.pdf")
+    start_page, end_page = benchmark.make_synthetic_issue(path, pages=6, start_page=1, end_page=4, seed=5)
+    parent = os.getpid()
+    match_page = app.MarkerMatcher.match_page
+
+    def hang_in_worker(self, raster, search_mode):
+        if os.getpid() != parent:
+            time.sleep(600)
+        return match_page(self, raster, search_mode)
+
+    monkeypatch.setattr(app.MarkerMatcher, "match_page", hang_in_worker)
+    monkeypatch.setattr(app, "MARKER_DIGEST_SCAN", False)
+    monkeypatch.setattr(app, "MARKER_SCAN_TIMEOUT_SECONDS", 1)
+    monkeypatch.setattr(app, "_available_cpus", lambda: 2)
+    scan_info = {}
+    began = time.monotonic()
+    assert app.extract_pdf_by_images(path, str(tmp_path / "out.pdf"), *matchers, workers=2, scan_info=scan_info)
+    assert (scan_info["start_page"], scan_info["end_page"]) == (start_page, end_page)
+    assert time.monotonic() - began < 60
+    strategies = [e.get("strategy") for e in app._PROFILE_EVENTS if e["stage"] == "marker_scan"]
+    assert strategies[-1] == "sequential"
+
+
+def test_scan_workers_follow_available_cpus(monkeypatch):
+    monkeypatch.setattr(app, "_available_cpus", lambda: 1)
+    assert app._marker_scan_workers(0) == 1 and app._marker_scan_workers(3) == 1
+    monkeypatch.setattr(app, "_available_cpus", lambda: 4)
+    assert app._marker_scan_workers(0) == 4 and app._marker_scan_workers(2) == 2
+
+
+def test_coarse_search_agrees_with_exhaustive(tmp_path, matchers):
+    start_matcher, end_matcher = matchers
+    for scale in (app.MARKER_SCALES[2], app.MARKER_SCALES[9]):
+        path = str(tmp_path / f"issue_{scale:.2f}.pdf")
+        benchmark.make_synthetic_issue(path, pages=5, marker_scale=scale, start_page=1, end_page=3, seed=6)
+        found = {}
+        with fitz.open(path) as doc:
+            for mode in ("coarse", "exhaustive"):
+                found[mode] = [(start_matcher.match_page(app.PageRaster(page), mode), end_matcher.match_page(app.PageRaster(page), mode))
+                               for page in doc]
+        assert found["coarse"] == found["exhaustive"], scale
+        assert [page for page, (has_start, _) in enumerate(found["coarse"]) if has_start] == [1]
+        assert [page for page, (_, has_end) in enumerate(found["coarse"]) if has_end] == [3]
+
+
+def test_hinted_scan_recovers_from_stale_or_wrong_hint(tmp_path, matchers):
+    path = str(tmp_path / "issue.pdf")
+    start_page, end_page = benchmark.make_synthetic_issue(path, pages=10, start_page=3, end_page=6, seed=7)
+    with fitz.open(path) as doc:
+        # רמז מדויק, רמז מגיליון קודם שבו הסימנים היו במקום אחר, רמז הפוך ורמז מחוץ למסמך
+        for hint in ((3, 6), (1, 8), (7, 2), (40, 55), (-5, -1)):
+            assert app._scan_markers_hinted(doc, *matchers, "coarse", hint) == (start_page, end_page), hint
+
+    # גיליון בלי סימן סיום: הרמז לא ממציא עמוד
+    empty = str(tmp_path / "no_end.pdf")
+    with fitz.open(path) as doc:
+        doc.select(range(end_page))
+        doc.save(empty)
+    with fitz.open(empty) as doc:
+        assert app._scan_markers_hinted(doc, *matchers, "coarse", (3, 6)) == (start_page, -1)
@@ -0,0 +1,36 @@
+import time
+
+import numpy as np
+
+import app
+import benchmark
+
+
+def _last_event(stage):
+    return [e for e in app._PROFILE_EVENTS if e["stage"] == stage][-1]
+
+
+def test_stage_peak_is_measured_during_the_stage():
+    with app.profile_stage("test_allocate"):
+        block = np.ones(200 * 2**20 // 8)
+        time.sleep(4 * app.PROFILE_RSS_SAMPLE_SECONDS)
+        del block
+    event = _last_event("test_allocate")
+    assert event["peak_growth_mb"] >= 150
+    assert event["peak_rss_mb"] - event["rss_mb"] >= 150
+
+    # שלב קטן אחרי שיא גדול לא יורש את השיא של חיי התהליך
+    with app.profile_stage("test_small"):
+        pass
+    event = _last_event("test_small")
+    assert event["peak_growth_mb"] < 50
+    assert "maxrss_growth_mb" not in event
+
+
+def test_scan_workers_do_not_inherit_a_held_rss_lock(tmp_path, matchers):
+    path = str(tmp_path / "issue.pdf")
+    pages = benchmark.make_synthetic_issue(path, pages=5, start_page=1, end_page=3, seed=6)
+    # כמו fork שקרה בזמן שתהליכון הדגימה מחזיק את המנעול
+    with app._RSS_WATCH_LOCK:
+        found = app._scan_markers_parallel(path, 5, *matchers, "coarse", 2, None, timeout=30)
+    assert found == pages
@@ -0,0 +1,36 @@
+import os
+
+import app
+
+
+def test_evict_survives_files_vanishing_mid_scan(store_entry, monkeypatch):
+    paths = store_entry("kept")
+    entry_dir = os.path.dirname(paths["regular"])
+    # גרסה עצלה שבבנייה, ששמה מוחלף לפני שהסריקה מגיעה אליה
+    open(os.path.join(entry_dir, "cut.pdf.1.2.tmp"), "wb").close()
+    app.result_cache_add_ref("gone", "session")
+    real_getmtime, real_getsize = os.path.getmtime, os.path.getsize
+
+    def getmtime(path):
+        if os.sep + "gone" + os.sep in path:
+            raise FileNotFoundError(path)
+        return real_getmtime(path)
+
+    def getsize(path):
+        if path.endswith(".tmp"):
+            raise FileNotFoundError(path)
+        return real_getsize(path)
+
+    monkeypatch.setattr(os.path, "getmtime", getmtime)
+    monkeypatch.setattr(os.path, "getsize", getsize)
+    app._result_cache_evict(max_bytes=1 << 30)
+    assert app.result_cache_get("kept") == paths
+
+
+def test_evict_keeps_entries_with_fresh_refs(store_entry):
+    store_entry("old")
+    app.result_cache_add_ref("old", "session")
+    store_entry("new")
+    app._result_cache_evict(max_bytes=0)
+    assert app.result_cache_get("old") is not None
+    assert app.result_cache_get("new") is None
@@ -0,0 +1,97 @@
+import os
+import threading
+
+import fitz
+import pytest
+
+import app
+import benchmark
+
+
+def _three_columns(path):
+    doc = fitz.open()
+    page = doc.new_page(width=600, height=400)
+    for col in range(3):
+        for line in range(12):
+            page.insert_text((20 + col * 200, 40 + line * 25), f"column {col} line {line}", fontsize=11, color=(1, 0, 0))
+    doc.save(path)
+    doc.close()
+
+
+def _pages(path):
+    with fitz.open(path) as doc:
+        return [(round(page.rect.width), round(page.rect.height), page.get_text()) for page in doc]
+
+
+# מלבני החיתוך (MediaBox) של split_pdf_to_columns לגיליון הסינתטי בן 4 העמודים, שלושה טורים לכל עמוד
+SYNTHETIC_COLUMN_BOXES = [
+    (384.9, 54.3, 568.0, 801.4), (195.4, 54.3, 378.0, 801.4), (5.9, 54.3, 188.0, 801.4),
+    (386.4, 55.0, 568.0, 797.4), (193.4, 55.0, 378.0, 797.4), (5.9, 54.3, 188.0, 801.4),
+    (372.4, 55.0, 568.0, 803.2), (194.9, 54.3, 378.0, 795.0), (9.4, 54.3, 188.0, 795.0),
+    (383.9, 54.3, 568.0, 801.4), (192.9, 54.3, 378.0, 801.4), (6.4, 54.3, 188.0, 801.4),
+]
+
+
+def test_split_matches_known_column_boxes(tmp_path):
+    issue, cut = str(tmp_path / "issue.pdf"), str(tmp_path / "cut.pdf")
+    # גופן Helvetica המובנה (נתיב גופן שלא קיים), כדי שהפריסה לא תהיה תלויה בגופנים של המכונה
+    benchmark.make_synthetic_issue(issue, pages=4, font_path=str(tmp_path / "no-font.ttf"))
+    app.split_pdf_to_columns(issue, cut)
+    with fitz.open(cut) as doc:
+        boxes = [tuple(page.mediabox) for page in doc]
+    assert len(boxes) == len(SYNTHETIC_COLUMN_BOXES)
+    for box, expected in zip(boxes, SYNTHETIC_COLUMN_BOXES):
+        assert box == pytest.approx(expected, abs=0.5)
+
+
+def test_cut_bw_falls_back_when_page_geometry_changed(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "GRAYSCALE_BACKEND", "pymupdf")
+    color, cut = str(tmp_path / "color.pdf"), str(tmp_path / "cut.pdf")
+    _three_columns(color)
+    app.split_pdf_to_columns(color, cut)
+
+    bw = str(tmp_path / "bw.pdf")
+    app.convert_pdf_to_bw(color, bw)
+    assert app._same_page_geometry(color, bw)
+    app.split_bw_pdf_to_columns(color, bw, str(tmp_path / "cut_bw.pdf"))
+    assert _pages(str(tmp_path / "cut_bw.pdf")) == _pages(cut)
+
+    # המרה שסובבה את העמוד (כמו AutoRotatePages של Ghostscript): מלבני החיתוך לא תקפים לעמודים שלה
+    rotated = str(tmp_path / "rotated.pdf")
+    with fitz.open(bw) as doc:
+        doc[0].set_rotation(90)
+        doc.save(rotated)
+    assert not app._same_page_geometry(color, rotated)
+    app.split_bw_pdf_to_columns(color, rotated, str(tmp_path / "cut_rotated.pdf"))
+    assert _pages(str(tmp_path / "cut_rotated.pdf")) == _pages(cut)
+
+
+def test_compact_split_is_smaller_and_reports_its_size(tmp_path):
+    color = str(tmp_path / "color.pdf")
+    _three_columns(color)
+    sizes = {}
+    for compact in (False, True):
+        path = str(tmp_path / f"cut_{compact}.pdf")
+        app.split_pdf_to_columns(color, path, compact=compact)
+        event = [e for e in app._PROFILE_EVENTS if e["stage"] == "split_save"][-1]
+        assert event["bytes"] == os.path.getsize(path) and "plain_bytes" not in event
+        sizes[compact] = event["bytes"]
+    assert sizes[True] < sizes[False]
+    assert _pages(str(tmp_path / "cut_True.pdf")) == _pages(str(tmp_path / "cut_False.pdf"))
+
+
+def test_pipeline_stage_leaves_mupdf_lock_to_previews(tmp_path):
+    color, cut = str(tmp_path / "color.pdf"), str(tmp_path / "cut.pdf")
+    _three_columns(color)
+    previews = []
+
+    def split_then_preview():
+        app.split_pdf_to_columns(color, cut)
+        # תצוגה מקדימה מסשן אחר (תהליכון אחר) באמצע השלב לא צריכה לחכות לסופו
+        preview = threading.Thread(target=lambda: previews.append(app._pdf_page_count(cut)))
+        preview.start()
+        preview.join(timeout=5)
+        return not preview.is_alive()
+
+    ok, _ = app.PipelineStage("cut", split_then_preview).run()
+    assert ok and previews == [3]